@@ -0,0 +1,3 @@
+"""
+Benchmarks and synthetic program generators for Semantic Code Browsing.
+"""
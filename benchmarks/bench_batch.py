@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Throughput benchmark for batch query mode.
+
+Writes a generated Prolog fact base to a temporary file, loads it once, then runs a list of queries
+through QueryShell.run_batch with the result cache enabled and disabled. Throughput is reported in
+queries per second.
+"""
+
+import os
+import io
+import sys
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+from benchmarks.generators import generate_fact_base
+
+
+QUERY_TEMPLATES = [
+    'find predicate/{}.',
+    'find predicate/{} where inputs:atom,atom.',
+    'find predicate/{} where inputs:atom,scalar or bodycontains:function.',
+    'find predicate/{} where bodycontains:function.',
+    'find predicate/{} where inputs:scalar.',
+]
+
+
+def generate_queries(num_queries, num_distinct, seed=0):
+    rng = random.Random(seed)
+    distinct_queries = []
+    for i in range(0, num_distinct):
+        distinct_queries.append(QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)].format(rng.randint(1, 2)))
+    return [rng.choice(distinct_queries) + '\n' for i in range(0, num_queries)]
+
+
+def time_batch(program_path, queries, result_cache_bytes):
+    with contextlib.redirect_stdout(io.StringIO()):
+        query_shell = QUERY_ENGINE.QueryShell(program_path, use_snapshots=False, result_cache_bytes=result_cache_bytes)
+    output_fp = io.StringIO()
+    with contextlib.redirect_stderr(io.StringIO()):
+        start_time = time.perf_counter()
+        query_shell.run_batch(iter(queries), output_fp)
+        elapsed = time.perf_counter() - start_time
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batch query throughput.')
+    parser.add_argument('-c', '--clauses', type=int, default=2000, help='Number of clauses in the generated program.')
+    parser.add_argument('-q', '--queries', type=int, default=500, help='Number of queries to run.')
+    parser.add_argument('-d', '--distinct', type=int, default=8, help='Number of distinct queries among them.')
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        program_path = os.path.join(temp_dir, 'facts.pl')
+        with open(program_path, 'w') as program_fp:
+            program_fp.writelines(generate_fact_base(args['clauses']))
+        queries = generate_queries(args['queries'], args['distinct'])
+
+        print('{:>10} {:>10} {:>12} {:>12}'.format('clauses', 'queries', 'cache', 'queries/s'))
+        for cache_name, result_cache_bytes in [('disabled', 0), ('enabled', 64 * 1024 * 1024)]:
+            elapsed = time_batch(program_path, queries, result_cache_bytes)
+            print('{:>10} {:>10} {:>12} {:>12.1f}'.format(args['clauses'], len(queries), cache_name, len(queries) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
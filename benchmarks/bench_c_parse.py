@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""
+Throughput benchmark for the C parser.
+
+Synthetic C programs of each requested number of functions are generated and parsed into a
+representation. Throughput is reported in lines per second.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.program_parser as PARSER
+import benchmarks.generators as GENERATORS
+
+
+def time_parse(program_lines, repeats):
+    best_time = None
+    for _ in range(0, repeats):
+        parser = PARSER.CProgramParser()
+        start_time = time.perf_counter()
+        parser.parse_lines_into_representation(program_lines)
+        elapsed = time.perf_counter() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time, len(parser.program_representation.c_functions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark C parser throughput on generated programs.')
+    parser.add_argument('-f', '--functions', type=int, nargs='+', default=[1000, 10000, 50000], help='Numbers of functions of the generated programs.')
+    parser.add_argument('-d', '--body-depth', type=int, default=3, help='How deep loops and conditionals are nested in function bodies.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of runs per size, the fastest is reported.')
+    args = vars(parser.parse_args())
+
+    print('{:>10} {:>10} {:>12} {:>12}'.format('lines', 'functions', 'parse (s)', 'lines/s'))
+    for num_functions in args['functions']:
+        program_lines = GENERATORS.generate_c_program(num_functions, body_depth=args['body_depth'])
+        elapsed, num_parsed = time_parse(program_lines, args['repeats'])
+        print('{:>10} {:>10} {:>12.3f} {:>12.0f}'.format(len(program_lines), num_parsed, elapsed, len(program_lines) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
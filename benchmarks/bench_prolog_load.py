@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for loading generated Prolog fact bases.
+
+Loads fact bases of increasing clause counts and reports the time per clause and the memory held
+by the loaded representation. With the name/arity clause index the time per clause should stay
+roughly constant as the program grows.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.program_parser as PARSER
+from benchmarks.generators import generate_fact_base
+
+
+def time_load(num_clauses, repeats):
+    program_lines = generate_fact_base(num_clauses)
+    best_time = None
+    for _ in range(0, repeats):
+        parser = PARSER.PrologProgramParser()
+        start_time = time.perf_counter()
+        parser.parse_lines_into_representation(program_lines)
+        elapsed = time.perf_counter() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time
+
+
+def measure_memory(num_clauses):
+    # Measured in a separate run, tracing allocations slows down parsing considerably
+    program_lines = generate_fact_base(num_clauses)
+    tracemalloc.start()
+    parser = PARSER.PrologProgramParser()
+    parser.parse_lines_into_representation(program_lines)
+    retained_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return retained_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Prolog fact base load time against clause count.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[10000, 20000, 40000, 80000], help='Clause counts to benchmark.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of runs per size, the fastest is reported.')
+    args = vars(parser.parse_args())
+
+    print('{:>10} {:>12} {:>16} {:>12}'.format('clauses', 'load (s)', 'us per clause', 'memory (MB)'))
+    for num_clauses in args['sizes']:
+        elapsed = time_load(num_clauses, args['repeats'])
+        retained_bytes = measure_memory(num_clauses)
+        print('{:>10} {:>12.3f} {:>16.2f} {:>12.1f}'.format(num_clauses, elapsed, elapsed * 1e6 / num_clauses, retained_bytes / (1024 * 1024)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Throughput benchmark for the Prolog parser.
+
+The Prolog programs in the examples directory are concatenated and repeated until they reach
+each requested size, then parsed into a representation. Throughput is reported in MB/s.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.program_parser as PARSER
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+def load_example_source():
+    source = ''
+    for example_path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.pl'))):
+        with open(example_path, 'r') as example_fp:
+            source = source + example_fp.read().rstrip() + '\n'
+    return source
+
+
+def scale_source(source, target_bytes):
+    num_copies = max(1, target_bytes // len(source))
+    return (source * num_copies).splitlines(keepends=True)
+
+
+def time_parse(program_lines, repeats):
+    best_time = None
+    for _ in range(0, repeats):
+        parser = PARSER.PrologProgramParser()
+        start_time = time.perf_counter()
+        parser.parse_lines_into_representation(program_lines)
+        elapsed = time.perf_counter() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time, parser.program_representation.count_predicates()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Prolog parser throughput on scaled up example programs.')
+    parser.add_argument('-s', '--sizes', type=float, nargs='+', default=[0.5, 1, 2, 4], help='Program sizes to benchmark, in MB.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of runs per size, the fastest is reported.')
+    args = vars(parser.parse_args())
+
+    source = load_example_source()
+    print('{:>10} {:>10} {:>12} {:>10}'.format('size (MB)', 'clauses', 'parse (s)', 'MB/s'))
+    for size in args['sizes']:
+        program_lines = scale_source(source, int(size * 1024 * 1024))
+        num_bytes = sum([len(line) for line in program_lines])
+        elapsed, num_clauses = time_parse(program_lines, args['repeats'])
+        megabytes = num_bytes / (1024 * 1024)
+        print('{:>10.2f} {:>10} {:>12.3f} {:>10.2f}'.format(megabytes, num_clauses, elapsed, megabytes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for indexing a large Python tree with the ast frontend.
+
+By default indexes the standard library of the running interpreter. Reports files per second for a
+full parse, for a reload of the unchanged tree from its snapshot, and for a reload after one file
+changed, where only that file is reparsed. The tree is copied to a temporary directory first, so
+the changed file is never one of the originals.
+"""
+
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import sysconfig
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+
+
+QUERIES = [
+    'find function where returns:none and bodycontains:loop.',
+    'find function/2 where inputs:str,int.',
+    'find function where bodycontains:conditional and returns:bool limit 10.',
+]
+
+
+def copy_python_tree(source_dir, target_dir):
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = [directory for directory in dirs if directory not in ['site-packages', '__pycache__']]
+        for file_name in files:
+            if file_name.endswith('.py'):
+                target_path = os.path.join(target_dir, os.path.relpath(os.path.join(root, file_name), source_dir))
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copyfile(os.path.join(root, file_name), target_path)
+
+
+def time_load(program_dir, num_workers):
+    # Warnings about files the running interpreter cannot parse are not part of the benchmark
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        query_shell = QUERY_ENGINE.QueryShell(program_dir, num_workers=num_workers)
+    return time.perf_counter() - start_time, query_shell
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark indexing a large Python tree.')
+    parser.add_argument('-p', '--path', default=sysconfig.get_paths()['stdlib'], help='Python tree to index, the standard library by default.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes used for the full parse. Use 0 for one per CPU core.')
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        program_dir = os.path.join(work_dir, 'tree')
+        copy_python_tree(args['path'], program_dir)
+        # Snapshots of the copy are written to the temporary directory rather than the user's cache
+        os.environ['XDG_CACHE_HOME'] = work_dir
+
+        elapsed, query_shell = time_load(program_dir, args['workers'])
+        num_files = len(query_shell.program_representation.source_files)
+        num_functions = query_shell.engine.query_index.num_symbols
+        print('{} files, {} functions and methods'.format(num_files, num_functions))
+        print('{:<30} {:>10} {:>12}'.format('load', 'time (s)', 'files/s'))
+        print('{:<30} {:>10.3f} {:>12.1f}'.format('full parse', elapsed, num_files / elapsed))
+
+        elapsed, query_shell = time_load(program_dir, args['workers'])
+        print('{:<30} {:>10.3f} {:>12.1f}'.format('unchanged, from snapshot', elapsed, num_files / elapsed))
+
+        changed_file = sorted(query_shell.program_representation.source_files.keys())[0]
+        with open(changed_file, 'a') as changed_fp:
+            changed_fp.write('\ndef benchmark_added_function(x: int) -> int:\n    return x\n')
+        elapsed, query_shell = time_load(program_dir, args['workers'])
+        print('{:<30} {:>10.3f} {:>12.1f}'.format('one file changed', elapsed, num_files / elapsed))
+
+        for query in QUERIES:
+            start_time = time.perf_counter()
+            batch_result = query_shell.run_batch_query(query)
+            print('{:>8} matches in {:>8.2f} ms  {}'.format(batch_result['count'], (time.perf_counter() - start_time) * 1000, query))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for find queries against large generated C representations.
+
+Builds representations of increasing function counts, then times building the query indexes and
+running a few selective queries. With the indexed planner the query time should follow the number
+of results rather than the number of functions in the program.
+"""
+
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+from benchmarks.generators import generate_c_representation
+
+
+QUERIES = [
+    'find function/2 where returns:void.',
+    'find function where inputs:int,char* and returns:void.',
+    'find function/1 where bodycontains:loop or returns:void.',
+]
+
+
+def time_queries(program_representation, repeats):
+    start_time = time.perf_counter()
+    engine = QUERY_ENGINE.QueryEngine(program_representation)
+    index_time = time.perf_counter() - start_time
+    query_results = []
+    for query in QUERIES:
+        scb_query = engine.convert_query(query)
+        best_time = None
+        for _ in range(0, repeats):
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scb_result = engine.process_query(scb_query)
+            elapsed = time.perf_counter() - start_time
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+        query_results.append((query, len(scb_result.true_matched_terms), best_time))
+    return index_time, query_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark find query time against program size.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[25000, 50000, 100000, 200000], help='Function counts to benchmark.')
+    parser.add_argument('-r', '--repeats', type=int, default=5, help='Number of runs per query, the fastest is reported.')
+    args = vars(parser.parse_args())
+
+    print('{:>10} {:>10} {:>8} {:>10} {:>14}  {}'.format('functions', 'index (s)', 'results', 'query (ms)', 'us per result', 'query'))
+    for num_functions in args['sizes']:
+        program_representation = generate_c_representation(num_functions)
+        index_time, query_results = time_queries(program_representation, args['repeats'])
+        for query, num_results, elapsed in query_results:
+            print('{:>10} {:>10.3f} {:>8} {:>10.3f} {:>14.2f}  {}'.format(num_functions, index_time, num_results, elapsed * 1e3,
+                                                                     elapsed * 1e6 / max(1, num_results), query))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark comparing the posting list query index with the vectorized NumPy index.
+
+Builds generated C representations of increasing function counts and times building each index and
+evaluating a few queries down to the list of matching symbol numbers. Results are checked to be the
+same for both indexes. Requires NumPy.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+import code_browsing.query_planner as QUERY_PLANNER
+import code_browsing.vector_index as VECTOR_INDEX
+from benchmarks.generators import generate_c_representation
+
+
+QUERIES = [
+    'find function/2 where returns:void.',
+    'find function where inputs:int,char* and returns:void.',
+    'find function/1 where bodycontains:loop or returns:void.',
+    'find function where inputs:int,int,int or bodycontains:loop and returns:int.',
+]
+
+
+def time_index(index_class, program_representation, scb_queries, repeats):
+    start_time = time.perf_counter()
+    query_index = index_class(program_representation)
+    index_time = time.perf_counter() - start_time
+    query_results = []
+    for scb_query in scb_queries:
+        best_time = None
+        for _ in range(0, repeats):
+            start_time = time.perf_counter()
+            ordinals = list(scb_query.evaluator(query_index).iter_ordinals())
+            elapsed = time.perf_counter() - start_time
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+        query_results.append((ordinals, best_time))
+    return index_time, query_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the posting list and vectorized query indexes.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Function counts to benchmark.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of runs per query, the fastest is reported.')
+    args = vars(parser.parse_args())
+
+    if not VECTOR_INDEX.is_available():
+        print('NumPy is not installed, the vectorized index cannot be benchmarked.')
+        return
+
+    print('{:>10} {:>12} {:>10} {:>8} {:>10}  {}'.format('functions', 'index', 'build (s)', 'results', 'query (ms)', 'query'))
+    for num_functions in args['sizes']:
+        program_representation = generate_c_representation(num_functions)
+        engine = QUERY_ENGINE.QueryEngine(program_representation, result_cache_bytes=0)
+        scb_queries = [engine.convert_query(query) for query in QUERIES]
+        results = {}
+        for index_name, index_class in [('postings', QUERY_PLANNER.QueryIndex), ('vectorized', VECTOR_INDEX.VectorQueryIndex)]:
+            index_time, query_results = time_index(index_class, program_representation, scb_queries, args['repeats'])
+            results[index_name] = [ordinals for ordinals, _ in query_results]
+            for query, (ordinals, elapsed) in zip(QUERIES, query_results):
+                print('{:>10} {:>12} {:>10.3f} {:>8} {:>10.3f}  {}'.format(num_functions, index_name, index_time, len(ordinals), elapsed * 1e3, query))
+        if results['postings'] != results['vectorized']:
+            print('ERROR - Indexes returned different results for {} functions!'.format(num_functions))
+        del engine, program_representation
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Generators for synthetic Prolog and C programs.
+
+All generators are seeded, so the same arguments always produce the same program. Prolog programs
+mix ground facts with rules whose bodies call other generated predicates, nested up to a given
+depth in disjunctions, if-then-else and negation. C programs have functions whose bodies nest loops
+and conditionals and call other generated functions, and can be split over several files.
+"""
+
+import os
+import random
+import code_browsing.program_representation as PR
+
+
+# Constants of one kind are used for each argument position of a predicate, so clauses agree on types
+PROLOG_CONSTANTS = [['alpha', 'beta', 'gamma', "'Quoted Atom'"], ['42', '7', '3.5'], ['[]', '[a, b]'], ['f(x)', 'f(y)']]
+C_TYPES = ['int', 'char*', 'void', 'double', 'struct node*', 'int*']
+
+
+def generate_fact_base(num_clauses):
+    # A few large predicates, similar to generated graph/fact databases
+    lines = []
+    for i in range(0, num_clauses):
+        if i % 4 == 0:
+            lines.append('node(n{}).\n'.format(i))
+        elif i % 4 == 3:
+            lines.append('weight(n{}, {}).\n'.format(i, i % 97))
+        else:
+            lines.append('edge(n{}, n{}).\n'.format(i, (i * 7) % num_clauses))
+    lines.append('path(X, Y) :- edge(X, Y).\n')
+    lines.append('path(X, Y) :- edge(X, Z), path(Z, Y).\n')
+    return lines
+
+
+def generate_prolog_goal(rng, predicate_names, variables, depth):
+    if depth > 0 and rng.random() < 0.3:
+        goals = [generate_prolog_body(rng, predicate_names, variables, depth - 1) for i in range(0, 2)]
+        control = rng.choice([' ; ', ' -> '])
+        if control == ' -> ':
+            return '( {} -> {} ; true )'.format(goals[0], goals[1])
+        return '( {} ; {} )'.format(goals[0], goals[1])
+    if depth > 0 and rng.random() < 0.1:
+        return '\\+ ' + generate_prolog_goal(rng, predicate_names, variables, depth - 1)
+    name, arity = rng.choice(predicate_names)
+    if arity == 0:
+        return name
+    return '{}({})'.format(name, ', '.join([rng.choice(variables) for i in range(0, arity)]))
+
+
+def generate_prolog_body(rng, predicate_names, variables, depth):
+    return ', '.join([generate_prolog_goal(rng, predicate_names, variables, depth) for i in range(0, rng.randint(1, 3))])
+
+
+def generate_prolog_program(num_clauses, max_arity=3, body_depth=2, fact_ratio=0.5, num_predicates=None, seed=0):
+    """Function that generates the lines of a synthetic Prolog program
+
+    Parameters
+    ----------
+    num_clauses : int
+        number of clauses in the program
+    max_arity : int
+        largest arity of a generated predicate
+    body_depth : int
+        how deep disjunctions, if-then-else and negation are nested in rule bodies
+    fact_ratio : float
+        fraction of the clauses that are ground facts
+    num_predicates : int
+        number of distinct name/arity pairs, by default one per 20 clauses
+    seed : int
+        seed of the random generator
+
+    Returns
+    -------
+    list of str
+        lines of the program
+    """
+
+    rng = random.Random(seed)
+    if num_predicates is None:
+        num_predicates = max(1, num_clauses // 20)
+    predicate_names = [('pred_{}'.format(i), rng.randint(1, max_arity)) for i in range(0, num_predicates)]
+    position_constants = dict([(predicate, [rng.choice(PROLOG_CONSTANTS) for j in range(0, predicate[1])]) for predicate in predicate_names])
+    # Facts and rules use separate predicates, so fact predicates can be stored as fact tables
+    num_fact_predicates = max(1, int(round(num_predicates * fact_ratio))) if fact_ratio > 0 else 0
+    fact_predicates = predicate_names[:num_fact_predicates]
+    rule_predicates = predicate_names[num_fact_predicates:] or predicate_names
+    lines = []
+    for i in range(0, num_clauses):
+        if len(fact_predicates) > 0 and rng.random() < fact_ratio:
+            name, arity = rng.choice(fact_predicates)
+            lines.append('{}({}).\n'.format(name, ', '.join([rng.choice(constants) for constants in position_constants[(name, arity)]])))
+            continue
+        name, arity = rng.choice(rule_predicates)
+        variables = ['X{}'.format(j) for j in range(0, arity + 2)]
+        head_arguments = [variables[j] if rng.random() < 0.8 else rng.choice(position_constants[(name, arity)][j]) for j in range(0, arity)]
+        lines.append('{}({}) :-\n    {}.\n'.format(name, ', '.join(head_arguments), generate_prolog_body(rng, predicate_names, variables, body_depth)))
+    return lines
+
+
+def generate_c_block(rng, function_names, variables, depth, indent):
+    lines = []
+    for i in range(0, rng.randint(1, 4)):
+        kind = rng.random()
+        if depth > 0 and kind < 0.25:
+            if rng.random() < 0.5:
+                lines.append('{}for(int i = 0; i < {}; i++){{\n'.format(indent, rng.choice(variables)))
+            else:
+                lines.append('{}while({} > 0){{\n'.format(indent, rng.choice(variables)))
+            lines.extend(generate_c_block(rng, function_names, variables, depth - 1, indent + '\t'))
+            lines.append('{}}}\n'.format(indent))
+        elif depth > 0 and kind < 0.45:
+            lines.append('{}if({} == {}){{\n'.format(indent, rng.choice(variables), rng.randint(0, 9)))
+            lines.extend(generate_c_block(rng, function_names, variables, depth - 1, indent + '\t'))
+            lines.append('{}}}\n'.format(indent))
+        elif kind < 0.75:
+            name, arity = rng.choice(function_names)
+            lines.append('{}{}({});\n'.format(indent, name, ', '.join([rng.choice(variables) for j in range(0, arity)])))
+        else:
+            lines.append('{}{} = {} + {};\n'.format(indent, rng.choice(variables), rng.choice(variables), rng.randint(0, 9)))
+    return lines
+
+
+def generate_c_program(num_functions, max_arity=3, body_depth=2, seed=0, first_function=0):
+    """Function that generates the lines of a synthetic C program
+
+    Parameters
+    ----------
+    num_functions : int
+        number of functions in the program
+    max_arity : int
+        largest number of arguments of a generated function, every function takes at least one
+    body_depth : int
+        how deep loops and conditionals are nested in function bodies
+    seed : int
+        seed of the random generator
+    first_function : int
+        number of the first generated function, so that several files have distinct names
+
+    Returns
+    -------
+    list of str
+        lines of the program
+    """
+
+    rng = random.Random(seed)
+    function_names = [('function_{}'.format(first_function + i), rng.randint(1, max_arity)) for i in range(0, num_functions)]
+    lines = ['#include <stdio.h>\n', '\n']
+    for name, arity in function_names:
+        arguments = ['{} arg{}'.format(rng.choice(C_TYPES[:2] + C_TYPES[3:]), i) for i in range(0, arity)]
+        variables = ['arg{}'.format(i) for i in range(0, arity)]
+        lines.append('{} {}({}){{\n'.format(rng.choice(C_TYPES), name, ', '.join(arguments)))
+        lines.extend(generate_c_block(rng, function_names, variables, body_depth, '\t'))
+        lines.append('}\n')
+        lines.append('\n')
+    return lines
+
+
+def generate_c_files(num_files, functions_per_file, max_arity=3, body_depth=2, seed=0):
+    # File name -> lines, with function names unique across files
+    program_files = {}
+    for i in range(0, num_files):
+        program_files['file_{}.c'.format(i)] = generate_c_program(functions_per_file, max_arity=max_arity, body_depth=body_depth,
+                                                                  seed=seed + i, first_function=i * functions_per_file)
+    return program_files
+
+
+def write_program_files(directory, program_files):
+    for file_name, lines in program_files.items():
+        with open(os.path.join(directory, file_name), 'w') as program_fp:
+            program_fp.writelines(lines)
+
+
+def generate_c_representation(num_functions, seed=0):
+    # Builds the representation directly, for benchmarks that only need a large representation.
+    # Return and argument types are drawn from a pool of 50 types, so each one is rare
+    rng = random.Random(seed)
+    types = ['int', 'char*', 'void'] + ['struct type_{}*'.format(i) for i in range(0, 47)]
+    program_representation = PR.CProgramRepresentation()
+    for i in range(0, num_functions):
+        arguments = [PR.Variable('arg{}'.format(j), rng.choice(types)) for j in range(0, rng.randint(0, 4))]
+        body = []
+        if rng.random() < 0.2:
+            body.append(PR.Loop('for'))
+        method = PR.Method('function_{}'.format(i), rng.choice(types), arguments, body)
+        method.update_body_summary()
+        program_representation.add_method(method)
+    return program_representation
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""
+Reproducible benchmark suite.
+
+Generates a Prolog program and a C program split over several files with the seeded generators, then
+times the Prolog and C parsers, the variable type inference passes and a fixed query mix. Each stage
+is run several times and the fastest run is kept. Results are written as JSON together with the
+configuration and the version of this package, and can be compared with the results of an earlier
+run to spot regressions.
+
+    python3 benchmarks/suite.py -o results.json
+    python3 benchmarks/suite.py -o new.json --compare results.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing
+import code_browsing.errors as SCBErrors
+import code_browsing.program_parser as PARSER
+import code_browsing.prolog_reader as PROLOG_READER
+import code_browsing.query_engine as QUERY_ENGINE
+import benchmarks.generators as GENERATORS
+
+# Version of the results file layout
+RESULTS_FORMAT_VERSION = 1
+
+PROLOG_QUERIES = [
+    'find predicate.',
+    'find predicate/2 where inputs:atom,scalar.',
+    'find predicate where bodycontains:conditional and inputs:var,var,var.',
+    'find predicate/1 where inputs:list or bodycontains:function limit 100.',
+]
+
+C_QUERIES = [
+    'find function.',
+    'find function/2 where returns:void.',
+    'find function where bodycontains:loop and inputs:int,char*.',
+    'find function where (returns:int or returns:double) and bodycontains:conditional limit 100.',
+]
+
+
+def time_best(run, repeats):
+    # run is called once per repeat and returns (seconds, count), the fastest run is kept
+    best = None
+    for _ in range(0, repeats):
+        elapsed, count = run()
+        if best is None or elapsed < best[0]:
+            best = (elapsed, count)
+    return best
+
+
+def time_prolog_parse(program_lines):
+    parser = PARSER.PrologProgramParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        start_time = time.perf_counter()
+        parser.parse_lines_into_representation(program_lines)
+        elapsed = time.perf_counter() - start_time
+    return elapsed, parser.program_representation.count_predicates()
+
+
+def time_prolog_read(program_text):
+    start_time = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        clauses = list(PROLOG_READER.PrologTermReader(program_text).read_clauses())
+    return time.perf_counter() - start_time, len(clauses)
+
+
+def time_prolog_clause_types(program_text):
+    # The per clause pass run by the parser on every clause it reads
+    with contextlib.redirect_stderr(io.StringIO()):
+        clauses = list(PROLOG_READER.PrologTermReader(program_text).read_clauses())
+    start_time = time.perf_counter()
+    for predicate in clauses:
+        try:
+            predicate.update_variable_expected_types()
+        except SCBErrors.SCBVariableMatchInvalidError:
+            pass
+    return time.perf_counter() - start_time, len(clauses)
+
+
+def time_prolog_reconcile(program_lines):
+    # The cross clause pass, which joins the head types of all clauses of each name/arity
+    parser = PARSER.PrologProgramParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        parser.parse_lines_into_representation(program_lines)
+        program_representation = parser.program_representation
+        keys = list(program_representation.predicate_index.keys())
+        start_time = time.perf_counter()
+        program_representation.reconcile_predicates(keys)
+        elapsed = time.perf_counter() - start_time
+    return elapsed, len(keys)
+
+
+def time_c_parse(program_dir):
+    parser = PARSER.CProgramParser()
+    start_time = time.perf_counter()
+    parser.parse_program(program_dir)
+    elapsed = time.perf_counter() - start_time
+    return elapsed, len(parser.program_representation.c_functions)
+
+
+def time_c_types(program_dir):
+    parser = PARSER.CProgramParser()
+    parser.parse_program(program_dir)
+    c_functions = parser.program_representation.c_functions
+    start_time = time.perf_counter()
+    for method in c_functions:
+        try:
+            method.update_variable_expected_types()
+        except SCBErrors.SCBVariableMatchInvalidError:
+            pass
+    return time.perf_counter() - start_time, len(c_functions)
+
+
+def time_query(engine, query):
+    scb_query = engine.convert_query(query)
+    start_time = time.perf_counter()
+    scb_result = engine.process_query(scb_query, verbose=False)
+    return time.perf_counter() - start_time, len(scb_result.true_matched_terms)
+
+
+def run_suite(config):
+    """Function that runs every benchmark of the suite
+
+    Parameters
+    ----------
+    config : dict
+        generator and run settings, see the command line options of main
+
+    Returns
+    -------
+    list of dict
+        one entry per benchmark with its name, fastest time in seconds and number of items processed
+    """
+
+    repeats = config['repeats']
+    results = []
+
+    def record(name, run):
+        elapsed, count = time_best(run, repeats)
+        results.append({'name': name, 'seconds': elapsed, 'count': count})
+        print('{:<60} {:>10.4f} {:>10}'.format(name, elapsed, count))
+
+    program_lines = GENERATORS.generate_prolog_program(config['clauses'], max_arity=config['max_arity'], body_depth=config['body_depth'],
+                                                       fact_ratio=config['fact_ratio'], seed=config['seed'])
+    program_text = ''.join(program_lines)
+    record('prolog/read', lambda: time_prolog_read(program_text))
+    record('prolog/parse', lambda: time_prolog_parse(program_lines))
+    record('prolog/types/clauses', lambda: time_prolog_clause_types(program_text))
+    record('prolog/types/reconcile', lambda: time_prolog_reconcile(program_lines))
+
+    prolog_parser = PARSER.PrologProgramParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        prolog_parser.parse_lines_into_representation(program_lines)
+    engine = QUERY_ENGINE.QueryEngine(prolog_parser.program_representation, result_cache_bytes=0)
+    for query in PROLOG_QUERIES:
+        record('prolog/query/' + query, lambda: time_query(engine, query))
+
+    with tempfile.TemporaryDirectory() as program_dir:
+        GENERATORS.write_program_files(program_dir, GENERATORS.generate_c_files(config['files'], config['functions_per_file'],
+                                                                                max_arity=config['max_arity'], body_depth=config['body_depth'],
+                                                                                seed=config['seed']))
+        record('c/parse', lambda: time_c_parse(program_dir))
+        record('c/types', lambda: time_c_types(program_dir))
+        c_parser = PARSER.CProgramParser()
+        c_parser.parse_program(program_dir)
+    engine = QUERY_ENGINE.QueryEngine(c_parser.program_representation, result_cache_bytes=0)
+    for query in C_QUERIES:
+        record('c/query/' + query, lambda: time_query(engine, query))
+    return results
+
+
+def compare_results(old_results, new_results):
+    old_times = dict([(result['name'], result['seconds']) for result in old_results['results']])
+    print('\nCompared to version {} ({}):'.format(old_results['version'], old_results['timestamp']))
+    print('{:<60} {:>10} {:>10} {:>8}'.format('benchmark', 'old (s)', 'new (s)', 'ratio'))
+    for result in new_results['results']:
+        if result['name'] not in old_times:
+            continue
+        old_time = old_times[result['name']]
+        print('{:<60} {:>10.4f} {:>10.4f} {:>8.2f}'.format(result['name'], old_time, result['seconds'], result['seconds'] / max(old_time, 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and write its results as JSON.')
+    parser.add_argument('-c', '--clauses', type=int, default=20000, help='Number of clauses in the generated Prolog program.')
+    parser.add_argument('-a', '--max-arity', type=int, default=3, help='Largest arity of generated predicates and functions.')
+    parser.add_argument('-d', '--body-depth', type=int, default=2, help='Nesting depth of control constructs in generated bodies.')
+    parser.add_argument('-f', '--fact-ratio', type=float, default=0.5, help='Fraction of generated Prolog clauses that are facts.')
+    parser.add_argument('--files', type=int, default=20, help='Number of generated C files.')
+    parser.add_argument('--functions-per-file', type=int, default=200, help='Number of functions in each generated C file.')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the program generators.')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of runs per benchmark, the fastest is reported.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='File the JSON results are written to.')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against.')
+    args = vars(parser.parse_args())
+
+    config = dict([(key, args[key]) for key in ['clauses', 'max_arity', 'body_depth', 'fact_ratio', 'files', 'functions_per_file', 'seed', 'repeats']])
+    print('{:<60} {:>10} {:>10}'.format('benchmark', 'time (s)', 'count'))
+    results = {
+        'format': RESULTS_FORMAT_VERSION,
+        'version': code_browsing.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': config,
+        'results': run_suite(config),
+    }
+    with open(args['output'], 'w') as results_fp:
+        json.dump(results, results_fp, indent=2)
+    print('Wrote results to {}'.format(args['output']))
+
+    if args['compare'] is not None:
+        with open(args['compare'], 'r') as old_fp:
+            old_results = json.load(old_fp)
+        if old_results['config'] != config:
+            print('WARNING - {} was run with a different configuration, times may not be comparable.'.format(args['compare']))
+        compare_results(old_results, results)
+
+
+if __name__ == '__main__':
+    main()
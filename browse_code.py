@@ -1,17 +1,91 @@
 #!/usr/bin/env python3
 
 import argparse
+import atexit
+import gc
 import os
+import sys
+import contextlib
+import code_browsing.logger as LOGGER
 import code_browsing.query_engine as QUERY_ENGINE
+import code_browsing.query_server as QUERY_SERVER
+import code_browsing.workspace as WORKSPACE
 
 
+def load_query_shell(args):
+    # The program loaded at startup lives until exit and is made of millions of small objects. The
+    # cyclic GC is kept off while they are created and then they are frozen, or every full collection
+    # would walk all of them. Representations hold no reference cycles, so frozen objects are still
+    # freed once a reload drops them.
+    gc.disable()
+    try:
+        query_shell = QUERY_ENGINE.QueryShell(args['programpath'], num_workers=args['workers'], use_snapshots=not args['no_snapshot'],
+                                              result_cache_bytes=int(args['result_cache_mb'] * 1024 * 1024),
+                                              vectorized=args['vectorized'], mapped=args['mapped'])
+        gc.freeze()
+    finally:
+        gc.enable()
+    return query_shell
+
 
 def main():
     parser = argparse.ArgumentParser(description='A python utility for sematically browsing python and prolog code.')
-    parser.add_argument('programpath', help='Enter the path to the program or directory you wish to browse.')
+    parser.add_argument('programpath', nargs='+', help='Enter the path to the program or directory you wish to browse. Several paths open a workspace with one shard per path.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes used to parse program directories. Use 0 for one per CPU core.')
+    parser.add_argument('--no-snapshot', action='store_true', help='Always parse the program from source instead of loading a saved snapshot.')
+    parser.add_argument('--result-cache-mb', type=float, default=64, help='Memory bound of the query result cache in MB. Use 0 to disable caching.')
+    parser.add_argument('--vectorized', action='store_true', help='Evaluate queries over NumPy arrays of symbol attributes. Requires NumPy.')
+    parser.add_argument('--mapped', action='store_true', help='Query a read-only memory-mapped copy of the representation, shared by all processes loading the same program.')
+    parser.add_argument('-b', '--batch', help='Run the queries in this file, one per line, and print one JSON object per query. Use - to read from stdin.')
+    parser.add_argument('-o', '--output', help='File to write batch results to instead of stdout.')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Serve JSON queries over TCP on this port instead of starting the shell.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the query server listens on.')
+    parser.add_argument('--unix-socket', help='Serve JSON queries on this Unix socket path instead of starting the shell.')
+    parser.add_argument('--shard-workers', type=int, default=0, help='Number of worker processes holding the shards of a workspace. Use 0 for one per CPU core, -1 to hold all shards in this process.')
+    parser.add_argument('--trace', action='store_true', help='Write timing records of program loads, refreshes, index updates and queries to stderr and the logs directory.')
     args = vars(parser.parse_args())
-    query_shell = QUERY_ENGINE.QueryShell(args['programpath'])
-    query_shell.run_shell()
+    if args['trace']:
+        LOGGER.initialize_logger()
+        LOGGER.assign_write_function(sys.stderr.write)
+        LOGGER.toggle_debug_logging()
+        atexit.register(LOGGER.close_logger)
+    if len(args['programpath']) > 1:
+        if args['batch'] is not None or args['serve'] is not None or args['unix_socket'] is not None:
+            parser.error('batch and server modes take a single program path')
+        num_shard_workers = args['shard_workers']
+        if num_shard_workers == 0:
+            num_shard_workers = os.cpu_count()
+        workspace = WORKSPACE.Workspace(args['programpath'], num_workers=max(0, num_shard_workers), num_parse_workers=args['workers'],
+                                        use_snapshots=not args['no_snapshot'], result_cache_bytes=int(args['result_cache_mb'] * 1024 * 1024),
+                                        mapped=args['mapped'])
+        workspace.run_shell()
+        return
+    args['programpath'] = args['programpath'][0]
+    if args['serve'] is not None or args['unix_socket'] is not None:
+        query_shell = load_query_shell(args)
+        QUERY_SERVER.QueryServer(query_shell).run(host=args['host'], port=args['serve'], unix_socket_path=args['unix_socket'])
+        return
+    if args['batch'] is None:
+        query_shell = load_query_shell(args)
+        query_shell.run_shell()
+        return
+
+    # Keep stdout for the JSON Lines results, messages printed while loading go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        query_shell = load_query_shell(args)
+    input_fp = sys.stdin
+    output_fp = sys.stdout
+    if args['batch'] != '-':
+        input_fp = open(args['batch'], 'r')
+    if args['output'] is not None:
+        output_fp = open(args['output'], 'w')
+    try:
+        query_shell.run_batch(input_fp, output_fp)
+    finally:
+        if input_fp is not sys.stdin:
+            input_fp.close()
+        if output_fp is not sys.stdout:
+            output_fp.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,437 @@
+"""
+Single pass, brace aware scanner for C source.
+
+The scanner walks the program text once with a single compiled pattern that matches comments,
+string and character literals, preprocessor lines and the characters that give C code its
+structure. Comments, literals and preprocessor lines are skipped, so braces and semicolons inside
+them are never mistaken for code. The text of each statement is collected up to the '{', '}' or ';'
+ending it, and a stack of open blocks turns function definitions into Methods whose bodies hold
+their calls, loops and conditionals, nested as in the source. Statements do not need to sit on lines of
+their own, so '} else {', one line if statements and conditionals without braces are read as well.
+"""
+
+import re
+import code_browsing.program_representation as PR
+
+
+# Code the scanner has nothing to look at in is skipped in front of each token, which includes
+# parenthesized code with at most one level of nested parentheses and no comments, literals or braces
+# inside. Group 1 holds comments, group 2 string and character literals, group 3 preprocessor lines
+# with their continuation lines and group 4 structural characters. A '/' that starts no comment is
+# skipped. Unterminated comments and literals end at the end of the text and the end of the line.
+_TOKEN_PATTERN = re.compile(r'''
+    (?:[^/"'\#{};()]+|\((?:[^()"'/{}]|/(?![/*])|\((?:[^()"'/{}]|/(?![/*]))*\))*\))*
+    (?:
+        (//[^\n]*|/\*.*?(?:\*/|\Z))
+      | ("(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?)
+      | (\#(?:[^\n\\]|\\.)*)
+      | ([{};()])
+      | /
+    )?
+''', re.S | re.X)
+_LITERAL, _STRUCTURAL = 2, 4
+
+# Keywords starting a loop or conditional, and the term each one is read into
+_CONTROL_PATTERN = re.compile(r'\s*(else\s+if|if|for|while|switch|else|do)\b\s*')
+_CONTROL_TERMS = {'for': PR.Loop, 'while': PR.Loop, 'do': PR.Loop,
+                  'if': PR.Conditional, 'else if': PR.Conditional, 'else': PR.Conditional, 'switch': PR.Conditional}
+_CONDITION_PATTERN = re.compile(r'\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)')
+_CONDITION_KEYWORDS = frozenset(['if', 'else if', 'for', 'while', 'switch'])
+
+# case and goto labels in front of a statement
+_LABEL_PATTERN = re.compile(r'\s*(?:(?:case\b[^:]*|\w+)\s*:(?!:)\s*)+')
+
+# A name followed by '(' is a call, group 2 holds other parentheses and argument separators
+_CALL_PATTERN = re.compile(r'\b([A-Za-z_]\w*)\s*\(|([(),])')
+_FLAT_CALL_PATTERN = re.compile(r'\b([A-Za-z_]\w*)\s*\(([^()]*)\)')
+
+_POINTER_SPACE_PATTERN = re.compile(r'\s+([*\[])')
+_FUNCTION_POINTER_PATTERN = re.compile(r'\(\s*\*\s*(\w+)\s*\)')
+_STORAGE_SPECIFIERS = frozenset(['static', 'inline', 'extern', '__inline', '__inline__'])
+_NOT_FUNCTION_NAMES = frozenset(['if', 'for', 'while', 'switch', 'return', 'sizeof', 'do', 'else'])
+
+
+def normalize_type(type_text):
+    # 'char *' and 'char*' are the same type, pointers and arrays are written without the space
+    type_text = ' '.join(type_text.split())
+    if ' *' in type_text or ' [' in type_text:
+        return _POINTER_SPACE_PATTERN.sub(r'\1', type_text)
+    return type_text
+
+
+def find_closing_paren(text, position, end):
+    # Conditions rarely nest parentheses more than twice, deeper ones are matched one by one
+    match = _CONDITION_PATTERN.match(text, position, end)
+    if match is not None:
+        return match.end() - 1
+    depth = 0
+    for i in range(position, end):
+        char = text[i]
+        if char == '(':
+            depth = depth + 1
+        elif char == ')':
+            depth = depth - 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def find_opening_paren(text):
+    # Matching '(' of the ')' that ends text
+    if text.count('(') == 1:
+        return text.find('(')
+    depth = 0
+    for i in range(len(text) - 1, -1, -1):
+        char = text[i]
+        if char == ')':
+            depth = depth + 1
+        elif char == '(':
+            depth = depth - 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def split_parameters(parameter_text):
+    if '(' not in parameter_text and '[' not in parameter_text:
+        return [parameter.strip() for parameter in parameter_text.split(',')]
+    parameters = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(parameter_text):
+        if char in '([':
+            depth = depth + 1
+        elif char in ')]':
+            depth = depth - 1
+        elif char == ',' and depth == 0:
+            parameters.append(parameter_text[start:i].strip())
+            start = i + 1
+    parameters.append(parameter_text[start:].strip())
+    return parameters
+
+
+def convert_parameter(parameter):
+    """Function that converts a single parameter declaration into a variable term
+
+    Returns
+    -------
+    Variable
+        the parameter with its declared type, None for an empty or void parameter list
+    """
+
+    if parameter == '' or parameter == 'void':
+        return None
+    if parameter == '...':
+        return PR.Variable('...', None)
+    if '(' in parameter:
+        pointer_match = _FUNCTION_POINTER_PATTERN.search(parameter)
+        if pointer_match is not None:
+            return PR.Variable(pointer_match.group(1), normalize_type(parameter[:pointer_match.start(1)] + parameter[pointer_match.end(1):]))
+    declaration = parameter
+    num_dimensions = 0
+    if '[' in parameter:
+        declaration = parameter[:parameter.find('[')].rstrip()
+        num_dimensions = parameter.count('[')
+    parameter_type, name = split_declaration(declaration)
+    if parameter_type is None:
+        # Unnamed parameter, only the type is given
+        return PR.Variable('_', normalize_type(parameter))
+    return PR.Variable(name, normalize_type(parameter_type + '[]' * num_dimensions))
+
+
+def split_declaration(declaration):
+    # 'char *name' -> ('char *', 'name'), (None, None) if there is no name after the type
+    split_position = max(declaration.rfind(' '), declaration.rfind('*'))
+    name = declaration[split_position + 1:]
+    declared_type = declaration[:split_position + 1]
+    if not name.isidentifier() or declared_type.strip() == '':
+        return None, None
+    return declared_type, name
+
+
+def convert_function_header(header):
+    """Function that converts the text in front of a top level block into a method
+
+    Parameters
+    ----------
+    header : str
+        statement text in front of the '{', with comments and literals removed
+
+    Returns
+    -------
+    Method
+        the method with an empty body, or None if the block is not a function definition
+    """
+
+    header = ' '.join(header.split())
+    if not header.endswith(')'):
+        return None
+    open_position = find_opening_paren(header)
+    if open_position < 0:
+        return None
+    prefix = header[:open_position].rstrip()
+    if '=' in prefix:
+        return None
+    return_type, name = split_declaration(prefix)
+    if return_type is None or name in _NOT_FUNCTION_NAMES:
+        return None
+    return_type = [word for word in return_type.split() if word not in _STORAGE_SPECIFIERS]
+    if len(return_type) == 0:
+        return None
+    terms = []
+    for parameter in split_parameters(header[open_position + 1:-1]):
+        term = convert_parameter(parameter)
+        if term is not None:
+            terms.append(term)
+    return PR.Method(name, normalize_type(' '.join(return_type)), terms, None)
+
+
+def split_control_keywords(text, start, end):
+    """Function that reads the loop and conditional keywords a statement starts with
+
+    A statement may start with several, as in 'for(...) if(...) x++', where the if is the body of
+    the for.
+
+    Parameters
+    ----------
+    text : str
+        text holding the statement
+    start, end : int
+        bounds of the statement in text, so statements are read in place without being copied
+
+    Returns
+    -------
+    list of tuple, int
+        (keyword, start, end of its condition) for each keyword, outermost first, and the start of
+        the rest of the statement
+    """
+
+    controls = []
+    match = _CONTROL_PATTERN.match(text, start, end)
+    if match is None and text.find(':', start, end) >= 0:
+        label_match = _LABEL_PATTERN.match(text, start, end)
+        if label_match is not None:
+            match = _CONTROL_PATTERN.match(text, label_match.end(), end)
+    while match is not None:
+        keyword = match.group(1)
+        if keyword.startswith('else') and keyword != 'else':
+            keyword = 'else if'
+        position = match.end()
+        condition_end = position
+        if keyword in _CONDITION_KEYWORDS:
+            if position >= end or text[position] != '(':
+                break
+            condition_end = find_closing_paren(text, position, end)
+            if condition_end < 0:
+                break
+            position = condition_end + 1
+        controls.append((keyword, match.end(), condition_end))
+        start = position
+        match = _CONTROL_PATTERN.match(text, start, end)
+    return controls, start
+
+
+def make_call(name, arguments):
+    return PR.Function(name, [PR.Variable(argument if argument.isidentifier() else '_', None) for argument in arguments])
+
+
+def add_calls(text, start, end, terms):
+    """Function that adds a Function term to terms for every call in a statement
+
+    Calls are found in one pass over the statement, with a stack holding the arguments read so far
+    of every call whose parentheses are still open. Arguments that are plain names become variables
+    of that name, all others variables named '_'.
+    """
+
+    # Most statements only make calls without parentheses in their arguments, one regex reads those
+    flat_calls = _FLAT_CALL_PATTERN.findall(text, start, end)
+    if len(flat_calls) == text.count('(', start, end):
+        for name, argument_text in flat_calls:
+            if name in _NOT_FUNCTION_NAMES:
+                break
+        else:
+            for name, argument_text in flat_calls:
+                if argument_text.strip() == '':
+                    terms.append(make_call(name, []))
+                else:
+                    terms.append(make_call(name, [argument.strip() for argument in argument_text.split(',')]))
+            return
+    calls = []
+    open_calls = []
+    for match in _CALL_PATTERN.finditer(text, start, end):
+        name = match.group(1)
+        char = match.group(2)
+        if name is not None:
+            if name in _NOT_FUNCTION_NAMES:
+                open_calls.append(None)
+            else:
+                open_calls.append([name, len(calls), match.end(), []])
+                calls.append(None)
+        elif char == '(':
+            open_calls.append(None)
+        elif len(open_calls) == 0:
+            continue
+        elif char == ',':
+            if open_calls[-1] is not None:
+                open_calls[-1][3].append(text[open_calls[-1][2]:match.start()].strip())
+                open_calls[-1][2] = match.end()
+        else:
+            call = open_calls.pop()
+            if call is None:
+                continue
+            name, position, argument_start, arguments = call
+            last_argument = text[argument_start:match.start()].strip()
+            if len(arguments) > 0 or last_argument != '':
+                arguments.append(last_argument)
+            calls[position] = make_call(name, arguments)
+    for call in calls:
+        if call is not None:
+            terms.append(call)
+
+
+class CSourceReader:
+
+    def __init__(self, text):
+        self.text = text
+
+
+    def read_methods(self):
+        """Generator that reads the function definitions of the program text
+
+        Yields
+        ------
+        Method
+            each function definition with its calls, loops and conditionals, in source order
+        """
+
+        text = self.text
+        # Statement text runs from statement_start, with the text before skipped comments and
+        # literals kept in statement_parts
+        statement_start = 0
+        statement_parts = []
+        paren_depth = 0
+        # Braces inside parentheses, as in compound literals, do not open blocks
+        paren_brace_depth = 0
+        # Depth inside top level blocks that are not functions, such as structs and initializers
+        skip_depth = 0
+        extern_depth = 0
+        method = None
+        method_body = None
+        # Open blocks of the current method, as the loop or conditional whose body the block is, or
+        # None for other blocks, and the list the terms inside the block are added to
+        open_blocks = []
+        # Set after the body of a do loop, its 'while (...);' is part of the loop
+        after_do = False
+        control_match = _CONTROL_PATTERN.match
+        for match in _TOKEN_PATTERN.finditer(text):
+            kind = match.lastindex
+            if kind != _STRUCTURAL:
+                if kind is None:
+                    continue
+                statement_parts.append(text[statement_start:match.start(kind)])
+                statement_parts.append('""' if kind == _LITERAL else ' ')
+                statement_start = match.end()
+                continue
+
+            char = match.group(_STRUCTURAL)
+            if char == '(':
+                paren_depth = paren_depth + 1
+                continue
+            elif char == ')':
+                if paren_depth > 0:
+                    paren_depth = paren_depth - 1
+                continue
+            elif paren_depth > 0:
+                if char == '{':
+                    paren_brace_depth = paren_brace_depth + 1
+                    continue
+                elif char == '}' and paren_brace_depth > 0:
+                    paren_brace_depth = paren_brace_depth - 1
+                    continue
+                elif char == ';':
+                    continue
+                # A '}' closing a block ends any unbalanced parentheses left open inside it
+                paren_depth = 0
+                paren_brace_depth = 0
+
+            # The statement ends in front of char, it is only copied if comments or literals were cut out
+            if statement_parts:
+                statement_parts.append(text[statement_start:match.end() - 1])
+                statement_text = ''.join(statement_parts)
+                statement_parts = []
+                start = 0
+                end = len(statement_text)
+            else:
+                statement_text = text
+                start = statement_start
+                end = match.end() - 1
+            statement_start = match.end()
+
+            if method is None:
+                statement = statement_text[start:end]
+                if char == '{':
+                    if skip_depth > 0:
+                        skip_depth = skip_depth + 1
+                        continue
+                    method = convert_function_header(statement)
+                    if method is not None:
+                        method_body = []
+                        open_blocks = []
+                        after_do = False
+                    elif statement.lstrip().startswith('extern') and '(' not in statement:
+                        extern_depth = extern_depth + 1
+                    else:
+                        skip_depth = 1
+                elif char == '}':
+                    if skip_depth > 0:
+                        skip_depth = skip_depth - 1
+                    elif extern_depth > 0:
+                        extern_depth = extern_depth - 1
+                continue
+
+            container = open_blocks[-1][1] if open_blocks else method_body
+            has_calls = statement_text.find('(', start, end) >= 0
+            if char == '}':
+                if has_calls:
+                    add_calls(statement_text, start, end, container)
+                if not open_blocks:
+                    method.body = method_body
+                    yield method
+                    method = None
+                    continue
+                block_term = open_blocks.pop()[0]
+                after_do = block_term is not None and block_term.name == 'do'
+                continue
+
+            if after_do:
+                after_do = False
+                if char == ';' and statement_text[start:end].lstrip().startswith('while'):
+                    if has_calls:
+                        add_calls(statement_text, start, end, container)
+                    continue
+            controls = ()
+            rest_start = start
+            if control_match(statement_text, start, end) is not None or statement_text.find(':', start, end) >= 0:
+                controls, rest_start = split_control_keywords(statement_text, start, end)
+            innermost = None
+            for keyword, condition_start, condition_end in controls:
+                # Calls in a condition are made before the loop or conditional is entered
+                if has_calls and condition_start < condition_end:
+                    add_calls(statement_text, condition_start, condition_end, container)
+                innermost = _CONTROL_TERMS[keyword](keyword)
+                container.append(innermost)
+                container = innermost.contents
+            if has_calls and rest_start < end:
+                add_calls(statement_text, rest_start, end, container)
+            if char == ';':
+                # A do loop without braces ends at its first statement
+                after_do = innermost is not None and innermost.name == 'do'
+            else:
+                # The block is the body of the innermost loop or conditional, unless the statement
+                # goes on past it, as in an initializer
+                is_control_block = innermost is not None and statement_text[rest_start:end].strip() == ''
+                open_blocks.append((innermost if is_control_block else None, container))
+
+        if method is not None:
+            method.body = method_body
+            yield method
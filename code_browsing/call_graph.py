@@ -0,0 +1,563 @@
+"""
+Call graph of a program, stored as compressed sparse row (CSR) arrays.
+
+Every function or predicate that is defined or called is a node. Nodes are numbered in the order of
+their (name, arity) keys, with names lowercased since queries are, so a node is found by binary
+search. Since nodes are sorted by name, they also serve as the name index of name: assertions, where
+the nodes whose names share a prefix are consecutive. Symbols are the function or predicate clauses,
+numbered as in the query index. The graph is held in three pairs of offset and value arrays: the
+symbols defining each node, the nodes each symbol calls and the symbols calling each node. The
+callers or callees of a node are read from one slice of these arrays, in time proportional to their
+number rather than to the size of the program.
+
+When a program changes, the symbols of the changed functions or predicates are removed and added again
+under new numbers. Removed symbols keep their numbers but are skipped, and added symbols, along with
+any node they introduce, are kept next to the CSR arrays, so a change costs time proportional to
+the changed symbols.
+
+Transitive queries run on the graph with its strongly connected components collapsed, which are
+found on first use. The components reaching a component are kept as a bitset with one bit per
+component, together with the symbols calling into them, and memoized, so a later search that meets
+the component takes its bitset and symbols instead of walking on.
+"""
+
+import array
+import bisect
+import itertools
+import code_browsing.program_representation as PR
+
+# Larger than any arity, used to find all nodes of a name
+_MAX_ARITY = 1 << 32
+
+
+def parse_symbol_key(value):
+    """Function that reads a NAME/N or NAME assertion value
+
+    Returns
+    -------
+    tuple
+        (name, arity), arity is -1 if the value has none
+
+    Raises
+    ------
+    ValueError
+        if the arity is not a number or the name is empty
+    """
+
+    name, separator, arity = value.rpartition('/')
+    if separator == '':
+        name, arity = value, -1
+    else:
+        arity = int(arity)
+    if name == '' or arity < -1:
+        raise ValueError(value)
+    return name, arity
+
+
+def get_symbol_calls(symbol):
+    # The body summary already counts the calls, bodies without any are not walked
+    if symbol.body_call_count == 0:
+        return ()
+    return PR.collect_body_calls(symbol.body)
+
+
+def iter_group_calls(key, group):
+    if isinstance(group, PR.FactTable):
+        yield key[0], key[1], (), len(group)
+        return
+    for pred in group:
+        yield pred.name, pred.arity, get_symbol_calls(pred), 1
+
+
+def iter_symbol_calls(program_representation, keys=None):
+    # (name, arity, calls, count) for runs of symbols in query index order, or only for the symbols of
+    # the given (name, arity) keys, key by key. Every symbol of a run has the same key and calls, so all
+    # rows of a fact table are a single run.
+    if isinstance(program_representation, PR.PrologProgramRepresentation):
+        if keys is None:
+            for key, group in program_representation.predicate_index.items():
+                yield from iter_group_calls(key, group)
+            return
+        for key in keys:
+            if key in program_representation.predicate_index:
+                yield from iter_group_calls(key, program_representation.predicate_index[key])
+    elif isinstance(program_representation, PR.CProgramRepresentation):
+        if keys is None:
+            functions = program_representation.c_functions
+        else:
+            functions = itertools.chain.from_iterable([program_representation.c_function_index.get(key, []) for key in keys])
+        for func in functions:
+            yield func.name, func.arity, get_symbol_calls(func), 1
+
+
+def get_offsets(counts):
+    # Counts of each node -> CSR offsets, counts[0] must be 0
+    return array.array('I', itertools.accumulate(counts))
+
+
+def build_call_graph(program_representation):
+    """Function that builds the call graph of a representation
+
+    Parameters
+    ----------
+    program_representation : ProgramRepresentation
+        a parsed Prolog, C or Python representation
+
+    Returns
+    -------
+    CallGraph
+        the call graph, with calls to functions or predicates that are not defined in the program
+        as nodes without definitions
+    """
+
+    # Keys are first numbered as they are met, raw_ids maps each key as written to the number of its
+    # lowercased key so every spelling is lowercased once
+    key_ids = {}
+    raw_ids = {}
+
+    def get_key_id(raw_key):
+        key_id = raw_ids.get(raw_key)
+        if key_id is None:
+            key = (raw_key[0].lower(), raw_key[1])
+            key_id = key_ids.setdefault(key, len(key_ids))
+            raw_ids[raw_key] = key_id
+        return key_id
+
+    runs = []
+    for name, arity, calls, count in iter_symbol_calls(program_representation):
+        runs.append((get_key_id((name, arity)), set([get_key_id(call) for call in calls]), count))
+    sorted_keys = sorted(key_ids)
+    num_nodes = len(sorted_keys)
+    nodes = [0] * num_nodes
+    for node, key in enumerate(sorted_keys):
+        nodes[key_ids[key]] = node
+
+    definition_counts = [0] * (num_nodes + 1)
+    caller_counts = [0] * (num_nodes + 1)
+    call_offsets = array.array('I', [0])
+    call_nodes = array.array('I')
+    for i, (key_id, callee_ids, count) in enumerate(runs):
+        node = nodes[key_id]
+        callees = sorted([nodes[callee_id] for callee_id in callee_ids])
+        runs[i] = (node, callees, count)
+        definition_counts[node + 1] = definition_counts[node + 1] + count
+        for callee in callees:
+            caller_counts[callee + 1] = caller_counts[callee + 1] + count
+        if count == 1:
+            call_nodes.extend(callees)
+            call_offsets.append(len(call_nodes))
+        elif len(callees) == 0:
+            call_offsets.extend([len(call_nodes)] * count)
+        else:
+            for _ in range(0, count):
+                call_nodes.extend(callees)
+                call_offsets.append(len(call_nodes))
+
+    # Symbols are visited in order, so the definitions and callers of each node come out sorted
+    definition_offsets = get_offsets(definition_counts)
+    caller_offsets = get_offsets(caller_counts)
+    definition_symbols = array.array('I', bytes(4 * definition_offsets[-1]))
+    caller_symbols = array.array('I', bytes(4 * caller_offsets[-1]))
+    definition_positions = definition_offsets.tolist()
+    caller_positions = caller_offsets.tolist()
+    ordinal = 0
+    for node, callees, count in runs:
+        if count == 1:
+            definition_symbols[definition_positions[node]] = ordinal
+            definition_positions[node] = definition_positions[node] + 1
+            for callee in callees:
+                caller_symbols[caller_positions[callee]] = ordinal
+                caller_positions[callee] = caller_positions[callee] + 1
+            ordinal = ordinal + 1
+            continue
+        ordinals = array.array('I', range(ordinal, ordinal + count))
+        position = definition_positions[node]
+        definition_symbols[position:position + count] = ordinals
+        definition_positions[node] = position + count
+        for callee in callees:
+            position = caller_positions[callee]
+            caller_symbols[position:position + count] = ordinals
+            caller_positions[callee] = position + count
+        ordinal = ordinal + count
+
+    return CallGraph([key[0] for key in sorted_keys], array.array('I', [key[1] for key in sorted_keys]),
+                     definition_offsets, definition_symbols, call_offsets, call_nodes, caller_offsets, caller_symbols)
+
+
+class CallGraph:
+
+    def __init__(self, node_names, node_arities, definition_offsets, definition_symbols, call_offsets, call_nodes, caller_offsets, caller_symbols):
+        # node_names holds the lowercased name of each node, or any value ordered the same way
+        self.node_names = node_names
+        self.node_arities = node_arities
+        self.num_nodes = len(node_arities)
+        # Nodes past the sorted ones were added by changes, added_node_keys holds their
+        # (name, arity, node) keys sorted
+        self.num_sorted_nodes = self.num_nodes
+        self.added_node_keys = []
+        self.definition_offsets = definition_offsets
+        self.definition_symbols = definition_symbols
+        self.call_offsets = call_offsets
+        self.call_nodes = call_nodes
+        self.caller_offsets = caller_offsets
+        self.caller_symbols = caller_symbols
+        self.num_symbols = len(call_offsets) - 1
+        # Definitions and callers added by changes, past those in the CSR arrays, and the symbols removed
+        self.added_definitions = {}
+        self.added_callers = {}
+        self.removed_symbols = bytearray(self.num_symbols)
+        self.num_removed = 0
+        # Strongly connected components and the memoized reachability, set on first use
+        self.component_of = None
+        self.component_reach = {}
+        self.flag_reach = {}
+
+
+    def __getstate__(self):
+        # Components and reachability are derived on first use, snapshots only store the graph
+        state = self.__dict__.copy()
+        for attribute in ['num_components', 'component_offsets', 'component_nodes', 'component_caller_offsets', 'component_callers', 'symbol_nodes']:
+            state.pop(attribute, None)
+        state['component_of'] = None
+        state['component_reach'] = {}
+        state['flag_reach'] = {}
+        return state
+
+
+    def get_name_key(self, name):
+        # Value compared against node_names, None if no node has the name
+        return name
+
+
+    def find_first_node(self, name_key, arity):
+        # First node whose key is not less than (name_key, arity)
+        low = 0
+        high = self.num_sorted_nodes
+        while low < high:
+            middle = (low + high) // 2
+            middle_name = self.node_names[middle]
+            if middle_name < name_key or (middle_name == name_key and self.node_arities[middle] < arity):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+    def find_nodes(self, name, arity=-1):
+        """Function that finds the nodes of a name
+
+        Parameters
+        ----------
+        name : str
+            name of the function or predicate, compared case-insensitively
+        arity : int
+            arity of the function or predicate, -1 for all arities
+
+        Returns
+        -------
+        sequence of int
+            the matching nodes
+        """
+
+        nodes = self.find_sorted_nodes(name.lower(), arity)
+        if len(self.added_node_keys) == 0:
+            return nodes
+        if arity == -1:
+            low = bisect.bisect_left(self.added_node_keys, (name.lower(), -1))
+            high = bisect.bisect_left(self.added_node_keys, (name.lower(), _MAX_ARITY))
+        else:
+            low = bisect.bisect_left(self.added_node_keys, (name.lower(), arity))
+            high = bisect.bisect_left(self.added_node_keys, (name.lower(), arity + 1))
+        return list(nodes) + [key[2] for key in self.added_node_keys[low:high]]
+
+
+    def find_sorted_nodes(self, name, arity):
+        name_key = self.get_name_key(name)
+        if name_key is None:
+            return range(0)
+        if arity == -1:
+            return range(self.find_first_node(name_key, -1), self.find_first_node(name_key, _MAX_ARITY))
+        first_node = self.find_first_node(name_key, arity)
+        if first_node < self.num_sorted_nodes and self.node_names[first_node] == name_key and self.node_arities[first_node] == arity:
+            return range(first_node, first_node + 1)
+        return range(0)
+
+
+    def get_node_name(self, node):
+        return self.node_names[node]
+
+
+    def find_prefix_nodes(self, prefix):
+        """Function that finds the nodes whose names start with a prefix
+
+        Parameters
+        ----------
+        prefix : str
+            lowercased prefix, the empty prefix matches all nodes
+
+        Returns
+        -------
+        sequence of int
+            the matching nodes, sorted nodes first and then nodes added by changes
+        """
+
+        low = 0
+        high = self.num_sorted_nodes
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_node_name(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        first_node = low
+        high = self.num_sorted_nodes
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_node_name(middle).startswith(prefix):
+                low = middle + 1
+            else:
+                high = middle
+        if len(self.added_node_keys) == 0:
+            return range(first_node, low)
+        added_nodes = []
+        for key in self.added_node_keys[bisect.bisect_left(self.added_node_keys, (prefix,)):]:
+            if not key[0].startswith(prefix):
+                break
+            added_nodes.append(key[2])
+        return list(range(first_node, low)) + added_nodes
+
+
+    def get_node_symbols(self, node, offsets, symbols, added_symbols):
+        # Symbols of a node in the CSR arrays followed by those added by changes, without removed ones
+        if node < self.num_sorted_nodes:
+            node_symbols = symbols[offsets[node]:offsets[node + 1]]
+        else:
+            node_symbols = array.array('I')
+        if node in added_symbols:
+            node_symbols = node_symbols + added_symbols[node]
+        if self.num_removed > 0:
+            node_symbols = array.array('I', itertools.filterfalse(self.removed_symbols.__getitem__, node_symbols))
+        return node_symbols
+
+
+    def get_definitions(self, node):
+        return self.get_node_symbols(node, self.definition_offsets, self.definition_symbols, self.added_definitions)
+
+
+    def get_called_nodes(self, ordinal):
+        return self.call_nodes[self.call_offsets[ordinal]:self.call_offsets[ordinal + 1]]
+
+
+    def get_callers(self, node):
+        return self.get_node_symbols(node, self.caller_offsets, self.caller_symbols, self.added_callers)
+
+
+    def get_or_add_node(self, name, arity):
+        nodes = self.find_nodes(name, arity)
+        if len(nodes) > 0:
+            return nodes[0]
+        node = self.num_nodes
+        self.node_names.append(name)
+        self.node_arities.append(arity)
+        self.num_nodes = self.num_nodes + 1
+        bisect.insort(self.added_node_keys, (name, arity, node))
+        return node
+
+
+    def clear_reachability(self):
+        self.component_of = None
+        self.component_reach = {}
+        self.flag_reach = {}
+
+
+    def remove_symbols(self, ordinals):
+        for ordinal in ordinals:
+            if not self.removed_symbols[ordinal]:
+                self.removed_symbols[ordinal] = 1
+                self.num_removed = self.num_removed + 1
+        self.clear_reachability()
+
+
+    def add_symbols(self, symbol_calls):
+        """Function that adds symbols numbered from num_symbols on
+
+        Parameters
+        ----------
+        symbol_calls : iterable of tuple
+            (name, arity, calls, count) runs of symbols, as yielded by iter_symbol_calls
+        """
+
+        for name, arity, calls, count in symbol_calls:
+            node = self.get_or_add_node(name.lower(), arity)
+            callees = sorted(set([self.get_or_add_node(call[0].lower(), call[1]) for call in calls]))
+            ordinals = array.array('I', range(self.num_symbols, self.num_symbols + count))
+            self.added_definitions.setdefault(node, array.array('I')).extend(ordinals)
+            for callee in callees:
+                self.added_callers.setdefault(callee, array.array('I')).extend(ordinals)
+            for _ in range(0, count):
+                self.call_nodes.extend(callees)
+                self.call_offsets.append(len(self.call_nodes))
+            self.removed_symbols.extend(bytes(count))
+            self.num_symbols = self.num_symbols + count
+        self.clear_reachability()
+
+
+    def get_callees(self, node):
+        # Symbols defining the functions or predicates any definition of node calls, sorted
+        callee_nodes = set()
+        for ordinal in self.get_definitions(node):
+            callee_nodes.update(self.get_called_nodes(ordinal))
+        callee_symbols = array.array('I')
+        for callee in sorted(callee_nodes):
+            callee_symbols.extend(self.get_definitions(callee))
+        return array.array('I', sorted(callee_symbols))
+
+
+    def iter_successors(self, node):
+        for ordinal in self.get_definitions(node):
+            yield from self.get_called_nodes(ordinal)
+
+
+    def find_components(self):
+        # Iterative Tarjan's algorithm, components are numbered callees first. Each component's
+        # nodes and the other components calling into it are stored as CSR arrays as well.
+        index = [-1] * self.num_nodes
+        low = [0] * self.num_nodes
+        on_stack = bytearray(self.num_nodes)
+        component_of = array.array('I', bytes(4 * self.num_nodes))
+        component_offsets = array.array('I', [0])
+        component_nodes = array.array('I')
+        stack = []
+        counter = 0
+        for root in range(0, self.num_nodes):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter = counter + 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, self.iter_successors(root))]
+            while len(work) > 0:
+                node, successors = work[-1]
+                for successor in successors:
+                    if index[successor] == -1:
+                        index[successor] = low[successor] = counter
+                        counter = counter + 1
+                        stack.append(successor)
+                        on_stack[successor] = 1
+                        work.append((successor, self.iter_successors(successor)))
+                        break
+                    elif on_stack[successor] and index[successor] < low[node]:
+                        low[node] = index[successor]
+                else:
+                    work.pop()
+                    if len(work) > 0 and low[node] < low[work[-1][0]]:
+                        low[work[-1][0]] = low[node]
+                    if low[node] == index[node]:
+                        component = len(component_offsets) - 1
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            component_of[member] = component
+                            component_nodes.append(member)
+                            if member == node:
+                                break
+                        component_offsets.append(len(component_nodes))
+
+        symbol_nodes = array.array('I', bytes(4 * self.num_symbols))
+        for node in range(0, self.num_nodes):
+            for ordinal in self.get_definitions(node):
+                symbol_nodes[ordinal] = node
+        caller_offsets = array.array('I', [0])
+        caller_components = array.array('I')
+        for component in range(0, len(component_offsets) - 1):
+            callers = set()
+            for node in component_nodes[component_offsets[component]:component_offsets[component + 1]]:
+                callers.update([component_of[symbol_nodes[ordinal]] for ordinal in self.get_callers(node)])
+            callers.discard(component)
+            caller_components.extend(sorted(callers))
+            caller_offsets.append(len(caller_components))
+
+        self.num_components = len(component_offsets) - 1
+        self.component_offsets = component_offsets
+        self.component_nodes = component_nodes
+        self.component_caller_offsets = caller_offsets
+        self.component_callers = caller_components
+        self.symbol_nodes = symbol_nodes
+        self.component_of = component_of
+
+
+    def search_reaching(self, target_components):
+        # Walks from the targets to the components calling them. Returns the bitset of reached
+        # components and the set of symbols calling a node of any of them.
+        reached = bytearray((self.num_components + 7) // 8)
+        symbols = set()
+        pending = []
+        for component in target_components:
+            if not reached[component >> 3] & (1 << (component & 7)):
+                reached[component >> 3] = reached[component >> 3] | (1 << (component & 7))
+                pending.append(component)
+        while len(pending) > 0:
+            component = pending.pop()
+            memoized = self.component_reach.get(component)
+            if memoized is not None:
+                reached = bytearray((int.from_bytes(reached, 'little') | int.from_bytes(memoized[0], 'little')).to_bytes(len(reached), 'little'))
+                symbols.update(memoized[1])
+                continue
+            for node in self.component_nodes[self.component_offsets[component]:self.component_offsets[component + 1]]:
+                symbols.update(self.get_callers(node))
+            for caller in self.component_callers[self.component_caller_offsets[component]:self.component_caller_offsets[component + 1]]:
+                if not reached[caller >> 3] & (1 << (caller & 7)):
+                    reached[caller >> 3] = reached[caller >> 3] | (1 << (caller & 7))
+                    pending.append(caller)
+        return reached, symbols
+
+
+    def get_reaching_symbols(self, node):
+        """Function that finds the symbols with a call path to a node
+
+        Parameters
+        ----------
+        node : int
+            the called function or predicate
+
+        Returns
+        -------
+        array of int
+            sorted symbols calling node, directly or through other calls
+        """
+
+        if self.component_of is None:
+            self.find_components()
+        component = self.component_of[node]
+        if component not in self.component_reach:
+            reached, symbols = self.search_reaching([component])
+            self.component_reach[component] = (bytes(reached), array.array('I', sorted(symbols)))
+        return self.component_reach[component][1]
+
+
+    def get_flag_reaching_symbols(self, body_flags, flag):
+        """Function that finds the symbols whose body or the body of any function or predicate they
+        call, directly or through other calls, has a body summary flag set
+
+        Parameters
+        ----------
+        body_flags : sequence of int
+            body summary flags of every symbol
+        flag : int
+            one of the BODY_CONTAINS_* flags
+
+        Returns
+        -------
+        array of int
+            sorted matching symbols
+        """
+
+        if self.component_of is None:
+            self.find_components()
+        if flag not in self.flag_reach:
+            flagged_symbols = [ordinal for ordinal in range(0, self.num_symbols) if body_flags[ordinal] & flag and not self.removed_symbols[ordinal]]
+            reached, symbols = self.search_reaching(set([self.component_of[self.symbol_nodes[ordinal]] for ordinal in flagged_symbols]))
+            symbols.update(flagged_symbols)
+            self.flag_reach[flag] = array.array('I', sorted(symbols))
+        return self.flag_reach[flag]
@@ -8,4 +8,10 @@ class SCBRedefinedPredicateError(Exception):
     pass
 
 class SCBInvalidQueryError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class SCBPrologSyntaxError(Exception):
+    pass
+
+class SCBShardError(Exception):
+    pass
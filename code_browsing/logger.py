@@ -3,10 +3,19 @@ I pulled this logging module from another project I worked on:
 https://github.com/jwlodek/installSynApps/blob/master/installSynApps/IO/logger.py
 
 Allows for very simple logging to be done.
+
+Once initialize_logger is called, messages are put on a bounded queue and formatted and written by a
+background thread in batches, so logging from hot paths does not wait on stdout or the log file.
+When the queue is full, new messages are dropped by default. close_logger writes all queued messages
+before returning, and the record telling the writer to stop is never dropped.
 """
 
 import os
+import time
+import queue
 import datetime
+import threading
+import contextlib
 
 # Global variable storing function for logging. Function must accept a single string parameter
 _WRITE_FUNCTION = None
@@ -23,27 +32,102 @@ _DEBUG = False
 # Global variable to determine whether or not 
 _WITH_NEW_LINES = True
 
+# Global variables holding the queue of pending log records and the thread writing them
+_RECORD_QUEUE = None
+_WRITER_THREAD = None
+
+# Largest number of records written per batch by the writer thread
+_BATCH_SIZE = 256
+
+# What to do with a record when the queue is full: 'drop_newest', 'drop_oldest' or 'block'
+_OVERFLOW_POLICY = 'drop_newest'
+
+# Number of records dropped because the queue was full
+_DROPPED_RECORDS = 0
+
+# Put on the queue to stop the writer thread
+_STOP_RECORD = None
+
+OVERFLOW_POLICIES = ['drop_newest', 'drop_oldest', 'block']
 
-def initialize_logger():
-    """Function for initializing log-file writing in addition to stdout output
+
+def initialize_logger(log_to_file=True, max_pending_records=10000, batch_size=256, overflow_policy='drop_newest'):
+    """Function for initializing log-file writing in addition to stdout output, and the background writer
+
+    Parameters
+    ----------
+    log_to_file=True : bool
+        whether to also write messages to a file in the logs directory
+    max_pending_records=10000 : int
+        number of messages that can wait to be written before the overflow policy applies
+    batch_size=256 : int
+        largest number of messages written at once
+    overflow_policy='drop_newest' : str
+        drop_newest drops messages logged while the queue is full, drop_oldest drops the oldest
+        queued message instead, and block waits for the writer
     """
 
     global _LOG_FILE
-    try:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        _LOG_FILE = open(os.path.join('logs', 'SCB_{}.log'.format(datetime.datetime.now())), 'w')
-    except OSError:
-        write('Failed to initialize log file...')
+    global _RECORD_QUEUE
+    global _WRITER_THREAD
+    global _BATCH_SIZE
+    global _OVERFLOW_POLICY
+    global _DROPPED_RECORDS
+    if overflow_policy not in OVERFLOW_POLICIES:
+        raise ValueError('Unknown overflow policy {}'.format(overflow_policy))
+    if _WRITER_THREAD is not None:
+        close_logger()
+    if log_to_file:
+        try:
+            if not os.path.exists('logs'):
+                os.mkdir('logs')
+            _LOG_FILE = open(os.path.join('logs', 'SCB_{}.log'.format(datetime.datetime.now())), 'w')
+        except OSError:
+            write('Failed to initialize log file...')
+    _BATCH_SIZE = batch_size
+    _OVERFLOW_POLICY = overflow_policy
+    _DROPPED_RECORDS = 0
+    _RECORD_QUEUE = queue.Queue(maxsize=max_pending_records)
+    _WRITER_THREAD = threading.Thread(target=_run_writer, args=(_RECORD_QUEUE,), name='scb-logger', daemon=True)
+    _WRITER_THREAD.start()
 
 
 def close_logger():
-    """Function that closes the opened logfile
+    """Function that writes all queued messages, stops the background writer and closes the opened logfile
     """
 
     global _LOG_FILE
+    global _RECORD_QUEUE
+    global _WRITER_THREAD
+    if _WRITER_THREAD is not None:
+        # The stop record is always queued, even if that means waiting for the writer
+        _RECORD_QUEUE.put(_STOP_RECORD)
+        _WRITER_THREAD.join()
+        _WRITER_THREAD = None
+        _RECORD_QUEUE = None
+        if _DROPPED_RECORDS > 0:
+            _emit('WARNING - Logger queue was full, {} message(s) were dropped.\n'.format(_DROPPED_RECORDS))
     if _LOG_FILE is not None:
         _LOG_FILE.close()
+        _LOG_FILE = None
+
+
+def flush_logger():
+    """Function that waits until all queued messages have been written
+    """
+
+    record_queue = _RECORD_QUEUE
+    if record_queue is not None:
+        record_queue.join()
+        if _LOG_FILE is not None:
+            _LOG_FILE.flush()
+
+
+def get_dropped_count():
+    """Function that returns the number of messages dropped because the queue was full
+    """
+
+    return _DROPPED_RECORDS
 
 
 def toggle_command_printing():
@@ -111,28 +195,104 @@ def print_command(command):
         write(command, no_timestamp=True)
 
 
-def write(text, no_timestamp=True):
+def trace(event, **fields):
+    """Function for writing structured debug records, only queued while debug logging is enabled
+
+    Parameters
+    ----------
+    event : str
+        name of the traced event
+    **fields
+        values written as key=value pairs after the event name, such as timings
+    """
+
+    if _DEBUG:
+        write(event, no_timestamp=False, fields=fields)
+
+
+@contextlib.contextmanager
+def timed(event, **fields):
+    """Context manager tracing how long its block took, as an elapsed_ms field
+
+    Parameters
+    ----------
+    event : str
+        name of the traced event
+    **fields
+        additional values written with the record
+    """
+
+    if not _DEBUG:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        fields['elapsed_ms'] = (time.perf_counter() - start_time) * 1000
+        trace(event, **fields)
+
+
+def write(text, no_timestamp=True, fields=None):
     """Main logging funcion. Called if write function was set
-    
+
+    With a background writer running the message is only queued, it is formatted and written later.
+
     Parameters
     ----------
     text : str
         debug text to print
     no_timestamp=False : bool
         a flag to disable timestamp printing when required
+    fields=None : dict
+        structured values written as key=value pairs after the text
     """
 
-    global _DEBUG
-    global _WRITE_FUNCTION
-    global _WITH_NEW_LINES
-
+    global _DROPPED_RECORDS
+
+    # Timestamps are only taken here, formatting waits for the writer
+    record = (text, None if not _DEBUG or no_timestamp else time.time(), fields)
+    record_queue = _RECORD_QUEUE
+    if record_queue is None:
+        _emit(_format_record(record))
+        return
+    if _OVERFLOW_POLICY == 'block':
+        record_queue.put(record)
+        return
+    while True:
+        try:
+            record_queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if _OVERFLOW_POLICY == 'drop_newest':
+            _DROPPED_RECORDS = _DROPPED_RECORDS + 1
+            return
+        try:
+            oldest_record = record_queue.get_nowait()
+            record_queue.task_done()
+        except queue.Empty:
+            continue
+        if oldest_record is _STOP_RECORD:
+            # close_logger waits for the writer to take the stop record, so it is never dropped but
+            # queued again behind the newer records
+            record_queue.put(_STOP_RECORD)
+        else:
+            _DROPPED_RECORDS = _DROPPED_RECORDS + 1
+
+
+def _format_record(record):
+    text, timestamp, fields = record
+    if fields:
+        text = '{} {}'.format(text, ' '.join(['{}={}'.format(key, value) for key, value in fields.items()]))
     # remove timestamp if not in use
-    if not _DEBUG or no_timestamp:
-        final_text = '{}\n'.format(text)
-    else:
-        # otherwise add timestamp
-        final_text = '{} - {}\n'.format(datetime.datetime.now(), text)
+    if timestamp is None:
+        return '{}\n'.format(text)
+    # otherwise add timestamp
+    return '{} - {}\n'.format(datetime.datetime.fromtimestamp(timestamp), text)
+
 
+def _emit(final_text):
     # If we are also writing to logfile do that here
     log_write(final_text)
 
@@ -145,6 +305,39 @@ def write(text, no_timestamp=True):
         _WRITE_FUNCTION(final_text)
 
 
+def _run_writer(record_queue):
+    # Waits for one record, then takes whatever else is queued up to the batch size, so a burst of
+    # messages costs one log file write
+    running = True
+    while running:
+        batch = [record_queue.get()]
+        while len(batch) < _BATCH_SIZE:
+            try:
+                batch.append(record_queue.get_nowait())
+            except queue.Empty:
+                break
+        final_texts = []
+        for record in batch:
+            if record is _STOP_RECORD:
+                running = False
+            else:
+                final_texts.append(_format_record(record))
+        try:
+            if _LOG_FILE is not None and len(final_texts) > 0:
+                _LOG_FILE.write(''.join(final_texts))
+                _LOG_FILE.flush()
+            for final_text in final_texts:
+                if not _WITH_NEW_LINES:
+                    final_text = final_text.strip()
+                if _WRITE_FUNCTION is not None:
+                    _WRITE_FUNCTION(final_text)
+        except Exception:
+            # A failing write function must not stop the writer, or flush and close would wait forever
+            pass
+        for record in batch:
+            record_queue.task_done()
+
+
 def log_write(text):
     """Function that writes text to a file
     Parameters
@@ -155,4 +348,4 @@ def log_write(text):
 
     global _LOG_FILE
     if _LOG_FILE is not None:
-        _LOG_FILE.write(text)
\ No newline at end of file
+        _LOG_FILE.write(text)
@@ -0,0 +1,437 @@
+"""
+Read-only, memory-mapped representations of parsed programs.
+
+A parsed representation is written to a flat file holding a sorted string table, one fixed size
+record per function or predicate clause, the input types of every symbol, their body summaries, the
+posting lists of the query index and the arrays of its call graph. Loading the file maps it read-only and reads the sections
+through memoryviews, so processes that load the same program share one copy of its pages, and
+queries run on the posting lists in place. Python objects are only built for the symbols a query
+returns.
+
+    magic | header length | JSON header | padding | sections, each aligned to 8 bytes
+
+The header holds the source file signature the file was written from, the parse statistics and the
+offset, length and item type of every section.
+"""
+
+import os
+import sys
+import json
+import mmap
+import array
+import code_browsing.program_representation as PR
+import code_browsing.query_planner as QUERY_PLANNER
+import code_browsing.call_graph as CALL_GRAPH
+import code_browsing.snapshot as SNAPSHOT
+
+# Must be bumped whenever the layout of the sections changes, and with the snapshot format version
+MAPPED_FORMAT_VERSION = 4
+
+# Magic bytes written at the start of every mapped representation file
+_MAPPED_MAGIC = b'SCBMAP\n\0'
+
+# String id stored for missing strings, such as the return type of a predicate
+NO_STRING = 0xFFFFFFFF
+
+# Number of unsigned ints in each symbol record: name, arity, return type, source file, first input
+SYMBOL_RECORD_SIZE = 5
+
+# Posting list kinds, each posting key record is kind, three key values, offset and length
+POSTING_ARITY = 0
+POSTING_RETURN = 1
+POSTING_INPUT = 2
+POSTING_BODY = 3
+POSTING_KEY_SIZE = 6
+
+
+def get_mapped_path(program_path, snapshot_dir=None):
+    return '{}.map'.format(os.path.splitext(SNAPSHOT.get_snapshot_path(program_path, snapshot_dir=snapshot_dir))[0])
+
+
+def build_sections(program_representation):
+    # Numbers symbols the same way the query index does, and reuses its posting lists
+    query_index = QUERY_PLANNER.QueryIndex(program_representation)
+    symbols = [query_index.get_symbol(ordinal) for ordinal in range(0, query_index.num_symbols)]
+    strings = set()
+    for symbol in symbols:
+        strings.add(symbol.name)
+        strings.add(symbol.source_file)
+        strings.add(getattr(symbol, 'return_type', None))
+        for term in symbol.set_of_terms:
+            strings.add(PR.get_term_input_type(term))
+    strings.update(query_index.return_postings.keys())
+    strings.update([key[2] for key in query_index.input_postings.keys()])
+    strings.update(query_index.call_graph.node_names)
+    strings.discard(None)
+    # Sorted so names can be found by binary search
+    string_list = sorted(strings)
+    string_ids = dict([(string, i) for i, string in enumerate(string_list)])
+    string_ids[None] = NO_STRING
+
+    string_data = bytearray()
+    string_offsets = array.array('I', [0])
+    for string in string_list:
+        string_data.extend(string.encode('utf-8'))
+        string_offsets.append(len(string_data))
+
+    symbol_records = array.array('I')
+    inputs = array.array('I')
+    body_depths = array.array('I')
+    body_calls = array.array('I')
+    name_counts = [0] * (len(string_list) + 1)
+    for symbol in symbols:
+        symbol_records.extend([string_ids[symbol.name], symbol.arity, string_ids[getattr(symbol, 'return_type', None)],
+                               string_ids[symbol.source_file], len(inputs)])
+        inputs.extend([string_ids[PR.get_term_input_type(term)] for term in symbol.set_of_terms])
+        body_depths.append(symbol.body_depth)
+        body_calls.append(symbol.body_call_count)
+        name_counts[string_ids[symbol.name] + 1] = name_counts[string_ids[symbol.name] + 1] + 1
+
+    # Symbols of each name, grouped by name id in symbol order
+    name_offsets = array.array('I', [0] * (len(string_list) + 1))
+    for i in range(1, len(name_offsets)):
+        name_offsets[i] = name_offsets[i - 1] + name_counts[i]
+    name_symbols = array.array('I', bytes(4 * len(symbols)))
+    name_positions = array.array('I', name_offsets)
+    for ordinal in range(0, len(symbols)):
+        name_id = symbol_records[ordinal * SYMBOL_RECORD_SIZE]
+        name_symbols[name_positions[name_id]] = ordinal
+        name_positions[name_id] = name_positions[name_id] + 1
+
+    posting_keys = array.array('I')
+    postings = array.array('I')
+
+    def add_postings(kind, key_values, ordinals):
+        posting_keys.extend([kind] + key_values + [len(postings), len(ordinals)])
+        postings.extend(ordinals)
+
+    for arity, ordinals in query_index.arity_postings.items():
+        add_postings(POSTING_ARITY, [arity, 0, 0], ordinals)
+    for return_type, ordinals in query_index.return_postings.items():
+        add_postings(POSTING_RETURN, [string_ids[return_type], 0, 0], ordinals)
+    for (arity, position, input_type), ordinals in query_index.input_postings.items():
+        add_postings(POSTING_INPUT, [arity, position, string_ids[input_type]], ordinals)
+    for flag, ordinals in query_index.body_postings.items():
+        add_postings(POSTING_BODY, [flag, 0, 0], ordinals)
+
+    call_graph = query_index.call_graph
+    # Call graph nodes are sorted by name and the string table is sorted, so nodes stay sorted by name id
+    node_names = array.array('I', [string_ids[name] for name in call_graph.node_names])
+
+    return query_index.num_symbols, [
+        ('string_offsets', string_offsets),
+        ('string_data', array.array('B', string_data)),
+        ('symbols', symbol_records),
+        ('inputs', inputs),
+        ('body_flags', query_index.body_flags),
+        ('body_depths', body_depths),
+        ('body_calls', body_calls),
+        ('name_offsets', name_offsets),
+        ('name_symbols', name_symbols),
+        ('posting_keys', posting_keys),
+        ('postings', postings),
+        ('call_node_names', node_names),
+        ('call_node_arities', call_graph.node_arities),
+        ('definition_offsets', call_graph.definition_offsets),
+        ('definition_symbols', call_graph.definition_symbols),
+        ('call_offsets', call_graph.call_offsets),
+        ('call_nodes', call_graph.call_nodes),
+        ('caller_offsets', call_graph.caller_offsets),
+        ('caller_symbols', call_graph.caller_symbols),
+    ]
+
+
+def write_mapped_representation(program_path, source_signature, program_representation, snapshot_dir=None):
+    """Function that writes the flat, mappable layout of a representation to disk
+
+    Parameters
+    ----------
+    program_path : str
+        path to the program file or directory that was parsed
+    source_signature : list of tuple
+        output of snapshot.get_representation_signature for the parsed representation
+    program_representation : ProgramRepresentation
+        the parsed representation
+
+    Returns
+    -------
+    bool
+        True if the file was written, False otherwise
+    """
+
+    if isinstance(program_representation, PR.PrologProgramRepresentation):
+        search_type, language = 'predicate', 'Prolog'
+    elif isinstance(program_representation, PR.PythonProgramRepresentation):
+        search_type, language = 'function', 'Python'
+    elif isinstance(program_representation, PR.CProgramRepresentation):
+        search_type, language = 'function', 'C'
+    else:
+        return False
+    num_symbols, sections = build_sections(program_representation)
+    header = {
+        'format_version': MAPPED_FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'program_path': os.path.abspath(program_path),
+        'source_signature': source_signature,
+        'representation_name': program_representation.representation_name,
+        'description': program_representation.description,
+        'search_type': search_type,
+        'language': language,
+        'num_symbols': num_symbols,
+        'file_parse_times': program_representation.file_parse_times,
+        'type_inference_count': program_representation.type_inference_count,
+        'type_inference_time': program_representation.type_inference_time,
+        'body_summary_count': program_representation.body_summary_count,
+        'body_summary_time': program_representation.body_summary_time,
+        'sections': {},
+    }
+    # Section offsets are relative to the end of the padded header, so they do not depend on its length
+    offset = 0
+    for name, values in sections:
+        header['sections'][name] = [offset, len(values), values.typecode]
+        offset = offset + len(values) * values.itemsize
+        offset = offset + (-offset % 8)
+
+    if snapshot_dir is None:
+        snapshot_dir = SNAPSHOT.get_snapshot_directory()
+    mapped_path = get_mapped_path(program_path, snapshot_dir=snapshot_dir)
+    temp_path = '{}.{}.tmp'.format(mapped_path, os.getpid())
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes = header_bytes + b' ' * (-(len(_MAPPED_MAGIC) + 4 + len(header_bytes)) % 8)
+    try:
+        SNAPSHOT.make_snapshot_directory(snapshot_dir)
+        with open(temp_path, 'wb') as mapped_fp:
+            mapped_fp.write(_MAPPED_MAGIC)
+            mapped_fp.write(len(header_bytes).to_bytes(4, 'little'))
+            mapped_fp.write(header_bytes)
+            for name, values in sections:
+                values.tofile(mapped_fp)
+                mapped_fp.write(bytes(-(len(values) * values.itemsize) % 8))
+        os.replace(temp_path, mapped_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def load_mapped_representation(program_path, source_signature, snapshot_dir=None):
+    """Function that maps a mapped representation file if it is still valid
+
+    Parameters
+    ----------
+    program_path : str
+        path to the program file or directory
+    source_signature : list of tuple
+        output of snapshot.get_source_signature for the current state of the sources
+
+    Returns
+    -------
+    MappedRepresentation
+        a view of the file, or None if there is no valid file
+    """
+
+    mapped_path = get_mapped_path(program_path, snapshot_dir=snapshot_dir)
+    if not os.path.exists(mapped_path):
+        return None
+    try:
+        with open(mapped_path, 'rb') as mapped_fp:
+            if mapped_fp.read(len(_MAPPED_MAGIC)) != _MAPPED_MAGIC:
+                return None
+            header_length = int.from_bytes(mapped_fp.read(4), 'little')
+            header = json.loads(mapped_fp.read(header_length).decode('utf-8'))
+            if header.get('format_version') != MAPPED_FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+                return None
+            if header.get('source_signature') != [list(entry) for entry in source_signature]:
+                return None
+            mapping = mmap.mmap(mapped_fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, UnicodeDecodeError):
+        return None
+    return MappedRepresentation(mapping, header, len(_MAPPED_MAGIC) + 4 + header_length)
+
+
+class MappedSymbol:
+    # A function or predicate clause built from its record, only for symbols returned by queries
+
+    def __init__(self, kind, name, arity, return_type, input_types, source_file, body_flags, body_depth, body_call_count):
+        self.kind = kind
+        self.name = name
+        self.arity = arity
+        self.return_type = return_type
+        self.input_types = input_types
+        self.source_file = source_file
+        self.body_flags = body_flags
+        self.body_depth = body_depth
+        self.body_call_count = body_call_count
+
+    def to_dict(self):
+        if self.kind == 'function':
+            return {'kind': 'function', 'name': self.name, 'arity': self.arity, 'returns': self.return_type,
+                    'inputs': self.input_types, 'source_file': self.source_file}
+        return {'kind': 'predicate', 'name': self.name, 'arity': self.arity, 'inputs': self.input_types, 'source_file': self.source_file}
+
+    def print_term(self, fp=sys.stdout, verbosity='standard'):
+        if verbosity == 'low':
+            if self.kind == 'function':
+                fp.write('Function Name: {} Function arity: {} Returns: {}\n'.format(self.name, self.arity, self.return_type))
+            else:
+                fp.write('Predicate Name: {} Predicate arity: {}\n'.format(self.name, self.arity))
+            return
+        # Bodies are not stored in the mapped layout, only their summaries
+        fp.write('{} Name: {}\n'.format(self.kind.capitalize(), self.name))
+        fp.write('{} of arity {}\n'.format(self.kind.capitalize(), self.arity))
+        if self.kind == 'function':
+            fp.write('Returns: {}\n'.format(self.return_type))
+        fp.write('Input types: {}\n'.format(', '.join([str(input_type) for input_type in self.input_types])))
+        fp.write('Body contains calls: {}, loops: {}, conditionals: {}\n'.format(self.body_flags & PR.BODY_CONTAINS_CALL != 0,
+                                                                                self.body_flags & PR.BODY_CONTAINS_LOOP != 0,
+                                                                                self.body_flags & PR.BODY_CONTAINS_CONDITIONAL != 0))
+        fp.write('Source file: {}\n'.format(self.source_file))
+
+
+class MappedRepresentation:
+    # Read-only view of a mapped representation file, used in place of a parsed representation
+
+    def __init__(self, mapping, header, data_start):
+        self.mapping = mapping
+        self.mapped_size = len(mapping)
+        self.view = memoryview(mapping)
+        self.data_start = data_start
+        self.sections = header['sections']
+        self.representation_name = header['representation_name']
+        self.description = header['description']
+        self.search_type = header['search_type']
+        self.language = header['language']
+        self.num_symbols = header['num_symbols']
+        self.source_files = dict([(entry[0], (entry[1], entry[2])) for entry in header['source_signature']])
+        self.file_parse_times = header['file_parse_times']
+        self.type_inference_count = header['type_inference_count']
+        self.type_inference_time = header['type_inference_time']
+        self.body_summary_count = header['body_summary_count']
+        self.body_summary_time = header['body_summary_time']
+        # A mapped representation never changes, a reload maps a new file
+        self.generation = 0
+        self.string_offsets = self.get_section('string_offsets')
+        self.string_data = self.get_section('string_data')
+        self.symbols = self.get_section('symbols')
+        self.inputs = self.get_section('inputs')
+        self.body_flags = self.get_section('body_flags')
+        self.body_depths = self.get_section('body_depths')
+        self.body_calls = self.get_section('body_calls')
+        self.name_offsets = self.get_section('name_offsets')
+        self.name_symbols = self.get_section('name_symbols')
+        self.posting_keys = self.get_section('posting_keys')
+        self.postings = self.get_section('postings')
+
+    def get_section(self, name):
+        offset, length, typecode = self.sections[name]
+        start = self.data_start + offset
+        section = self.view[start:start + length * array.array(typecode).itemsize]
+        return section.cast(typecode)
+
+    def get_change_generation(self, arity):
+        return 0
+
+    def get_string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]]).decode('utf-8')
+
+    def find_string(self, value):
+        # Binary search of the sorted string table, None if the string is not in the program
+        low = 0
+        high = len(self.string_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_string(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.string_offsets) - 1 and self.get_string(low) == value:
+            return low
+        return None
+
+    def get_symbol(self, ordinal):
+        record_start = ordinal * SYMBOL_RECORD_SIZE
+        name_id, arity, return_id, source_id, input_start = self.symbols[record_start:record_start + SYMBOL_RECORD_SIZE]
+        input_types = [self.get_string(string_id) for string_id in self.inputs[input_start:input_start + arity]]
+        return MappedSymbol(self.search_type, self.get_string(name_id), arity, self.get_string(return_id), input_types,
+                            self.get_string(source_id), self.body_flags[ordinal], self.body_depths[ordinal], self.body_calls[ordinal])
+
+    def iter_postings(self):
+        # (kind, key values, posting list) for every posting list, the lists are views of the mapping
+        for i in range(0, len(self.posting_keys), POSTING_KEY_SIZE):
+            kind, first, second, third, offset, length = self.posting_keys[i:i + POSTING_KEY_SIZE]
+            yield kind, (first, second, third), self.postings[offset:offset + length]
+
+    def lookup_symbols(self, name, arity=-1):
+        name_id = self.find_string(name)
+        if name_id is None:
+            return []
+        matching_symbols = []
+        for ordinal in self.name_symbols[self.name_offsets[name_id]:self.name_offsets[name_id + 1]]:
+            if arity == -1 or self.symbols[ordinal * SYMBOL_RECORD_SIZE + 1] == arity:
+                matching_symbols.append(self.get_symbol(ordinal))
+        return matching_symbols
+
+    def count_predicates(self):
+        return self.num_symbols
+
+    def print_representation(self, fp=sys.stdout):
+        fp.write('{} w/ {} {}s (memory-mapped)\n{}\n'.format(self.representation_name, self.num_symbols, self.search_type, self.description))
+        for ordinal in range(0, self.num_symbols):
+            self.get_symbol(ordinal).print_term(fp=fp)
+
+
+class MappedCallGraph(CALL_GRAPH.CallGraph):
+    # The call graph of a mapped representation, its arrays are views of the mapping and node names
+    # are string ids
+
+    def __init__(self, program_representation):
+        self.program_representation = program_representation
+        CALL_GRAPH.CallGraph.__init__(self, *[program_representation.get_section(name) for name in
+                                              ['call_node_names', 'call_node_arities', 'definition_offsets', 'definition_symbols',
+                                               'call_offsets', 'call_nodes', 'caller_offsets', 'caller_symbols']])
+
+
+    def get_name_key(self, name):
+        return self.program_representation.find_string(name)
+
+
+    def get_node_name(self, node):
+        return self.program_representation.get_string(self.node_names[node])
+
+
+class MappedQueryIndex(QUERY_PLANNER.QueryIndex):
+    # The query index of a mapped representation. Posting lists and body flags are views of the
+    # mapping, so planning and evaluating queries reads the shared pages directly.
+
+    def __init__(self, program_representation):
+        self.program_representation = program_representation
+        self.num_symbols = program_representation.num_symbols
+        self.groups = []
+        self.group_bases = []
+        self.arity_postings = {}
+        self.return_postings = {}
+        self.input_postings = {}
+        self.body_flags = program_representation.body_flags
+        self.body_postings = {}
+        for kind, key_values, postings in program_representation.iter_postings():
+            if kind == POSTING_ARITY:
+                self.arity_postings[key_values[0]] = postings
+            elif kind == POSTING_RETURN:
+                self.return_postings[program_representation.get_string(key_values[0])] = postings
+            elif kind == POSTING_INPUT:
+                self.input_postings[(key_values[0], key_values[1], program_representation.get_string(key_values[2]))] = postings
+            elif kind == POSTING_BODY:
+                self.body_postings[key_values[0]] = postings
+        self.call_graph = MappedCallGraph(program_representation)
+
+
+    def apply_changes(self):
+        # The mapping is read-only, a changed program is written and mapped again
+        return False
+
+
+    def get_symbol(self, ordinal):
+        return self.program_representation.get_symbol(ordinal)
@@ -0,0 +1,262 @@
+"""
+Performance metrics of a query shell.
+
+Collects parse and type inference times recorded on the loaded representation, an estimate of the
+memory it holds, query latencies and cache hit rates into one dictionary, which the shell prints
+with shell info. and exports as JSON or in the Prometheus text format.
+"""
+
+import gc
+import sys
+import time
+import types
+import collections
+import code_browsing.mapped_index as MAPPED_INDEX
+
+# Upper bounds of the query latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Objects that are shared with the rest of the interpreter and not counted as representation memory
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+class LatencyHistogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        # counts[i] is the number of observations no larger than buckets[i], the last entry counts the rest
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total_count = 0
+        self.total_seconds = 0.0
+
+    def observe(self, seconds):
+        position = len(self.buckets)
+        for i, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                position = i
+                break
+        self.counts[position] = self.counts[position] + 1
+        self.total_count = self.total_count + 1
+        self.total_seconds = self.total_seconds + seconds
+
+    def cumulative_counts(self):
+        cumulative = []
+        running_count = 0
+        for count in self.counts:
+            running_count = running_count + count
+            cumulative.append(running_count)
+        return cumulative
+
+    def to_dict(self):
+        bucket_labels = [str(upper_bound) for upper_bound in self.buckets] + ['+Inf']
+        return {'buckets': dict(zip(bucket_labels, self.cumulative_counts())), 'count': self.total_count, 'sum': self.total_seconds}
+
+
+class QueryMetrics:
+
+    def __init__(self, num_recent=100, num_slowest=5):
+        # Latency of every find query, and the most recent queries to pick the slowest ones from
+        self.latency = LatencyHistogram()
+        self.recent_queries = collections.deque(maxlen=num_recent)
+        self.num_slowest = num_slowest
+        self.num_errors = 0
+        self.memory_estimate = (None, -1, 0)
+
+    def record_query(self, query, seconds):
+        self.latency.observe(seconds)
+        self.recent_queries.append((seconds, query))
+
+    def record_error(self):
+        self.num_errors = self.num_errors + 1
+
+    def get_slowest_queries(self):
+        slowest = sorted(self.recent_queries, key=lambda entry: entry[0], reverse=True)[:self.num_slowest]
+        return [{'query': query, 'ms': seconds * 1000} for seconds, query in slowest]
+
+    def get_representation_size(self, program_representation):
+        # Walking the representation is slow for large programs, so the estimate is reused until it changes
+        representation_id, generation, size = self.memory_estimate
+        if representation_id != id(program_representation) or generation != program_representation.generation:
+            size = estimate_representation_size(program_representation)
+            self.memory_estimate = (id(program_representation), program_representation.generation, size)
+        return size
+
+
+def estimate_representation_size(program_representation):
+    """Function that estimates the memory held by a program representation
+
+    Sums sys.getsizeof over every object reachable from the representation, counting shared objects
+    once. Interned strings and small integers shared with the rest of the interpreter are counted too.
+
+    Parameters
+    ----------
+    program_representation : ProgramRepresentation
+        representation to measure
+
+    Returns
+    -------
+    int
+        estimated size in bytes
+    """
+
+    seen = set()
+    pending = [program_representation]
+    total_size = 0
+    while len(pending) > 0:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total_size = total_size + sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total_size
+
+
+def collect_metrics(query_shell):
+    """Function that collects the metrics of a query shell into one dictionary
+
+    Parameters
+    ----------
+    query_shell : QueryShell
+        shell to collect metrics from
+
+    Returns
+    -------
+    dict
+        program, parse, memory, query and cache metrics
+    """
+
+    program_representation = query_shell.program_representation
+    engine = query_shell.engine
+    query_metrics = query_shell.query_metrics
+    query_cache = engine.query_cache
+    result_cache = engine.result_cache
+    file_parse_times = program_representation.file_parse_times
+    return {
+        'timestamp': time.time(),
+        'program': {
+            'path': query_shell.program_path,
+            'language': query_shell.representation_language,
+            'generation': program_representation.generation,
+            'files': len(program_representation.source_files),
+            'symbols': engine.query_index.count_symbols(),
+        },
+        'parse': {
+            'total_seconds': sum(file_parse_times.values()),
+            'file_seconds': dict(file_parse_times),
+            'type_inference_clauses': program_representation.type_inference_count,
+            'type_inference_seconds': program_representation.type_inference_time,
+            'body_summaries': program_representation.body_summary_count,
+            'body_summary_seconds': program_representation.body_summary_time,
+        },
+        'memory': {
+            'representation_bytes': query_metrics.get_representation_size(program_representation),
+            'mapped_bytes': program_representation.mapped_size if isinstance(program_representation, MAPPED_INDEX.MappedRepresentation) else 0,
+        },
+        'queries': {
+            'latency_seconds': query_metrics.latency.to_dict(),
+            'errors': query_metrics.num_errors,
+            'slowest_recent': query_metrics.get_slowest_queries(),
+        },
+        'caches': {
+            'compiled_queries': {'entries': len(query_cache.compiled_queries), 'max_entries': query_cache.max_size,
+                                 'hits': query_cache.hits, 'misses': query_cache.misses},
+            'results': {'entries': len(result_cache.entries), 'bytes': result_cache.current_bytes, 'max_bytes': result_cache.max_bytes,
+                        'hits': result_cache.hits, 'misses': result_cache.misses,
+                        'evictions': result_cache.evictions, 'invalidations': result_cache.invalidations},
+        },
+    }
+
+
+def get_hit_rate(hits, misses):
+    if hits + misses == 0:
+        return 0.0
+    return hits / (hits + misses)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(metrics):
+    """Function that formats collected metrics in the Prometheus text exposition format
+
+    Parameters
+    ----------
+    metrics : dict
+        metrics returned by collect_metrics
+
+    Returns
+    -------
+    str
+        one sample per line, with HELP and TYPE lines for each metric
+    """
+
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for suffix, labels, value in samples:
+            label_str = ''
+            if len(labels) > 0:
+                label_str = '{' + ','.join(['{}="{}"'.format(key, escape_label(label)) for key, label in labels]) + '}'
+            lines.append('{}{}{} {}'.format(name, suffix, label_str, repr(float(value))))
+
+    program_labels = [('language', metrics['program']['language'])]
+    parse = metrics['parse']
+    add_metric('scb_program_generation', 'gauge', 'Number of times the loaded program was changed.', [('', program_labels, metrics['program']['generation'])])
+    add_metric('scb_program_files', 'gauge', 'Number of source files in the loaded program.', [('', program_labels, metrics['program']['files'])])
+    add_metric('scb_program_symbols', 'gauge', 'Number of functions or predicate clauses in the loaded program.', [('', program_labels, metrics['program']['symbols'])])
+    add_metric('scb_representation_bytes', 'gauge', 'Estimated memory held by the program representation.', [('', [], metrics['memory']['representation_bytes'])])
+    add_metric('scb_mapped_bytes', 'gauge', 'Size of the memory-mapped representation file, shared between processes.', [('', [], metrics['memory']['mapped_bytes'])])
+    add_metric('scb_parse_seconds', 'gauge', 'Time spent parsing all source files.', [('', [], parse['total_seconds'])])
+    add_metric('scb_file_parse_seconds', 'gauge', 'Time spent parsing each source file.',
+               [('', [('file', file_path)], seconds) for file_path, seconds in sorted(parse['file_seconds'].items())])
+    add_metric('scb_type_inference_seconds', 'gauge', 'Time spent inferring and reconciling variable types.', [('', [], parse['type_inference_seconds'])])
+    add_metric('scb_type_inference_clauses', 'gauge', 'Number of clauses whose variable types were inferred.', [('', [], parse['type_inference_clauses'])])
+    add_metric('scb_body_summary_seconds', 'gauge', 'Time spent computing body summaries.', [('', [], parse['body_summary_seconds'])])
+
+    latency = metrics['queries']['latency_seconds']
+    latency_samples = [('_bucket', [('le', bucket)], count) for bucket, count in latency['buckets'].items()]
+    latency_samples.append(('_sum', [], latency['sum']))
+    latency_samples.append(('_count', [], latency['count']))
+    add_metric('scb_query_duration_seconds', 'histogram', 'Latency of find queries.', latency_samples)
+    add_metric('scb_query_errors_total', 'counter', 'Number of queries that could not be parsed.', [('', [], metrics['queries']['errors'])])
+
+    caches = sorted(metrics['caches'].items())
+    add_metric('scb_cache_entries', 'gauge', 'Number of entries in each cache.', [('', [('cache', name)], cache['entries']) for name, cache in caches])
+    add_metric('scb_cache_hits_total', 'counter', 'Number of cache lookups that were hits.', [('', [('cache', name)], cache['hits']) for name, cache in caches])
+    add_metric('scb_cache_misses_total', 'counter', 'Number of cache lookups that were misses.', [('', [('cache', name)], cache['misses']) for name, cache in caches])
+    return '\n'.join(lines) + '\n'
+
+
+def print_metrics(metrics, fp=sys.stdout):
+    program = metrics['program']
+    parse = metrics['parse']
+    queries = metrics['queries']
+    latency = queries['latency_seconds']
+    caches = metrics['caches']
+    fp.write('Representation: {} file(s), {} symbol(s), about {:.1f} MiB in memory\n'.format(program['files'], program['symbols'],
+                                                                                     metrics['memory']['representation_bytes'] / (1024 * 1024)))
+    fp.write('Parse time: {:.1f} ms over {} file(s), type inference: {:.1f} ms for {} clause(s)\n'.format(parse['total_seconds'] * 1000, len(parse['file_seconds']),
+                                                                                                        parse['type_inference_seconds'] * 1000,
+                                                                                                        parse['type_inference_clauses']))
+    slowest_files = sorted(parse['file_seconds'].items(), key=lambda entry: entry[1], reverse=True)[:5]
+    for file_path, seconds in slowest_files:
+        fp.write('    {:>10.1f} ms  {}\n'.format(seconds * 1000, file_path))
+    fp.write('Queries run: {}, errors: {}, mean latency: {:.2f} ms\n'.format(latency['count'], queries['errors'],
+                                                                         latency['sum'] * 1000 / max(latency['count'], 1)))
+    previous_count = 0
+    for bucket, count in latency['buckets'].items():
+        if count > previous_count:
+            fp.write('    <= {:>7} s: {}\n'.format(bucket, count - previous_count))
+        previous_count = count
+    for cache_name in ['compiled_queries', 'results']:
+        cache = caches[cache_name]
+        fp.write('Cache {}: {:.1%} hit rate ({} hits, {} misses)\n'.format(cache_name, get_hit_rate(cache['hits'], cache['misses']),
+                                                                         cache['hits'], cache['misses']))
+    if len(queries['slowest_recent']) > 0:
+        fp.write('Slowest recent queries:\n')
+        for entry in queries['slowest_recent']:
+            fp.write('    {:>10.2f} ms  {}\n'.format(entry['ms'], entry['query']))
@@ -0,0 +1,117 @@
+r"""
+Name patterns of name: assertions.
+
+A value is an exact name, a glob such as search_* or get_?d, or a regular expression written
+between slashes such as /(get|set)_\w+/. Globs and regular expressions must match the whole name.
+Regular expressions keep the case they were written in, since escapes such as \S and \s differ, and
+are matched ignoring case. Every pattern has a literal prefix that all matching names start with, so
+matching names are found by binary search over a sorted name index and only names sharing the prefix
+are tested.
+"""
+
+import re
+import fnmatch
+
+_GLOB_CHARACTERS = '*?['
+
+# Characters that end the literal prefix of a regular expression
+_REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]()|\\')
+_REGEX_OPTIONAL_QUANTIFIERS = frozenset('*?{')
+
+
+def has_top_level_alternation(regex):
+    # A | outside of groups and classes means matches need not share the first branch's prefix
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\':
+            i = i + 1
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            if regex[i + 1:i + 2] == ']':
+                i = i + 1
+        elif char == '(':
+            depth = depth + 1
+        elif char == ')':
+            depth = depth - 1
+        elif char == '|' and depth == 0:
+            return True
+        i = i + 1
+    return False
+
+
+def get_regex_literal_prefix(regex):
+    """Function that finds the characters every match of a regular expression starts with
+
+    Parameters
+    ----------
+    regex : str
+        the regular expression, matched against whole names
+
+    Returns
+    -------
+    str
+        the literal prefix, possibly empty
+    """
+
+    if has_top_level_alternation(regex):
+        return ''
+    prefix = []
+    i = 0
+    if regex.startswith('^'):
+        i = 1
+    while i < len(regex):
+        char = regex[i]
+        length = 1
+        if char == '\\':
+            # Escaped punctuation is literal, escapes such as \w or \d are classes
+            if i + 1 >= len(regex) or regex[i + 1].isalnum() or regex[i + 1] == '_':
+                break
+            char = regex[i + 1]
+            length = 2
+        elif char in _REGEX_SPECIAL_CHARACTERS:
+            break
+        following = regex[i + length:i + length + 1]
+        if following != '' and following in _REGEX_OPTIONAL_QUANTIFIERS:
+            break
+        prefix.append(char)
+        if following == '+':
+            break
+        i = i + length
+    return ''.join(prefix)
+
+
+class NamePattern:
+
+    def __init__(self, value):
+        # Raises ValueError for unterminated or invalid regular expressions
+        self.exact = False
+        self.regex = None
+        if value.startswith('/'):
+            if len(value) < 2 or not value.endswith('/'):
+                raise ValueError(value)
+            try:
+                self.regex = re.compile(value[1:-1], re.IGNORECASE)
+            except re.error:
+                raise ValueError(value)
+            self.prefix = get_regex_literal_prefix(value[1:-1]).lower()
+            return
+        glob_start = min([value.find(char) for char in _GLOB_CHARACTERS if char in value], default=-1)
+        if glob_start == -1:
+            self.exact = True
+            self.prefix = value
+            return
+        self.prefix = value[:glob_start]
+        # A glob ending in its only * is a plain prefix, every name sharing the prefix matches
+        if value[glob_start:] != '*':
+            self.regex = re.compile(fnmatch.translate(value))
+
+
+    def matches(self, name):
+        if self.exact:
+            return name == self.prefix
+        return self.regex is None or self.regex.fullmatch(name) is not None
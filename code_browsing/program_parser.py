@@ -1,34 +1,109 @@
 import os
-import re
+import ast
 import sys
+import time
+import functools
+import multiprocessing
 import code_browsing.errors as SCBErrors
+import code_browsing.c_reader as C_READER
 import code_browsing.program_representation as PR
+import code_browsing.prolog_reader as PROLOG_READER
 
 
-def create_parser(program_path):
+def create_parser(program_path, num_workers=1):
     if os.path.isfile(program_path):
         ext = program_path.split('.', -1)[-1]
         if ext == 'pl' or ext == 'P':
-            return PrologProgramParser()
+            return PrologProgramParser(num_workers=num_workers)
         elif ext == 'c':
-            return CProgramParser()
+            return CProgramParser(num_workers=num_workers)
         elif ext == 'py':
-            return None
-    return PrologProgramParser()
-    
+            return PythonProgramParser(num_workers=num_workers)
+    elif os.path.isdir(program_path):
+        return detect_directory_parser(program_path)(num_workers=num_workers)
+    return PrologProgramParser(num_workers=num_workers)
+
+
+def detect_directory_parser(program_path):
+    # Directories are parsed in the language most of their source files are written in, Prolog if none
+    file_counts = {PrologProgramParser: 0, CProgramParser: 0, PythonProgramParser: 0}
+    for root, dirs, files in os.walk(program_path):
+        for file_name in files:
+            if file_name.endswith(('.pl', '.P')):
+                file_counts[PrologProgramParser] = file_counts[PrologProgramParser] + 1
+            elif file_name.endswith('.c'):
+                file_counts[CProgramParser] = file_counts[CProgramParser] + 1
+            elif file_name.endswith('.py'):
+                file_counts[PythonProgramParser] = file_counts[PythonProgramParser] + 1
+    parser_class = PrologProgramParser
+    for candidate_class in [CProgramParser, PythonProgramParser]:
+        if file_counts[candidate_class] > file_counts[parser_class]:
+            parser_class = candidate_class
+    return parser_class
+
+
+def parse_partial_representation(parser_class, file_path):
+    # Parses a single file without cross-clause reconciliation. Used by pool workers and incremental
+    # refreshes, the reconciliation is done once the partial representation is merged.
+    parser = parser_class()
+    parser.reconcile_symbols = False
+    parser.parse_program(file_path)
+    return parser.program_representation
+
+
 class ProgramParser:
 
-    def __init__(self, extension):
+    def __init__(self, extension, num_workers=1):
         self.extension = extension
         self.program_representation = None
+        self.reconcile_symbols = True
+        self.current_file = None
+        if num_workers is None or num_workers < 1:
+            num_workers = os.cpu_count() or 1
+        self.num_workers = num_workers
+
+
+    def collect_program_files(self, program_path):
+        program_files = []
+        for root, dirs, files in os.walk(program_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.endswith(self.extension):
+                    program_files.append(os.path.abspath(os.path.join(root, file_name)))
+        return program_files
+
+
+    def get_program_files(self, program_path):
+        if os.path.isdir(program_path):
+            return self.collect_program_files(program_path)
+        return [os.path.abspath(program_path)]
 
 
     def parse_program_module(self, program_path):
+        program_files = self.collect_program_files(program_path)
+        if self.num_workers > 1 and len(program_files) > 1:
+            self.parse_files_in_parallel(program_files)
+        else:
+            for file_path in program_files:
+                self.parse_program(file_path)
+
+
+    def parse_files_in_parallel(self, program_files):
+        num_workers = min(self.num_workers, len(program_files))
+        chunksize = max(1, len(program_files) // (num_workers * 4))
+        worker = functools.partial(parse_partial_representation, type(self))
+        with multiprocessing.Pool(num_workers) as pool:
+            # imap keeps file order, so merged results match a sequential parse
+            for partial_representation in pool.imap(worker, program_files, chunksize):
+                self.program_representation.merge_representation(partial_representation,
+                                                                  reconcile=self.reconcile_symbols)
+
 
-        for _, d, f in os.walk(program_path):
-            rel_path = os.path.join(d, f)
-            if f.endswith(self.extension):
-                self.parse_program(os.path.abspath(rel_path))
+    def read_program_lines(self, program_path):
+        program_fp = open(program_path, 'r')
+        program_lines = program_fp.readlines()
+        program_fp.close()
+        return program_lines
 
 
     def parse_lines_into_representation(self, lines):
@@ -44,240 +119,230 @@ class ProgramParser:
             self.parse_program_module(program_path)
 
         else:
-            program_fp = open(program_path, 'r')
-            program_lines = program_fp.readlines()
-            program_fp.close()
-            self.parse_lines_into_representation(program_lines)
+            file_path = os.path.abspath(program_path)
+            file_stat = os.stat(file_path)
+            self.current_file = file_path
+            self.program_representation.source_files[file_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+            start_time = time.perf_counter()
+            self.parse_lines_into_representation(self.read_program_lines(program_path))
+            self.program_representation.file_parse_times[file_path] = time.perf_counter() - start_time
 
 
 
 class PrologProgramParser(ProgramParser):
 
-    def __init__(self):
-        super().__init__('.pl')
+    def __init__(self, num_workers=1):
+        super().__init__(('.pl', '.P'), num_workers=num_workers)
         self.program_representation = PR.PrologProgramRepresentation()
-        self.possible_operands = ['+', 'is', '-', '=', '\\+', '\\=']
-
-
-
-    def find_operands(self, symbol):
-        operands = []
-        for operand in self.possible_operands:
-            if operand in symbol:
-                operands.append(operand)
-        return operands
-
-    def grab_symbols(self, symbols_str):
-        symbols = []
-        current_symbol = ''
-        nested_func_counter = 0
-        for c in symbols_str:
-            if c == '(':
-                nested_func_counter = nested_func_counter + 1
-            elif c == ')':
-                nested_func_counter = nested_func_counter - 1
-            if nested_func_counter == 0 and c == ',':
-                symbols.append(current_symbol)
-                current_symbol = ''
-            else:
-                current_symbol = current_symbol + c
-        symbols.append(current_symbol)
 
-        return symbols
 
+    def parse_lines_into_representation(self, program_lines):
+        reader = PROLOG_READER.PrologTermReader(''.join(program_lines))
+        for predicate in reader.read_clauses():
+            predicate.source_file = self.current_file
+            start_time = time.perf_counter()
+            try:
+                predicate.update_variable_expected_types()
+            except SCBErrors.SCBVariableMatchInvalidError:
+                sys.stderr.write('WARNING: Variable in predicate {}/{} matches to two different conflicting types!\n'.format(predicate.name, predicate.arity))
+            self.program_representation.record_type_inference(1, time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            predicate.update_body_summary()
+            self.program_representation.record_body_summaries(1, time.perf_counter() - start_time)
+
+            if self.reconcile_symbols:
+                self.program_representation.add_reconciled_predicate(predicate)
+            else:
+                self.program_representation.add_predicate(predicate)
 
 
-    def convert_symbol_to_PR(self, symbol, is_predicate=False):
-        symbol_no_whitespace = re.sub(' +', '', symbol.strip())
+class CProgramParser(ProgramParser):
 
-        if '(' in symbol_no_whitespace and ')' in symbol_no_whitespace:
-            term_list = []
-            symbol_inputs = self.grab_symbols(symbol_no_whitespace.split('(', 1)[1][:-1])
-            for elem in symbol_inputs:
-                term = self.convert_symbol_to_PR(elem)
-                term_list.append(term)
-            if is_predicate:
-                return PR.Predicate(symbol_no_whitespace.split('(')[0], term_list, None)
-            else:
-                return PR.Function(symbol_no_whitespace.split('(')[0], term_list)
-        else:
-            items = symbol_no_whitespace.split('=')
-            if len(items) == 1:
-                computed_type = None
-                if items[0][0].islower():
-                    computed_type = 'atom'
-                elif items[0][0] == '[':
-                    computed_type = 'list'
-                elif items[0][0].isdigit():
-                    computed_type = 'scalar'
-                elif items[0][0].isupper():
-                    computed_type = 'var'
-                return PR.Variable(items[0], computed_type)
-            else:
-                operations = self.find_operands(symbol_no_whitespace)
-                operators = []
-                for item in items:
-                    computed_type = None
-                    if item[0].islower():
-                        computed_type = 'atom'
-                    elif item[0] == '[':
-                        computed_type = 'list'
-                    elif item[0].isdigit():
-                        computed_type = 'scalar'
-                    elif items[0][0].isupper():
-                        computed_type = 'var'
-                    operators.append(PR.Variable(item, computed_type))
-                return PR.Operator('operator', operations, operators)
+    def __init__(self, num_workers=1):
+        super().__init__('.c', num_workers=num_workers)
+        self.program_representation = PR.CProgramRepresentation()
 
 
     def parse_lines_into_representation(self, program_lines):
-        
-        reading_predicate = False
-        predicate = None
-        predicate_body = []
-        for line in program_lines:
-            stripped = re.sub(' +', '', line.strip())
-
-            # Case of single line predicate with no body
-            if not reading_predicate and stripped.endswith('.') and ':-' not in line:
-                temp = stripped[:-1]
-                predicate = self.convert_symbol_to_PR(temp, is_predicate=True)
-
-            # Case of line with head + body
-            elif ':-' in line:
-                reading_predicate = True
-                head_body = stripped.split(':-')
-                predicate = self.convert_symbol_to_PR(head_body[0], is_predicate=True)
-                temp = head_body[1]
-                if temp.endswith(','):
-                    temp = temp[:-1]
-                if temp.endswith('.'):
-                    temp = temp[:-1]
-                    reading_predicate = False
-                if len(temp) > 0:
-                    clauses = self.grab_symbols(temp)
-                    for clause in clauses:
-                        convert = self.convert_symbol_to_PR(clause)
-                        if convert is not None:
-                            predicate_body.append(convert)
-                    
-            elif reading_predicate:
-                temp = line.strip()
-                if temp.endswith('.'):
-                    reading_predicate = False
-                    temp = temp[:-1]
-                elif temp.endswith(','):
-                    temp = temp[:-1]
-                clauses = self.grab_symbols(temp)
-                for clause in clauses:
-                    clause = self.convert_symbol_to_PR(clause)
-                    predicate_body.append(clause)
-
-            if not reading_predicate:
-                predicate.body = predicate_body
-                try:
-                    predicate.update_variable_expected_types()
-                except SCBErrors.SCBVariableMatchInvalidError:
-                    sys.stderr.write('WARNING: Variable in predicate {}/{} matches to two different conflicting types!\n'.format(predicate.name, predicate.arity))
+        reader = C_READER.CSourceReader(''.join(program_lines))
+        for method in reader.read_methods():
+            method.source_file = self.current_file
+            start_time = time.perf_counter()
+            method.update_body_summary()
+            self.program_representation.record_body_summaries(1, time.perf_counter() - start_time)
 
-                self.program_representation.add_predicate(predicate)
-                try:
-                    self.program_representation.update_variable_expected_types(predicate)
-                except SCBErrors.SCBVariableMatchInvalidError:
-                    sys.stderr.write('WARNING: Two instances of predicate {}/{} have different detected input types!\n'.format(predicate.name, predicate.arity))
-                predicate = None
-                predicate_body = []
+            self.program_representation.add_method(method)
 
 
-class CProgramParser(ProgramParser):
 
-    def __init__(self):
-        super().__init__('.c')
-        self.program_representation = PR.CProgramRepresentation()
-        self.possible_operands = ['+', '-', '=']
+# Statements holding blocks of other statements, all other statements only hold expressions. try/except*
+# and match only exist in newer versions of Python.
+PYTHON_BLOCK_STATEMENTS = frozenset([getattr(ast, name) for name in ['FunctionDef', 'AsyncFunctionDef', 'ClassDef', 'For', 'AsyncFor', 'While', 'If',
+                                                                     'Try', 'TryStar', 'With', 'AsyncWith', 'Match'] if hasattr(ast, name)])
+PYTHON_TRY_STATEMENTS = frozenset([getattr(ast, name) for name in ['Try', 'TryStar'] if hasattr(ast, name)])
 
 
-    def find_operands(self, symbol):
-        operands = []
-        for operand in self.possible_operands:
-            if operand in symbol:
-                operands.append(operand)
-        return operands
+class PythonProgramParser(ProgramParser):
 
+    def __init__(self, num_workers=1):
+        super().__init__('.py', num_workers=num_workers)
+        self.program_representation = PR.PythonProgramRepresentation()
 
-    def convert_symbol_to_PR(self, symbol, is_method=False):
-        symbol_no_whitespace = symbol.strip()
 
-        if '(' in symbol_no_whitespace and ')' in symbol_no_whitespace and is_method:
-            var_list = symbol_no_whitespace.split('(')[1][:-1].split(',')
-            terms = []
-            for t in var_list:
-                var = t.strip().rsplit(' ', 1)
-                terms.append(PR.Variable(var[1], var[0]))
-            return PR.Method(symbol_no_whitespace.split('(', 1)[0].rsplit(' ', 1)[1], symbol_no_whitespace.split('(', 1)[0].rsplit(' ', 1)[0], terms, None)
+    def read_program_lines(self, program_path):
+        # Read as bytes, so ast honors the encoding declared by the file
+        with open(program_path, 'rb') as program_fp:
+            return [program_fp.read()]
 
-        elif symbol_no_whitespace.startswith('for'):
-            return PR.Loop('for')
-        elif symbol_no_whitespace.startswith('while'):
-            return PR.Loop('while')
-        elif symbol_no_whitespace.startswith('if'):
-            return PR.Conditional('if')
-        elif symbol_no_whitespace.startswith('else if'):
-            return PR.Conditional('else if')
-        elif symbol_no_whitespace.startswith('else'):
-            return PR.Conditional('else')
+
+    def get_annotation(self, annotation):
+        if annotation is None:
+            return None
+        # Forward references are written as strings
+        if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+            return annotation.value
+        return ast.unparse(annotation)
+
+
+    def get_argument_terms(self, arguments, class_name, decorator_names):
+        # Types come from annotations, then from constant defaults, and self or cls of methods get the class
+        positional_args = arguments.posonlyargs + arguments.args
+        positional_defaults = [None] * (len(positional_args) - len(arguments.defaults)) + arguments.defaults
+        argument_list = list(zip(positional_args, positional_defaults)) + list(zip(arguments.kwonlyargs, arguments.kw_defaults))
+        terms = []
+        for i, (arg, default) in enumerate(argument_list):
+            arg_type = self.get_annotation(arg.annotation)
+            if arg_type is None and isinstance(default, ast.Constant) and default.value is not None:
+                arg_type = type(default.value).__name__
+            if arg_type is None and i == 0 and class_name is not None and 'staticmethod' not in decorator_names:
+                arg_type = 'type[{}]'.format(class_name) if 'classmethod' in decorator_names else class_name
+            terms.append(PR.Variable(arg.arg, arg_type))
+        if arguments.vararg is not None:
+            terms.append(PR.Variable('*' + arguments.vararg.arg, self.get_annotation(arguments.vararg.annotation)))
+        if arguments.kwarg is not None:
+            terms.append(PR.Variable('**' + arguments.kwarg.arg, self.get_annotation(arguments.kwarg.annotation)))
+        return terms
+
+
+    def convert_expression(self, expression, body_terms, function_summary):
+        # Calls, comprehensions and conditional expressions anywhere in an expression or simple statement,
+        # lambdas included
+        if function_summary is None:
+            return
+        # Walked without ast.walk, names, constants and load/store contexts have nothing to look at
+        pending_nodes = [expression]
+        while len(pending_nodes) > 0:
+            node = pending_nodes.pop()
+            node_type = type(node)
+            if node_type is ast.Name or node_type is ast.Constant:
+                continue
+            for field in node_type._fields:
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    pending_nodes.extend([item for item in value if isinstance(item, ast.AST)])
+                elif isinstance(value, ast.AST) and field != 'ctx':
+                    pending_nodes.append(value)
+            if node_type is ast.Yield or node_type is ast.YieldFrom:
+                function_summary['yields'] = True
+            elif node_type is ast.Call:
+                func = node.func
+                if isinstance(func, ast.Name):
+                    call_name = func.id
+                elif isinstance(func, ast.Attribute):
+                    call_name = func.attr
+                else:
+                    call_name = '<call>'
+                body_terms.append(PR.Function(call_name, [PR.Variable(arg.id if isinstance(arg, ast.Name) else '_', None) for arg in node.args]))
+            elif node_type in (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp):
+                body_terms.append(PR.Loop('comprehension'))
+            elif node_type is ast.IfExp:
+                body_terms.append(PR.Conditional('if expression'))
+
+
+    def convert_block(self, statements, body_terms, scope, function_summary, class_name=None):
+        # Appends the terms of a block of statements to body_terms. Nested definitions are indexed as
+        # functions of their own and are not part of the enclosing body. function_summary records
+        # whether the function returns a value or yields, it is None outside of functions, where only
+        # definitions are looked for. class_name is set for blocks of a class body, whose functions
+        # are methods of the class.
+        for statement in statements:
+            statement_type = type(statement)
+            if statement_type not in PYTHON_BLOCK_STATEMENTS:
+                if function_summary is not None:
+                    if statement_type is ast.Return and statement.value is not None:
+                        function_summary['returns'] = True
+                    self.convert_expression(statement, body_terms, function_summary)
+            elif statement_type is ast.FunctionDef or statement_type is ast.AsyncFunctionDef:
+                self.convert_function(statement, scope, class_name)
+            elif statement_type is ast.ClassDef:
+                self.convert_class(statement, scope)
+            elif statement_type is ast.For or statement_type is ast.AsyncFor or statement_type is ast.While:
+                loop = PR.Loop('while' if statement_type is ast.While else 'for')
+                self.convert_expression(statement.iter if statement_type is not ast.While else statement.test, body_terms, function_summary)
+                self.convert_block(statement.body, loop.contents, scope, function_summary, class_name)
+                self.convert_block(statement.orelse, loop.contents, scope, function_summary, class_name)
+                body_terms.append(loop)
+            elif statement_type is ast.If:
+                self.convert_expression(statement.test, body_terms, function_summary)
+                conditional = PR.Conditional('if')
+                self.convert_block(statement.body, conditional.contents, scope, function_summary, class_name)
+                body_terms.append(conditional)
+                if len(statement.orelse) > 0:
+                    else_conditional = PR.Conditional('else')
+                    self.convert_block(statement.orelse, else_conditional.contents, scope, function_summary, class_name)
+                    body_terms.append(else_conditional)
+            elif statement_type in PYTHON_TRY_STATEMENTS:
+                self.convert_block(statement.body, body_terms, scope, function_summary, class_name)
+                for handler in statement.handlers:
+                    except_conditional = PR.Conditional('except')
+                    self.convert_block(handler.body, except_conditional.contents, scope, function_summary, class_name)
+                    body_terms.append(except_conditional)
+                self.convert_block(statement.orelse, body_terms, scope, function_summary, class_name)
+                self.convert_block(statement.finalbody, body_terms, scope, function_summary, class_name)
+            elif statement_type is ast.With or statement_type is ast.AsyncWith:
+                for item in statement.items:
+                    self.convert_expression(item.context_expr, body_terms, function_summary)
+                self.convert_block(statement.body, body_terms, scope, function_summary, class_name)
+            else:
+                self.convert_expression(statement.subject, body_terms, function_summary)
+                for case in statement.cases:
+                    case_conditional = PR.Conditional('case')
+                    self.convert_block(case.body, case_conditional.contents, scope, function_summary, class_name)
+                    body_terms.append(case_conditional)
+
+
+    def convert_function(self, function_node, scope, class_name):
+        qualified_name = '.'.join(scope + [function_node.name])
+        decorator_names = [decorator.id for decorator in function_node.decorator_list if isinstance(decorator, ast.Name)]
+        terms = self.get_argument_terms(function_node.args, class_name, decorator_names)
+        body = []
+        function_summary = {'returns': False, 'yields': False}
+        self.convert_block(function_node.body, body, scope + [function_node.name, '<locals>'], function_summary)
+        return_type = self.get_annotation(function_node.returns)
+        if return_type is None and function_summary['yields']:
+            return_type = 'Generator'
+        elif return_type is None and not function_summary['returns']:
+            # Functions without a valued return implicitly return None
+            return_type = 'None'
+        method = PR.PythonFunction(function_node.name, return_type, terms, body, qualified_name=qualified_name)
+        method.source_file = self.current_file
+        start_time = time.perf_counter()
+        method.update_body_summary()
+        self.program_representation.record_body_summaries(1, time.perf_counter() - start_time)
+        self.program_representation.add_method(method)
+
+
+    def convert_class(self, class_node, scope):
+        # Definitions under if, try or with statements of the class body belong to the class too
+        self.convert_block(class_node.body, [], scope + [class_node.name], None, class_name=class_node.name)
 
 
     def parse_lines_into_representation(self, program_lines):
-        
-        reading_method = False
-        nested_depth = 0
-        nested_terms = []
-        method = None
-        method_body = []
-        for line in program_lines:
-            stripped = line.strip()
-
-            # Case of single line predicate with no body
-            if not reading_method and stripped.endswith('}') and '{' in line:
-                method = self.convert_symbol_to_PR(stripped.split('{')[0], is_method=True)
-
-            # Case of line with head + body
-            elif stripped.endswith('{') and not reading_method:
-                reading_method = True
-                method = self.convert_symbol_to_PR(stripped.split('{')[0], is_method=True)
-                    
-            elif reading_method:
-                temp = line.strip()
-                if temp.endswith('}'):
-                    if nested_depth > 1:
-                        nested_depth = nested_depth - 1
-                        nested_terms[nested_depth - 1].contents.append(nested_terms[nested_depth])
-                        del nested_terms[nested_depth]
-                    elif nested_depth == 1:
-                        nested_depth = nested_depth - 1
-                        method_body.append(nested_terms[nested_depth])
-                        del nested_terms[nested_depth]
-                    else:
-                        reading_method = False
-                    temp = temp[:-1]
-                elif temp.endswith(';'):
-                    temp = temp[:-1]
-                term = self.convert_symbol_to_PR(temp)
-                if term is not None:
-                
-                    if isinstance(term, PR.Loop) or isinstance(term, PR.Conditional):
-                        nested_terms.append(term)
-                        nested_depth = nested_depth + 1
-                    if nested_depth == 0:
-                        method_body.append(term)
-                    else:
-                        nested_terms[nested_depth - 1].contents.append(term)
-                
-
-            if not reading_method and method is not None:
-                method.body = method_body
-
-                self.program_representation.add_method(method)
-                method = None
-                method_body = []
+        source = program_lines[0] if len(program_lines) == 1 else ''.join(program_lines)
+        try:
+            module = ast.parse(source, filename=self.current_file or '<unknown>')
+        except (SyntaxError, ValueError, RecursionError) as err:
+            sys.stderr.write('WARNING: Could not parse {}: {}\n'.format(self.current_file, err))
+            return
+        # Module level statements are not a function, only the definitions in them are indexed
+        self.convert_block(module.body, [], [], None)
@@ -1,4 +1,9 @@
+import os
 import sys
+import time
+import array
+import operator
+import itertools
 import code_browsing.errors as SCBErrors
 
 class ProgramRepresentation:
@@ -6,83 +11,634 @@ class ProgramRepresentation:
     def __init__(self, name, description):
         self.representation_name = name
         self.description = description
+        # Maps absolute source file path to (size, mtime in ns) at the time it was parsed
+        self.source_files = {}
+        # Number of body summaries computed while parsing, and the time spent on them in seconds
+        self.body_summary_count = 0
+        self.body_summary_time = 0.0
+        # Seconds spent parsing each source file, and the number of clauses whose variable types were
+        # inferred with the time spent inferring and reconciling them
+        self.file_parse_times = {}
+        self.type_inference_count = 0
+        self.type_inference_time = 0.0
+        # Incremented on every change to the symbols. arity_generations holds the generation at which
+        # symbols of each arity last changed, so cached query results for other arities stay valid.
+        self.generation = 0
+        self.arity_generations = {}
+        # Generation at which the symbols of each (name, arity) key last changed, used to patch the
+        # query index
+        self.key_generations = {}
+        # Source file path -> (name, arity) keys of the symbols parsed from it, so that replacing a file
+        # only visits the symbols it defines
+        self.file_keys = {}
+
+    def mark_changed(self, keys):
+        # keys are the (name, arity) pairs of all added, removed or retyped symbols
+        self.generation = self.generation + 1
+        for key in keys:
+            self.arity_generations[key[1]] = self.generation
+            self.key_generations[key] = self.generation
+
+    def add_file_key(self, file_path, key):
+        file_keys = self.file_keys.get(file_path)
+        if file_keys is None:
+            file_keys = set()
+            self.file_keys[file_path] = file_keys
+        file_keys.add(key)
+
+    def get_changed_keys(self, generation):
+        return [key for key, key_generation in self.key_generations.items() if key_generation > generation]
+
+    def get_change_generation(self, arity=-1):
+        if arity == -1:
+            return self.generation
+        return self.arity_generations.get(arity, 0)
+
+    def record_body_summaries(self, count, elapsed):
+        self.body_summary_count = self.body_summary_count + count
+        self.body_summary_time = self.body_summary_time + elapsed
+
+    def record_type_inference(self, count, elapsed):
+        self.type_inference_count = self.type_inference_count + count
+        self.type_inference_time = self.type_inference_time + elapsed
+
+    def record_parse_statistics(self, partial_representation):
+        self.file_parse_times.update(partial_representation.file_parse_times)
+        self.record_body_summaries(partial_representation.body_summary_count, partial_representation.body_summary_time)
+        self.record_type_inference(partial_representation.type_inference_count, partial_representation.type_inference_time)
+
+    def splice_source_file(self, symbols, file_path, new_symbols):
+        # Replaces the symbols parsed from file_path with new_symbols. Symbols are kept in the order
+        # their files are parsed in, so new_symbols go where a full parse would have put them.
+        file_key = get_file_order_key(file_path)
+        file_keys = {}
+        kept_symbols = []
+        removed_symbols = []
+        insert_position = None
+        for symbol in symbols:
+            if symbol.source_file == file_path:
+                removed_symbols.append(symbol)
+                continue
+            if insert_position is None:
+                if symbol.source_file not in file_keys:
+                    file_keys[symbol.source_file] = get_file_order_key(symbol.source_file)
+                if file_keys[symbol.source_file] > file_key:
+                    insert_position = len(kept_symbols)
+            kept_symbols.append(symbol)
+        if insert_position is None:
+            insert_position = len(kept_symbols)
+        kept_symbols[insert_position:insert_position] = new_symbols
+        return kept_symbols, removed_symbols
+
+    def find_file_position(self, symbols, file_path):
+        # Index of the first symbol in symbols, kept in parse order, whose file is not parsed before
+        # file_path. The symbols of file_path, if any, start there.
+        file_key = get_file_order_key(file_path)
+        low = 0
+        high = len(symbols)
+        while low < high:
+            middle = (low + high) // 2
+            if get_file_order_key(symbols[middle].source_file) < file_key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def update_source_file(self, file_path, partial_representation):
+        if partial_representation is None or file_path not in partial_representation.source_files:
+            self.source_files.pop(file_path, None)
+            self.file_parse_times.pop(file_path, None)
+        else:
+            self.source_files[file_path] = partial_representation.source_files[file_path]
+            self.file_parse_times[file_path] = partial_representation.file_parse_times.get(file_path, 0.0)
+
+
+def get_file_order_key(file_path):
+    """Function that computes the sort key of a source file in parse order
+
+    Parameters
+    ----------
+    file_path : str
+        absolute path of the source file
+
+    Returns
+    -------
+    tuple
+        key ordering files as a directory walk with sorted names meets them, where the files of a
+        directory come before those of its subdirectories
+    """
+
+    directory, file_name = os.path.split(file_path)
+    return tuple([(1, part) for part in directory.split(os.sep)] + [(0, file_name)])
+
+
+# Bit flags of a body summary
+BODY_CONTAINS_LOOP = 0x1
+BODY_CONTAINS_CONDITIONAL = 0x2
+BODY_CONTAINS_CALL = 0x4
+
+
+def join_expected_types(current_type, new_type):
+    # Types form a small lattice: None < 'var' < any concrete type. Two different concrete types conflict.
+    if current_type is None or current_type == new_type:
+        return new_type
+    if new_type is None or new_type == 'var':
+        return current_type
+    if current_type == 'var':
+        return new_type
+    raise SCBErrors.SCBVariableMatchInvalidError
+
+
+def raise_variable_type(variable, joined_type):
+    # Moves a variable up to the joined type, leaving conflicting concrete types untouched
+    if variable.computed_type != joined_type:
+        if variable.computed_type is None or (variable.computed_type == 'var' and joined_type is not None):
+            variable.computed_type = joined_type
+
+
+def unify_variable_types(variable_list):
+    # All occurrences of a variable name belong to one equivalence class, so instead of comparing every
+    # pair of occurrences the classes are keyed by name and each takes the join of its members' types.
+    joined_types = {}
+    conflict_found = False
+    for var in variable_list:
+        try:
+            joined_types[var.name] = join_expected_types(joined_types.get(var.name), var.computed_type)
+        except SCBErrors.SCBVariableMatchInvalidError:
+            conflict_found = True
+    for var in variable_list:
+        raise_variable_type(var, joined_types[var.name])
+    if conflict_found:
+        raise SCBErrors.SCBVariableMatchInvalidError
+
+
+def get_term_expected_type(term):
+    if isinstance(term, Function):
+        return 'func'
+    elif isinstance(term, Variable):
+        return term.computed_type
+    return None
+
+
+def get_term_input_type(term):
+    # Input type of an argument as written in inputs: assertions
+    if isinstance(term, Function):
+        return 'func/{}'.format(term.arity)
+    elif isinstance(term, Variable):
+        return term.computed_type
+    return None
+
+
+def summarize_body(body):
+    """Function that computes the summary of a method or predicate body
+
+    Parameters
+    ----------
+    body : list of Term
+        the body, may be None
+
+    Returns
+    -------
+    tuple
+        (BODY_CONTAINS_* flags, nesting depth of loops and conditionals, number of calls)
+    """
+
+    body_summary = [0, 0, 0]
+    if body is not None:
+        for term in body:
+            term.add_to_body_summary(body_summary, 0)
+    return body_summary[0], body_summary[1], body_summary[2]
+
+
+def collect_body_calls(body):
+    """Function that collects the calls made by a method or predicate body
+
+    Parameters
+    ----------
+    body : list of Term
+        the body, may be None
+
+    Returns
+    -------
+    list of tuple
+        (name, arity) of every call, in body order, the same calls a body summary counts
+    """
+
+    call_list = []
+    if body is not None:
+        for term in body:
+            term.collect_calls(call_list)
+    return call_list
+
+
+def is_ground_fact(predicate):
+    # Bodiless clauses whose arguments are all atomic carry nothing beyond the text and type of each
+    # argument, so they can be stored in a FactTable without losing information
+    if predicate.body:
+        return False
+    for term in predicate.set_of_terms:
+        if not isinstance(term, Variable) or term.computed_type == 'var':
+            return False
+    return True
+
+
+class FactTable:
+    # Column storage for the ground facts of one name/arity. Each argument position is an array of
+    # interned atom ids, and rows are kept in program order.
+
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.columns = [array.array('I') for i in range(0, arity)]
+        # Interned source file id of each row
+        self.row_files = array.array('I')
+
+    def __len__(self):
+        return len(self.row_files)
+
+    def append_row(self, atom_ids, file_id):
+        for i in range(0, self.arity):
+            self.columns[i].append(atom_ids[i])
+        self.row_files.append(file_id)
+
+    def get_row(self, row):
+        return [column[row] for column in self.columns]
 
 
 class PrologProgramRepresentation(ProgramRepresentation):
 
     def __init__(self):
         super().__init__('Prolog Representation', 'Prolog Program represented as series of predicates.')
-        self.predicates = []
-        self.predicate_map = {}
+        # (name, arity) -> all clauses of that predicate in program order, either as a list of
+        # Predicates or, while every clause is a ground fact, as a FactTable
+        self.predicate_index = {}
+        # (name, arity) -> joined expected type of each argument position over all clauses
+        self.predicate_types = {}
+        # Atom interning table shared by all fact tables. Atoms are keyed on text and parsed type,
+        # and their types are stored as small codes into type_names.
+        self.atom_ids = {}
+        self.atom_names = []
+        self.atom_type_codes = array.array('H')
+        self.type_codes = {}
+        self.type_names = []
+        # Interned source file paths of fact table rows
+        self.fact_file_ids = {}
+        self.fact_file_paths = []
+
+    def intern_atom(self, name, computed_type):
+        atom_key = (name, computed_type)
+        atom_id = self.atom_ids.get(atom_key)
+        if atom_id is None:
+            type_code = self.type_codes.get(computed_type)
+            if type_code is None:
+                type_code = len(self.type_names)
+                self.type_codes[computed_type] = type_code
+                self.type_names.append(computed_type)
+            atom_id = len(self.atom_names)
+            self.atom_ids[atom_key] = atom_id
+            self.atom_names.append(name)
+            self.atom_type_codes.append(type_code)
+        return atom_id
+
+    def intern_fact_file(self, file_path):
+        file_id = self.fact_file_ids.get(file_path)
+        if file_id is None:
+            file_id = len(self.fact_file_paths)
+            self.fact_file_ids[file_path] = file_id
+            self.fact_file_paths.append(file_path)
+        return file_id
+
+    def append_fact_row(self, table, predicate):
+        atom_ids = [self.intern_atom(term.name, term.computed_type) for term in predicate.set_of_terms]
+        table.append_row(atom_ids, self.intern_fact_file(predicate.source_file))
+
+    def materialize_fact(self, key, table, row):
+        # Builds the Predicate for one fact table row, with argument types raised to the joined types
+        # of the predicate as reconciliation would have done
+        joined_types = self.predicate_types.get(key)
+        terms = []
+        parsed_head_types = []
+        for i in range(0, table.arity):
+            atom_id = table.columns[i][row]
+            parsed_type = self.type_names[self.atom_type_codes[atom_id]]
+            parsed_head_types.append(parsed_type)
+            computed_type = parsed_type
+            if computed_type is None and joined_types is not None:
+                computed_type = joined_types[i]
+            terms.append(Variable(self.atom_names[atom_id], computed_type))
+        pred = Predicate(table.name, terms, [])
+        pred.source_file = self.fact_file_paths[table.row_files[row]]
+        pred.parsed_head_types = parsed_head_types
+        return pred
+
+    def get_fact_type_names(self, key, position):
+        # Type of an argument at the given position of a fact table, indexed by the type code of its
+        # atom. Rows of one table only differ in type through their atoms' parsed types.
+        joined_types = self.predicate_types.get(key)
+        position_types = []
+        for type_name in self.type_names:
+            if type_name is None and joined_types is not None:
+                type_name = joined_types[position]
+            position_types.append(type_name)
+        return position_types
+
+    def iter_group_predicates(self, key, group):
+        if isinstance(group, FactTable):
+            for row in range(0, len(group)):
+                yield self.materialize_fact(key, group, row)
+        else:
+            for pred in group:
+                yield pred
+
+    def iter_predicates(self, arity=-1):
+        # Yields all clauses grouped by name/arity, in order of each predicate's first clause
+        for key, group in self.predicate_index.items():
+            if arity == -1 or key[1] == arity:
+                for pred in self.iter_group_predicates(key, group):
+                    yield pred
+
+    def count_predicates(self):
+        num_predicates = 0
+        for group in self.predicate_index.values():
+            num_predicates = num_predicates + len(group)
+        return num_predicates
+
+    def expand_fact_table(self, key):
+        # Converts a fact table to a list of Predicates once a clause that is not a ground fact is added
+        clauses = list(self.iter_group_predicates(key, self.predicate_index[key]))
+        self.predicate_index[key] = clauses
+        return clauses
+
+    def join_fact_types(self, key, head_types):
+        joined_types = self.predicate_types.get(key)
+        if joined_types is None:
+            joined_types = [None] * len(head_types)
+            self.predicate_types[key] = joined_types
+
+        conflict_found = False
+        for i in range(0, len(head_types)):
+            try:
+                joined_types[i] = join_expected_types(joined_types[i], head_types[i])
+            except SCBErrors.SCBVariableMatchInvalidError:
+                conflict_found = True
+        if conflict_found:
+            raise SCBErrors.SCBVariableMatchInvalidError
 
     def update_variable_expected_types(self, predicate):
+        # Reconciles the head of an indexed clause with all other clauses of the same name/arity. Each
+        # position's joined type can only be raised twice (None -> var -> concrete), so earlier clauses
+        # are revisited at most twice per position and loading N clauses stays linear.
+        key = (predicate.name, predicate.arity)
+        joined_types = self.predicate_types.get(key)
+        if joined_types is None:
+            joined_types = [None] * predicate.arity
+            self.predicate_types[key] = joined_types
+
+        conflict_found = False
+        for i in range(0, predicate.arity):
+            try:
+                joined_type = join_expected_types(joined_types[i], get_term_expected_type(predicate.set_of_terms[i]))
+            except SCBErrors.SCBVariableMatchInvalidError:
+                conflict_found = True
+                continue
+            if joined_type != joined_types[i]:
+                joined_types[i] = joined_type
+                for pred in self.predicate_index[key]:
+                    if isinstance(pred.set_of_terms[i], Variable):
+                        raise_variable_type(pred.set_of_terms[i], joined_type)
+            elif isinstance(predicate.set_of_terms[i], Variable):
+                raise_variable_type(predicate.set_of_terms[i], joined_type)
+
+        if conflict_found:
+            raise SCBErrors.SCBVariableMatchInvalidError
+
+    def reconcile_predicates(self, keys):
+        # Redo cross-clause reconciliation for the given (name, arity) groups, starting from the
+        # types each clause had before it was first reconciled.
+        for key in keys:
+            self.predicate_types.pop(key, None)
+            group = self.predicate_index.get(key, [])
+            if isinstance(group, FactTable):
+                for row in range(0, len(group)):
+                    try:
+                        self.join_fact_types(key, [self.type_names[self.atom_type_codes[atom_id]] for atom_id in group.get_row(row)])
+                    except SCBErrors.SCBVariableMatchInvalidError:
+                        sys.stderr.write('WARNING: Two instances of predicate {}/{} have different detected input types!\n'.format(key[0], key[1]))
+                continue
+            for pred in group:
+                for i in range(0, pred.arity):
+                    if isinstance(pred.set_of_terms[i], Variable):
+                        pred.set_of_terms[i].computed_type = pred.parsed_head_types[i]
+            for pred in group:
+                try:
+                    self.update_variable_expected_types(pred)
+                except SCBErrors.SCBVariableMatchInvalidError:
+                    sys.stderr.write('WARNING: Two instances of predicate {}/{} have different detected input types!\n'.format(pred.name, pred.arity))
+
+    def lookup_symbols(self, name, arity=-1):
+        if arity != -1:
+            key = (name, arity)
+            if key not in self.predicate_index:
+                return []
+            return list(self.iter_group_predicates(key, self.predicate_index[key]))
         matching_predicates = []
-        for pred in self.predicates:
-            if pred.name == predicate.name:
-                if pred.arity != predicate.arity:
-                    raise SCBErrors.SCBRedefinedPredicateError
-                else:
-                    matching_predicates.append(pred)
-
-        for pred in matching_predicates:
-            for i in range(0, len(pred.set_of_terms)):
-                if isinstance(pred.set_of_terms[i], Function) and isinstance(predicate.set_of_terms[i], Variable):
-                    if predicate.set_of_terms[i].computed_type == 'var' or predicate.set_of_terms[i].computed_type is None:
-                        predicate.set_of_terms[i].computed_type = 'func'
-                    else:
-                        raise SCBErrors.SCBVariableMatchInvalidError
-                elif isinstance(pred.set_of_terms[i], Variable) and isinstance(predicate.set_of_terms[i], Function):
-                    if pred.set_of_terms[i].computed_type == 'var' or pred.set_of_terms[i].computed_type is None:
-                        pred.set_of_terms[i].computed_type = 'func'
-                    else:
-                        raise SCBErrors.SCBVariableMatchInvalidError
-                elif isinstance(pred.set_of_terms[i], Variable) and isinstance(predicate.set_of_terms[i], Variable):
-                    if pred.set_of_terms[i].computed_type is None:
-                        pred.set_of_terms[i].computed_type = predicate.set_of_terms[i].computed_type
-                    elif predicate.set_of_terms[i].computed_type is None:
-                        predicate.set_of_terms[i].computed_type = pred.set_of_terms[i].computed_type
-                    elif pred.set_of_terms[i].computed_type == 'var' and predicate.set_of_terms[i].computed_type != 'var':
-                        pred.set_of_terms[i].computed_type = predicate.set_of_terms[i].computed_type
-                    elif predicate.set_of_terms[i].computed_type == 'var' and pred.set_of_terms[i].computed_type != 'var':
-                        predicate.set_of_terms[i].computed_type = pred.set_of_terms[i].computed_type
-                    elif predicate.set_of_terms[i].computed_type != pred.set_of_terms[i].computed_type:
-                        raise SCBErrors.SCBVariableMatchInvalidError
-
-
+        for key, group in self.predicate_index.items():
+            if key[0] == name:
+                matching_predicates.extend(self.iter_group_predicates(key, group))
+        return matching_predicates
 
     def add_predicate(self, new_pred):
-        self.predicates.append(new_pred)
-        self.predicate_map[new_pred.name] = len(self.predicates) - 1
+        new_pred.parsed_head_types = [term.computed_type if isinstance(term, Variable) else None for term in new_pred.set_of_terms]
+        key = (new_pred.name, new_pred.arity)
+        self.mark_changed([key])
+        self.add_file_key(new_pred.source_file, key)
+        group = self.predicate_index.get(key)
+        if group is None or isinstance(group, FactTable):
+            if is_ground_fact(new_pred):
+                if group is None:
+                    group = FactTable(new_pred.name, new_pred.arity)
+                    self.predicate_index[key] = group
+                self.append_fact_row(group, new_pred)
+                return
+            if group is None:
+                group = []
+                self.predicate_index[key] = group
+            else:
+                group = self.expand_fact_table(key)
+        group.append(new_pred)
+
+    def add_reconciled_predicate(self, new_pred):
+        self.add_predicate(new_pred)
+        key = (new_pred.name, new_pred.arity)
+        start_time = time.perf_counter()
+        try:
+            if isinstance(self.predicate_index[key], FactTable):
+                self.join_fact_types(key, new_pred.parsed_head_types)
+            else:
+                self.update_variable_expected_types(new_pred)
+        except SCBErrors.SCBVariableMatchInvalidError:
+            sys.stderr.write('WARNING: Two instances of predicate {}/{} have different detected input types!\n'.format(new_pred.name, new_pred.arity))
+        self.record_type_inference(0, time.perf_counter() - start_time)
+
+    def merge_representation(self, partial_representation, reconcile=True):
+        for pred in partial_representation.iter_predicates():
+            if reconcile:
+                self.add_reconciled_predicate(pred)
+            else:
+                self.add_predicate(pred)
+        self.source_files.update(partial_representation.source_files)
+        self.record_parse_statistics(partial_representation)
+
+    def get_parsed_group_clauses(self, key):
+        # All clauses of one name/arity as Predicates, with head types reset to their parsed types
+        clauses = list(self.iter_group_predicates(key, self.predicate_index.get(key, [])))
+        for pred in clauses:
+            for i in range(0, pred.arity):
+                if isinstance(pred.set_of_terms[i], Variable):
+                    pred.set_of_terms[i].computed_type = pred.parsed_head_types[i]
+        return clauses
+
+    def set_predicate_group(self, key, clauses):
+        if len(clauses) == 0:
+            self.predicate_index.pop(key, None)
+            self.predicate_types.pop(key, None)
+            return
+        for pred in clauses:
+            if not is_ground_fact(pred):
+                self.predicate_index[key] = clauses
+                return
+        table = FactTable(key[0], key[1])
+        for pred in clauses:
+            self.append_fact_row(table, pred)
+        self.predicate_index[key] = table
+
+    def replace_source_file(self, file_path, partial_representation):
+        # Swap in the clauses of a reparsed file (or drop them if partial_representation is None)
+        new_groups = {}
+        if partial_representation is not None:
+            for pred in partial_representation.iter_predicates():
+                key = (pred.name, pred.arity)
+                if key not in new_groups:
+                    new_groups[key] = []
+                new_groups[key].append(pred)
+
+        found_keys = self.file_keys.pop(file_path, set())
+        affected_keys = sorted(found_keys)
+        for key in new_groups:
+            if key not in found_keys:
+                affected_keys.append(key)
+
+        for key in affected_keys:
+            clauses, removed_clauses = self.splice_source_file(self.get_parsed_group_clauses(key), file_path, new_groups.get(key, []))
+            self.set_predicate_group(key, clauses)
+        if len(new_groups) > 0:
+            self.file_keys[file_path] = set(new_groups)
+        self.update_source_file(file_path, partial_representation)
+        self.reconcile_predicates(affected_keys)
+        self.mark_changed(affected_keys)
+        return set(affected_keys)
 
     def print_representation(self, fp=sys.stdout):
-        fp.write('{} w/ {} predicates\n{}\nPredicates:\n'.format(self.representation_name, len(self.predicates), self.description))
-        for pred in self.predicates:
+        fp.write('{} w/ {} predicates\n{}\nPredicates:\n'.format(self.representation_name, self.count_predicates(), self.description))
+        for pred in self.iter_predicates():
             pred.print_term(fp=fp)
 
-class PythonProgramRepresentation:
-    #TODO
-    pass
-
 class CProgramRepresentation(ProgramRepresentation):
     def __init__(self):
         super().__init__('C Representation', 'C Program represented as series of functions.')
         self.c_functions = []
         self.c_function_map = {}
+        self.c_function_index = {}
 
     def add_method(self, new_func):
         self.c_functions.append(new_func)
         self.c_function_map[new_func.name] = len(self.c_functions) - 1
+        key = (new_func.name, new_func.arity)
+        self.mark_changed([key])
+        self.add_file_key(new_func.source_file, key)
+        if key not in self.c_function_index:
+            self.c_function_index[key] = []
+        self.c_function_index[key].append(new_func)
+
+    def lookup_symbols(self, name, arity=-1):
+        if arity != -1:
+            return list(self.c_function_index.get((name, arity), []))
+        matching_functions = []
+        for key, functions in self.c_function_index.items():
+            if key[0] == name:
+                matching_functions.extend(functions)
+        return matching_functions
+
+    def merge_representation(self, partial_representation, reconcile=True):
+        # C functions have no cross-function type reconciliation
+        for func in partial_representation.c_functions:
+            self.add_method(func)
+        self.source_files.update(partial_representation.source_files)
+        self.record_parse_statistics(partial_representation)
+
+    def replace_source_file(self, file_path, partial_representation):
+        new_functions = []
+        if partial_representation is not None:
+            new_functions = partial_representation.c_functions
+        # The functions of one file are consecutive in c_functions, which is in parse order
+        start = self.find_file_position(self.c_functions, file_path)
+        end = start
+        while end < len(self.c_functions) and self.c_functions[end].source_file == file_path:
+            end = end + 1
+        self.c_functions = self.c_functions[:start] + new_functions + self.c_functions[end:]
+        self.c_function_map = dict(zip(map(operator.attrgetter('name'), self.c_functions), itertools.count()))
+
+        new_keys = {}
+        for func in new_functions:
+            key = (func.name, func.arity)
+            if key not in new_keys:
+                new_keys[key] = []
+            new_keys[key].append(func)
+        affected_keys = self.file_keys.pop(file_path, set()) | set(new_keys)
+        for key in affected_keys:
+            functions, removed_key_functions = self.splice_source_file(self.c_function_index.get(key, []), file_path, new_keys.get(key, []))
+            if len(functions) > 0:
+                self.c_function_index[key] = functions
+            else:
+                self.c_function_index.pop(key, None)
+        if len(new_keys) > 0:
+            self.file_keys[file_path] = set(new_keys)
+        self.update_source_file(file_path, partial_representation)
+        self.mark_changed(affected_keys)
+        return affected_keys
 
     def print_representation(self, fp=sys.stdout):
         fp.write('{} w/ {} function\n{}\nFunctions:\n'.format(self.representation_name, len(self.c_functions), self.description))
         for func in self.c_functions:
             func.print_term(fp=fp)
 
+class PythonProgramRepresentation(CProgramRepresentation):
+    # Python functions and methods are stored and indexed like C functions
+    def __init__(self):
+        super().__init__()
+        self.representation_name = 'Python Representation'
+        self.description = 'Python Program represented as series of functions and methods.'
+
 class Term:
 
     def __init__(self, name):
         self.name = name
 
+    def collect_variables(self, variable_list):
+        pass
+
+    def add_to_body_summary(self, body_summary, depth):
+        # body_summary is [flags, nesting depth, call count], depth the nesting depth of this term
+        pass
+
+    def collect_calls(self, call_list):
+        pass
+
+    def get_variable_list_from_terms(self):
+        variable_list = []
+        self.collect_variables(variable_list)
+        return variable_list
+
     def print_term(self, fp=sys.stdout):
         fp.write('Term name: {}\n'.format(self.name))
 
@@ -92,6 +648,20 @@ class Loop(Term):
         super().__init__(name)
         self.contents = []
 
+    def collect_variables(self, variable_list):
+        for term in self.contents:
+            term.collect_variables(variable_list)
+
+    def add_to_body_summary(self, body_summary, depth):
+        body_summary[0] = body_summary[0] | BODY_CONTAINS_LOOP
+        body_summary[1] = max(body_summary[1], depth + 1)
+        for term in self.contents:
+            term.add_to_body_summary(body_summary, depth + 1)
+
+    def collect_calls(self, call_list):
+        for term in self.contents:
+            term.collect_calls(call_list)
+
     def print_term(self, fp=sys.stdout):
         fp.write('Loop of type {}\n'.format(self.name))
 
@@ -100,6 +670,20 @@ class Conditional(Term):
         super().__init__(name)
         self.contents = []
 
+    def collect_variables(self, variable_list):
+        for term in self.contents:
+            term.collect_variables(variable_list)
+
+    def add_to_body_summary(self, body_summary, depth):
+        body_summary[0] = body_summary[0] | BODY_CONTAINS_CONDITIONAL
+        body_summary[1] = max(body_summary[1], depth + 1)
+        for term in self.contents:
+            term.add_to_body_summary(body_summary, depth + 1)
+
+    def collect_calls(self, call_list):
+        for term in self.contents:
+            term.collect_calls(call_list)
+
     def print_term(self, fp=sys.stdout):
         fp.write('Conditional of type {}\n'.format(self.name))
 
@@ -112,6 +696,31 @@ class Operator(Term):
         self.operations = operations
         self.operators = operators
 
+    def collect_variables(self, variable_list):
+        for term in self.operators:
+            term.collect_variables(variable_list)
+
+    def add_to_body_summary(self, body_summary, depth):
+        if self.name == 'control':
+            # Disjunctions and if-then-else branch like a conditional, a plain conjunction does not
+            for operation in self.operations:
+                if operation != ',':
+                    body_summary[0] = body_summary[0] | BODY_CONTAINS_CONDITIONAL
+                    body_summary[1] = max(body_summary[1], depth + 1)
+                    depth = depth + 1
+                    break
+        elif '\\+' not in self.operations:
+            # Operands of arithmetic and comparisons are terms, not goals
+            return
+        for term in self.operators:
+            term.add_to_body_summary(body_summary, depth)
+
+    def collect_calls(self, call_list):
+        # Only goals are calls, as in add_to_body_summary
+        if self.name == 'control' or '\\+' in self.operations:
+            for term in self.operators:
+                term.collect_calls(call_list)
+
     def print_term(self, fp=sys.stdout):
         fp.write('Performing operations:\n')
         for operation in self.operations:
@@ -127,10 +736,8 @@ class Variable(Term):
         super().__init__(name)
         self.computed_type = computed_type
 
-    def get_variable_list_from_terms(self):
-        out = []
-        out.append(self)
-        return out
+    def collect_variables(self, variable_list):
+        variable_list.append(self)
 
     def print_term(self, fp=sys.stdout):
         expected_type = self.computed_type
@@ -146,14 +753,17 @@ class Function(Term):
         self.arity = len(set_of_terms)
         self.set_of_terms = set_of_terms
 
-    def get_variable_list_from_terms(self):
-        variable_list = []
+    def collect_variables(self, variable_list):
         for term in self.set_of_terms:
-            if isinstance(term, Variable):
-                variable_list.append(term)
-            else:
-                variable_list = variable_list + term.get_variable_list_from_terms()
-        return variable_list
+            term.collect_variables(variable_list)
+
+    def add_to_body_summary(self, body_summary, depth):
+        # A function in a body is a call, its arguments are not visited
+        body_summary[0] = body_summary[0] | BODY_CONTAINS_CALL
+        body_summary[2] = body_summary[2] + 1
+
+    def collect_calls(self, call_list):
+        call_list.append((self.name, self.arity))
 
     def print_term(self, fp=sys.stdout):
         super().print_term()
@@ -162,46 +772,34 @@ class Function(Term):
             fp.write('- ')
             term.print_term(fp=fp)
 
-class PythonFunction(Function):
-
-    def __init__(self, name, set_of_terms, return_set):
-        super().__init__(name, set_of_terms)
-        self.return_set = return_set
-
-
 class Method(Function):
     def __init__(self, name, return_type, set_of_terms, body):
         super().__init__(name, set_of_terms)
         self.body = body
         self.return_type = return_type
-
-    def get_variable_list_from_terms(self):
-        variable_list = super().get_variable_list_from_terms()
-        for term in self.body:
-            if isinstance(term, Variable):
-                variable_list.append(term)
-            else:
-                variable_list = variable_list + term.get_variable_list_from_terms()
-        return variable_list
+        self.source_file = None
+        self.body_flags = 0
+        self.body_depth = 0
+        self.body_call_count = 0
+
+    def collect_variables(self, variable_list):
+        super().collect_variables(variable_list)
+        if self.body is not None:
+            for term in self.body:
+                term.collect_variables(variable_list)
 
     def update_variable_expected_types(self):
-        variable_list = self.get_variable_list_from_terms()
-        for var in variable_list:
-            for v2 in variable_list:
-                if var.name == v2.name:
-                    if var.computed_type is None:
-                        var.computed_type = v2.computed_type
-                    elif v2.computed_type is None:
-                        v2.computed_type = var.computed_type
-                    elif var.computed_type == 'var' and v2.computed_type != 'var':
-                        var.computed_type = v2.computed_type
-                    elif v2.computed_type == 'var' and var.computed_type != 'var':
-                        v2.computed_type = var.computed_type
-                    elif var.computed_type != v2.computed_type:
-                        raise SCBErrors.SCBVariableMatchInvalidError
+        unify_variable_types(self.get_variable_list_from_terms())
+
+    def update_body_summary(self):
+        self.body_flags, self.body_depth, self.body_call_count = summarize_body(self.body)
 
 
 
+    def to_dict(self):
+        return {'kind': 'function', 'name': self.name, 'arity': self.arity, 'returns': self.return_type,
+                'inputs': [get_term_input_type(term) for term in self.set_of_terms], 'source_file': self.source_file}
+
     def print_term(self, fp=sys.stdout, verbosity='standard'):
         if verbosity == 'low':
             fp.write('Function Name: {} Function arity: {} Returns: {}\n'.format(self.name, self.arity, self.return_type))
@@ -215,39 +813,47 @@ class Method(Function):
                 term.print_term(fp=fp)
 
 
+class PythonFunction(Method):
+    # A def or async def, qualified_name includes the enclosing classes and functions
+    def __init__(self, name, return_type, set_of_terms, body, qualified_name=None):
+        super().__init__(name, return_type, set_of_terms, body)
+        self.qualified_name = qualified_name if qualified_name is not None else name
+
+    def to_dict(self):
+        function_dict = super().to_dict()
+        function_dict['qualified_name'] = self.qualified_name
+        return function_dict
+
+
 class Predicate(Function):
 
     def __init__(self, name, set_of_terms, body):
         super().__init__(name, set_of_terms)
         self.body = body
-
-    def get_variable_list_from_terms(self):
-        variable_list = super().get_variable_list_from_terms()
-        for term in self.body:
-            if isinstance(term, Variable):
-                variable_list.append(term)
-            else:
-                variable_list = variable_list + term.get_variable_list_from_terms()
-        return variable_list
+        self.source_file = None
+        self.parsed_head_types = None
+        self.body_flags = 0
+        self.body_depth = 0
+        self.body_call_count = 0
+
+    def collect_variables(self, variable_list):
+        super().collect_variables(variable_list)
+        if self.body is not None:
+            for term in self.body:
+                term.collect_variables(variable_list)
 
 
     def update_variable_expected_types(self):
-        variable_list = self.get_variable_list_from_terms()
-        for var in variable_list:
-            for v2 in variable_list:
-                if var.name == v2.name:
-                    if var.computed_type is None:
-                        var.computed_type = v2.computed_type
-                    elif v2.computed_type is None:
-                        v2.computed_type = var.computed_type
-                    elif var.computed_type == 'var' and v2.computed_type != 'var':
-                        var.computed_type = v2.computed_type
-                    elif v2.computed_type == 'var' and var.computed_type != 'var':
-                        v2.computed_type = var.computed_type
-                    elif var.computed_type != v2.computed_type:
-                        raise SCBErrors.SCBVariableMatchInvalidError
+        unify_variable_types(self.get_variable_list_from_terms())
+
+    def update_body_summary(self):
+        self.body_flags, self.body_depth, self.body_call_count = summarize_body(self.body)
+
 
 
+    def to_dict(self):
+        return {'kind': 'predicate', 'name': self.name, 'arity': self.arity,
+                'inputs': [get_term_input_type(term) for term in self.set_of_terms], 'source_file': self.source_file}
 
     def print_term(self, fp=sys.stdout, verbosity='standard'):
         if verbosity == 'low':
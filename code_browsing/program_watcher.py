@@ -0,0 +1,79 @@
+"""
+Polling based change detection for loaded programs.
+
+Source files are compared by size and mtime against the stat data recorded when they were parsed.
+Only changed, added or deleted files are reparsed, and their symbols are replaced in the existing
+representation.
+"""
+
+import os
+import time
+import code_browsing.program_parser as PARSER
+
+
+class ProgramWatcher:
+
+    def __init__(self, program_path, parser_class, poll_interval=1.0):
+        self.program_path = program_path
+        self.parser_class = parser_class
+        self.poll_interval = poll_interval
+        self.last_poll_time = None
+
+
+    def get_current_source_files(self):
+        current_files = {}
+        if not os.path.exists(self.program_path):
+            return current_files
+        for file_path in self.parser_class().get_program_files(self.program_path):
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            current_files[file_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return current_files
+
+
+    def poll_changes(self, program_representation):
+        current_files = self.get_current_source_files()
+        known_files = program_representation.source_files
+        changed_files = []
+        added_files = []
+        deleted_files = []
+        for file_path, file_stat in current_files.items():
+            if file_path not in known_files:
+                added_files.append(file_path)
+            elif known_files[file_path] != file_stat:
+                changed_files.append(file_path)
+        for file_path in known_files:
+            if file_path not in current_files:
+                deleted_files.append(file_path)
+        return sorted(changed_files), sorted(added_files), sorted(deleted_files)
+
+
+    def poll(self, program_representation):
+        self.last_poll_time = time.monotonic()
+        return self.poll_changes(program_representation)
+
+
+    def is_poll_due(self):
+        return self.last_poll_time is None or time.monotonic() - self.last_poll_time >= self.poll_interval
+
+
+    def refresh(self, program_representation):
+        changed_files, added_files, deleted_files = self.poll(program_representation)
+        for file_path in deleted_files:
+            program_representation.replace_source_file(file_path, None)
+        for file_path in changed_files + added_files:
+            try:
+                partial_representation = PARSER.parse_partial_representation(self.parser_class, file_path)
+            except OSError:
+                # File vanished between polling and parsing
+                partial_representation = None
+            program_representation.replace_source_file(file_path, partial_representation)
+        return changed_files, added_files, deleted_files
+
+
+    def refresh_if_due(self, program_representation):
+        if not self.is_poll_due():
+            return [], [], []
+        return self.refresh(program_representation)
@@ -0,0 +1,339 @@
+"""
+Single pass tokenizer and term reader for Prolog source.
+
+The tokenizer walks the program text once with a single compiled pattern, collecting the tokens of
+one clause at a time. When the terminating period of a clause is reached, a recursive descent,
+operator precedence reader turns its tokens into a Predicate, which is yielded immediately. Clauses
+may span any number of lines, and a line may hold several clauses.
+"""
+
+import re
+import sys
+import code_browsing.errors as SCBErrors
+import code_browsing.program_representation as PR
+
+
+_SYMBOL_CHARS = '+-*/\\^<>=~:.?@#&$'
+
+# Comments and whitespace are consumed as part of the token that follows them. Group 1 holds
+# punctuation, variables, numbers, strings and clause ends, group 2 names (atoms, quoted atoms,
+# symbol atoms and solo characters) with group 3 holding an immediately following '(' for functional
+# notation, and group 4 any character that cannot start a token. A match with no groups set is
+# trailing whitespace or comments.
+_TOKEN_PATTERN = re.compile(r'''
+    (?:\s+|%[^\n]*|/\*.*?\*/)*
+    (?:
+        (\.(?=\s|%|$)
+        |0'(?:\\.|''|[^\\])|0[xob][0-9a-fA-F]+|\d+(?:\.\d+)?(?:[eE][+-]?\d+)?
+        |[A-Z_]\w*
+        |"(?:[^"\\]|\\.|"")*"|`(?:[^`\\]|\\.)*`
+        |[()\[\]{},|])
+      | ([^\W\dA-Z_]\w*|'(?:[^'\\]|\\.|'')*'|[+\-*/\\^<>=~:.?@#&$]+|[!;])(\(?)
+      | (\S)
+    )?
+''', re.S | re.X)
+
+# Token kinds, keyed by the first character of the token text
+_OTHER_KINDS = {'.': 'end', '"': 'str', '`': 'str', '_': 'var'}
+_OTHER_KINDS.update(dict.fromkeys('()[]{},|', 'punct'))
+_OTHER_KINDS.update(dict.fromkeys('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'var'))
+_NAME_KINDS = {"'": 'qatom', '!': 'solo', ';': 'solo'}
+_NAME_KINDS.update(dict.fromkeys(_SYMBOL_CHARS, 'sym'))
+
+_EOF_TOKEN = ('', 'eof')
+
+# Standard operator table: name -> (priority, type)
+INFIX_OPERATORS = {
+    ':-': (1200, 'xfx'), '-->': (1200, 'xfx'),
+    ';': (1100, 'xfy'), '|': (1100, 'xfy'),
+    '->': (1050, 'xfy'), '*->': (1050, 'xfy'),
+    ',': (1000, 'xfy'),
+    '=': (700, 'xfx'), '\\=': (700, 'xfx'), '==': (700, 'xfx'), '\\==': (700, 'xfx'),
+    '@<': (700, 'xfx'), '@>': (700, 'xfx'), '@=<': (700, 'xfx'), '@>=': (700, 'xfx'),
+    '=..': (700, 'xfx'), 'is': (700, 'xfx'), '=:=': (700, 'xfx'), '=\\=': (700, 'xfx'),
+    '<': (700, 'xfx'), '>': (700, 'xfx'), '=<': (700, 'xfx'), '>=': (700, 'xfx'),
+    ':': (200, 'xfy'),
+    '+': (500, 'yfx'), '-': (500, 'yfx'), '/\\': (500, 'yfx'), '\\/': (500, 'yfx'), 'xor': (500, 'yfx'),
+    '*': (400, 'yfx'), '/': (400, 'yfx'), '//': (400, 'yfx'), 'rem': (400, 'yfx'),
+    'mod': (400, 'yfx'), 'div': (400, 'yfx'), '<<': (400, 'yfx'), '>>': (400, 'yfx'),
+    '**': (200, 'xfx'), '^': (200, 'xfy'),
+}
+
+PREFIX_OPERATORS = {
+    ':-': (1200, 'fx'), '?-': (1200, 'fx'),
+    '\\+': (900, 'fy'),
+    '-': (200, 'fy'), '+': (200, 'fy'), '\\': (200, 'fy'),
+}
+
+# Operators that glue goals together rather than compute a value
+CONTROL_OPERATORS = frozenset([',', ';', '|', '->', '*->'])
+
+_INFIX_KINDS = frozenset(['sym', 'atom', 'solo', 'punct'])
+_TERM_START_KINDS = frozenset(['num', 'var', 'str', 'atom', 'qatom', 'sym', 'solo', 'functor'])
+_OPENING_PUNCT = frozenset(['(', '[', '{'])
+_CLOSING_PUNCT = frozenset([')', ']', '}'])
+
+
+def iter_clause_tokens(text):
+    """Generator that splits program text into the token lists of individual clauses
+
+    Yields
+    ------
+    tuple
+        (line number of the clause start, list of (text, kind) tokens ending with the clause end)
+    """
+
+    clause_tokens = []
+    clause_start = 0
+    line_number = 1
+    line_offset = 0
+    other_kinds = _OTHER_KINDS
+    name_kinds = _NAME_KINDS
+    for match in _TOKEN_PATTERN.finditer(text):
+        other, name, paren, error = match.groups()
+        if other is None and name is None and error is None:
+            continue
+        if not clause_tokens:
+            clause_start = match.start()
+        if name is not None:
+            if paren:
+                clause_tokens.append((name, 'functor'))
+            else:
+                clause_tokens.append((name, name_kinds.get(name[0], 'atom')))
+        elif other is not None:
+            kind = other_kinds.get(other[0], 'num')
+            clause_tokens.append((other, kind))
+            if kind == 'end':
+                line_number = line_number + text.count('\n', line_offset, clause_start)
+                line_offset = clause_start
+                yield line_number, clause_tokens
+                clause_tokens = []
+        else:
+            clause_tokens.append((error, 'error'))
+    if clause_tokens:
+        line_number = line_number + text.count('\n', line_offset, clause_start)
+        yield line_number, clause_tokens
+
+
+class PrologTermReader:
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = None
+        self.position = 0
+
+
+    def read_clauses(self):
+        for line_number, clause_tokens in iter_clause_tokens(self.text):
+            clause_tokens.append(_EOF_TOKEN)
+            self.tokens = clause_tokens
+            self.position = 0
+            try:
+                predicate = self.read_clause()
+            except SCBErrors.SCBPrologSyntaxError as err:
+                sys.stderr.write('WARNING: Skipping unparsable clause starting on line {}: {}\n'.format(line_number, err))
+                continue
+            except RecursionError:
+                sys.stderr.write('WARNING: Skipping clause starting on line {}, nested too deeply to parse\n'.format(line_number))
+                continue
+            if predicate is not None:
+                yield predicate
+
+
+    def syntax_error(self, message):
+        text, kind = self.tokens[min(self.position, len(self.tokens) - 1)]
+        if kind == 'eof':
+            return SCBErrors.SCBPrologSyntaxError('{} at end of file'.format(message))
+        return SCBErrors.SCBPrologSyntaxError('{} near {}'.format(message, text))
+
+
+    def expect(self, text):
+        token = self.tokens[self.position]
+        if token[0] != text or (token[1] != 'punct' and token[1] != 'end'):
+            raise self.syntax_error('expected {}'.format(text))
+        self.position = self.position + 1
+
+
+    def read_clause(self):
+        text, kind = self.tokens[0]
+        if kind == 'sym' and (text == ':-' or text == '?-'):
+            # Directives are not part of the program representation
+            return None
+
+        head = self.parse(1199)
+        body = []
+        text, kind = self.tokens[self.position]
+        if kind == 'sym' and (text == ':-' or text == '-->'):
+            self.position = self.position + 1
+            body = self.flatten_goals(self.parse(1199))
+        if self.tokens[self.position][1] != 'end':
+            raise self.syntax_error('expected end of clause')
+
+        if isinstance(head, PR.Function):
+            return PR.Predicate(head.name, head.set_of_terms, body)
+        elif isinstance(head, PR.Variable) and head.computed_type == 'atom':
+            return PR.Predicate(head.name, [], body)
+        raise self.syntax_error('invalid clause head')
+
+
+    def parse(self, max_priority):
+        # Operator nodes are (name, [operands]) tuples until converted with to_term
+        left, left_priority = self.parse_primary(max_priority)
+        tokens = self.tokens
+        while True:
+            text, kind = tokens[self.position]
+            if kind not in _INFIX_KINDS:
+                break
+            operator = INFIX_OPERATORS.get(text)
+            if operator is None:
+                break
+            priority, operator_type = operator
+            if priority > max_priority:
+                break
+            left_max = priority if operator_type == 'yfx' else priority - 1
+            if left_priority > left_max:
+                break
+            self.position = self.position + 1
+            if operator_type == 'xfy':
+                # Right associative chains such as long conjunctions are collected in a loop, so their
+                # length is not limited by the recursion depth.
+                names = [text]
+                operands = [left, self.parse(priority - 1)]
+                while True:
+                    next_text, next_kind = tokens[self.position]
+                    if next_kind not in _INFIX_KINDS or INFIX_OPERATORS.get(next_text) != operator:
+                        break
+                    self.position = self.position + 1
+                    names.append(next_text)
+                    operands.append(self.parse(priority - 1))
+                left = operands.pop()
+                while names:
+                    left = (names.pop(), [operands.pop(), left])
+            else:
+                left = (text, [left, self.parse(priority - 1)])
+            left_priority = priority
+        return left
+
+
+    def parse_primary(self, max_priority):
+        text, kind = self.tokens[self.position]
+        self.position = self.position + 1
+
+        if kind == 'var':
+            return PR.Variable(text, 'var'), 0
+        elif kind == 'functor':
+            if text[0] == "'":
+                text = text[1:-1]
+            return PR.Function(text, self.parse_arguments()), 0
+        elif kind == 'atom' or kind == 'sym' or kind == 'solo':
+            if text in PREFIX_OPERATORS:
+                next_text, next_kind = self.tokens[self.position]
+                if text == '-' and next_kind == 'num':
+                    self.position = self.position + 1
+                    return PR.Variable('-' + next_text, 'scalar'), 0
+                is_term_start = next_kind in _TERM_START_KINDS or (next_kind == 'punct' and next_text in _OPENING_PUNCT)
+                if is_term_start and (next_kind not in _INFIX_KINDS or next_text not in INFIX_OPERATORS):
+                    priority, operator_type = PREFIX_OPERATORS[text]
+                    if priority > max_priority:
+                        priority = 999
+                    argument_max = priority if operator_type == 'fy' else priority - 1
+                    return (text, [self.parse(argument_max)]), priority
+            return PR.Variable(text, 'atom'), 0
+        elif kind == 'num':
+            return PR.Variable(text, 'scalar'), 0
+        elif kind == 'qatom':
+            return PR.Variable(text[1:-1], 'atom'), 0
+        elif kind == 'str':
+            return PR.Variable(text, None), 0
+        elif kind == 'punct':
+            if text == '(':
+                inner = self.parse(1200)
+                self.expect(')')
+                return inner, 0
+            elif text == '[':
+                # Lists keep their flat representation: a list typed variable named by its source text
+                return PR.Variable(self.skip_bracketed(), 'list'), 0
+            elif text == '{':
+                return PR.Variable(self.skip_bracketed(), None), 0
+        self.position = self.position - 1
+        raise self.syntax_error('unexpected token')
+
+
+    def parse_arguments(self):
+        arguments = [self.to_term(self.parse(999))]
+        tokens = self.tokens
+        while tokens[self.position][0] == ',' and tokens[self.position][1] == 'punct':
+            self.position = self.position + 1
+            arguments.append(self.to_term(self.parse(999)))
+        self.expect(')')
+        return arguments
+
+
+    def skip_bracketed(self):
+        # Skips to the bracket closing the one just read, returning the covered source text
+        tokens = self.tokens
+        start = self.position - 1
+        depth = 1
+        position = self.position
+        while depth > 0:
+            text, kind = tokens[position]
+            if kind == 'punct':
+                if text in _OPENING_PUNCT:
+                    depth = depth + 1
+                elif text in _CLOSING_PUNCT:
+                    depth = depth - 1
+            elif kind == 'functor':
+                depth = depth + 1
+            elif kind == 'end' or kind == 'eof':
+                self.position = position
+                raise self.syntax_error('unbalanced brackets')
+            position = position + 1
+        self.position = position
+        parts = []
+        for text, kind in tokens[start:position]:
+            parts.append(text)
+            if kind == 'functor':
+                parts.append('(')
+        return ''.join(parts)
+
+
+    def flatten_goals(self, node):
+        goals = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            # Only conjunctions are split into goals, disjunctions and if-then-else stay control terms
+            if isinstance(node, tuple) and node[0] == ',' and len(node[1]) == 2:
+                stack.append(node[1][1])
+                stack.append(node[1][0])
+            else:
+                goals.append(self.to_term(node))
+        return goals
+
+
+    def to_term(self, node):
+        # Operator trees are flattened into a single Operator term per kind of operator
+        if not isinstance(node, tuple):
+            return node
+        is_control = node[0] in CONTROL_OPERATORS
+        operations = []
+        operators = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                operations.append(node)
+            elif isinstance(node, tuple) and (node[0] in CONTROL_OPERATORS) == is_control:
+                if len(node[1]) == 1:
+                    operations.append(node[0])
+                    stack.append(node[1][0])
+                else:
+                    # Visit the left operand, then the operation, then the right operand
+                    stack.append(node[1][1])
+                    stack.append(node[0])
+                    stack.append(node[1][0])
+            else:
+                operators.append(self.to_term(node))
+        if is_control:
+            return PR.Operator('control', operations, operators)
+        return PR.Operator('operator', operations, operators)
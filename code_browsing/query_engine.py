@@ -1,223 +1,503 @@
 import os
 import sys
 import re
+import json
+import time
+import itertools
+import collections
 import code_browsing.program_parser as PARSER
 import code_browsing.errors as SCBErrors
 import code_browsing.program_representation as PR
 import code_browsing.logger as LOGGER
+import code_browsing.snapshot as SNAPSHOT
+import code_browsing.program_watcher as PROGRAM_WATCHER
+import code_browsing.query_planner as QUERY_PLANNER
+import code_browsing.call_graph as CALL_GRAPH
+import code_browsing.name_pattern as NAME_PATTERN
+import code_browsing.vector_index as VECTOR_INDEX
+import code_browsing.mapped_index as MAPPED_INDEX
+import code_browsing.metrics as METRICS
 import code_browsing
 
+# A name:/REGEX/ assertion, kept whole by the tokenizer and left in its case by normalize_query
+NAME_REGEX_PATTERN = re.compile(r'(?<![^\s(])name:/(?:[^/\\]|\\.)*/')
+
 class SCBQuery:
 
-    def __init__(self, original_str, search_type, assertion_list, assertion_relationships):
+    def __init__(self, original_str, search_type, assertion_list, assertion_tree, search_arity=-1):
         self.original_str = original_str
         self.search_type = search_type
+        self.search_arity = search_arity
         self.assertion_list = assertion_list
-        self.assertion_relationships = assertion_relationships
+        # SCBAssertion, SCBAssertionGroup or None if the query has no where clause
+        self.assertion_tree = assertion_tree
+        # Callable taking a QueryIndex and returning the root of the query plan, set when compiled
+        self.evaluator = None
+        # Normalized query string, used as the key of the compiled query and result caches
+        self.query_key = None
+        # Number of matches to return, None for all, and number of matches to skip first
+        self.limit = None
+        self.offset = 0
 
 
 class SCBQueryResult:
 
     def __init__(self, original_query, true_matched_terms, partially_matched_terms):
+        # true_matched_terms is a list, or an iterator for lazy results that can only be consumed once
         self.original_query = original_query
         self.true_matched_terms = true_matched_terms
         self.partially_matched_terms = partially_matched_terms
 
     def print_result(self, fp=sys.stdout):
+        # Matches are written as they are found, so lazy results print without waiting for the whole search
         fp.write('\nQuery: {}\n\n'.format(self.original_query))
+        num_matches = 0
         for term in self.true_matched_terms:
             fp.write(' > ')
             term.print_term(fp, verbosity='low')
+            fp.flush()
+            num_matches = num_matches + 1
         
-        fp.write('\n{} Matching result(s) found.\n'.format(len(self.true_matched_terms)))
+        fp.write('\n{} Matching result(s) found.\n'.format(num_matches))
+
+    def to_dict(self):
+        matches = [term.to_dict() for term in self.true_matched_terms]
+        return {'query': self.original_query, 'count': len(matches), 'matches': matches}
 
 class SCBAssertion:
 
     def __init__(self, assertion_operator, assertion_values):
-        #VALID ASSERTION OPERATORS: inputs:, bodycontains:, returns:
+        #VALID ASSERTION OPERATORS: inputs:, bodycontains:, returns:, calls:, calledby:, reaches:, name:
         self.assertion_operator = assertion_operator
         self.assertion_values = assertion_values
 
 
+class SCBAssertionGroup:
+
+    def __init__(self, group_operator, children):
+        # group_operator is 'and' or 'or', children are SCBAssertion or SCBAssertionGroup objects
+        self.group_operator = group_operator
+        self.children = children
+
+
+class SCBQueryCache:
+
+    def __init__(self, max_size=128):
+        # Least recently used compiled queries, keyed by normalized query string
+        self.max_size = max_size
+        self.compiled_queries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_key):
+        scb_query = self.compiled_queries.get(query_key)
+        if scb_query is not None:
+            self.compiled_queries.move_to_end(query_key)
+            self.hits = self.hits + 1
+        else:
+            self.misses = self.misses + 1
+        return scb_query
+
+    def add(self, query_key, scb_query):
+        self.compiled_queries[query_key] = scb_query
+        self.compiled_queries.move_to_end(query_key)
+        while len(self.compiled_queries) > self.max_size:
+            self.compiled_queries.popitem(last=False)
+
+
+def estimate_result_size(scb_result):
+    # Shallow size of the result lists and matched terms. Terms shared with the representation are
+    # counted too, so this errs on the side of evicting early.
+    result_size = sys.getsizeof(scb_result.true_matched_terms) + sys.getsizeof(scb_result.partially_matched_terms)
+    for term in scb_result.true_matched_terms + scb_result.partially_matched_terms:
+        result_size = result_size + sys.getsizeof(term) + sys.getsizeof(term.__dict__)
+        for sub_term in getattr(term, 'set_of_terms', []):
+            result_size = result_size + sys.getsizeof(sub_term) + sys.getsizeof(sub_term.__dict__)
+    return result_size
+
+
+class SCBResultCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        # Least recently used query results, keyed by normalized query string. Each entry holds the
+        # representation generation it was computed at, the searched arity, the result and its size.
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def is_stale(self, entry, program_representation):
+        return entry[0] < program_representation.get_change_generation(entry[1])
+
+    def remove(self, query_key):
+        entry = self.entries.pop(query_key)
+        self.current_bytes = self.current_bytes - entry[3]
+
+    def clear(self):
+        self.entries = collections.OrderedDict()
+        self.current_bytes = 0
+
+    def invalidate_stale(self, program_representation):
+        # Drops the results for arities whose symbols changed, all others stay cached
+        for query_key, entry in list(self.entries.items()):
+            if self.is_stale(entry, program_representation):
+                self.remove(query_key)
+                self.invalidations = self.invalidations + 1
+
+    def get(self, query_key, program_representation):
+        entry = self.entries.get(query_key)
+        if entry is not None and self.is_stale(entry, program_representation):
+            self.remove(query_key)
+            self.invalidations = self.invalidations + 1
+            entry = None
+        if entry is None:
+            self.misses = self.misses + 1
+            return None
+        self.entries.move_to_end(query_key)
+        self.hits = self.hits + 1
+        return entry[2]
+
+    def add(self, query_key, search_arity, program_representation, scb_result):
+        result_size = estimate_result_size(scb_result)
+        if result_size > self.max_bytes:
+            return
+        if query_key in self.entries:
+            self.remove(query_key)
+        self.entries[query_key] = (program_representation.generation, search_arity, scb_result, result_size)
+        self.current_bytes = self.current_bytes + result_size
+        while self.current_bytes > self.max_bytes:
+            evicted_key = next(iter(self.entries))
+            self.remove(evicted_key)
+            self.evictions = self.evictions + 1
+
 
 class QueryEngine:
 
-    def __init__(self, program_representation):
+    def __init__(self, program_representation, query_cache_size=128, result_cache_bytes=64 * 1024 * 1024, vectorized=False, query_index=None):
 
+        if vectorized and not VECTOR_INDEX.is_available():
+            print('WARNING - NumPy is not installed, using the posting list query index instead.')
+            vectorized = False
+        self.vectorized = vectorized
         self.program_representation = program_representation
+        self.query_index = self.get_query_index(program_representation, query_index)
+        self.index_generation = program_representation.generation
+        self.query_cache = SCBQueryCache(max_size=query_cache_size)
+        self.result_cache = SCBResultCache(max_bytes=result_cache_bytes)
 
 
-    def parse_assertions(self, assertion_str):
-        # Make conjunction/disjunction one character for simplicity
-        assertion_list = []
-        assertion_relationships = []
-        simplified_assertion_string = re.sub(' and ', 'A', assertion_str)
-        simplified_assertion_string = re.sub(' or ', 'O', simplified_assertion_string)
-
-        nested_assertion_counter = 0
-        current_assertion = ''
-        for c in simplified_assertion_string:
-            if c == '(':
-                nested_assertion_counter = nested_assertion_counter + 1
-            elif c == ')':
-                nested_assertion_counter = nested_assertion_counter - 1
-            elif nested_assertion_counter == 0 and (c == 'O' or c=='A'):
-                operator = current_assertion.split(':')[0]
-                values = current_assertion.split(':')[1].split(',')
-                assertion_list.append(SCBAssertion(operator, values))
-                current_assertion = ''
-                if(c == 'O'):
-                    assertion_relationships.append(['or', len(assertion_list) - 1, len(assertion_list)])
+    def build_query_index(self, program_representation):
+        if isinstance(program_representation, MAPPED_INDEX.MappedRepresentation):
+            return MAPPED_INDEX.MappedQueryIndex(program_representation)
+        if self.vectorized:
+            return VECTOR_INDEX.VectorQueryIndex(program_representation)
+        return QUERY_PLANNER.QueryIndex(program_representation)
+
+
+    def get_query_index(self, program_representation, query_index):
+        # An index loaded from a snapshot is used if it is the kind this engine would build and is
+        # up to date with the representation
+        if (query_index is not None and type(query_index) is QUERY_PLANNER.QueryIndex and not self.vectorized
+                and query_index.program_representation is program_representation
+                and query_index.generation == program_representation.generation):
+            return query_index
+        return self.build_query_index(program_representation)
+
+
+    def get_snapshot_index(self):
+        # The index to store in a snapshot of the representation, vectorized and mapped indexes are
+        # rebuilt on load
+        self.update_program_index()
+        if type(self.query_index) is QUERY_PLANNER.QueryIndex:
+            return self.query_index
+        return None
+
+
+    def set_program_representation(self, program_representation, query_index=None):
+        # Indexes are built once per load or refresh, queries only read them
+        self.program_representation = program_representation
+        self.query_index = self.get_query_index(program_representation, query_index)
+        self.index_generation = program_representation.generation
+        self.result_cache.clear()
+
+
+    def update_program_index(self):
+        # Incremental updates bump the representation generation, the index is patched for the changed
+        # symbols or rebuilt, and results for the changed arities are dropped
+        if self.index_generation != self.program_representation.generation:
+            start_time = time.perf_counter()
+            patched = self.query_index.apply_changes()
+            if not patched:
+                self.query_index = self.build_query_index(self.program_representation)
+            self.index_generation = self.program_representation.generation
+            self.result_cache.invalidate_stale(self.program_representation)
+            LOGGER.trace('update_index', patched=patched, elapsed_ms=(time.perf_counter() - start_time) * 1000)
+
+
+    def tokenize_assertions(self, assertion_str):
+        # Parentheses and standalone and/or are separators, everything between them is an assertion,
+        # so types containing spaces such as struct student_records* stay intact
+        tokens = []
+        # name:/REGEX/ is one token, whatever parentheses or and/or words the regex holds
+        for token in re.split(r'({}|\(|\)|(?<![^\s()])(?:and|or)(?![^\s()]))'.format(NAME_REGEX_PATTERN.pattern), assertion_str):
+            token = token.strip()
+            if len(token) > 0:
+                tokens.append(token)
+        return tokens
+
+
+    def parse_assertion_group(self, tokens, position, assertion_list):
+        # Grammar: group := conjunction ('or' conjunction)*, conjunction := primary ('and' primary)*,
+        # primary := '(' group ')' | ASSERTION. 'and' binds tighter than 'or'.
+        disjuncts = []
+        while True:
+            conjuncts = []
+            while True:
+                primary, position = self.parse_assertion_primary(tokens, position, assertion_list)
+                conjuncts.append(primary)
+                if position < len(tokens) and tokens[position] == 'and':
+                    position = position + 1
                 else:
-                    assertion_relationships.append(['and', len(assertion_list) - 1, len(assertion_list)])
+                    break
+            if len(conjuncts) == 1:
+                disjuncts.append(conjuncts[0])
+            else:
+                disjuncts.append(SCBAssertionGroup('and', conjuncts))
+            if position < len(tokens) and tokens[position] == 'or':
+                position = position + 1
             else:
-                current_assertion = current_assertion + c
-        assertion_list.append(SCBAssertion(current_assertion.split(':')[0], current_assertion.split(':')[1].split(',')))
+                break
+        if len(disjuncts) == 1:
+            return disjuncts[0], position
+        return SCBAssertionGroup('or', disjuncts), position
 
-        return assertion_list, assertion_relationships
 
+    def parse_assertion_primary(self, tokens, position, assertion_list):
+        if position >= len(tokens):
+            raise SCBErrors.SCBInvalidQueryError
+        token = tokens[position]
+        if token == '(':
+            group, position = self.parse_assertion_group(tokens, position + 1, assertion_list)
+            if position >= len(tokens) or tokens[position] != ')':
+                raise SCBErrors.SCBInvalidQueryError
+            return group, position + 1
+        if token in (')', 'and', 'or') or ':' not in token:
+            raise SCBErrors.SCBInvalidQueryError
+        operator, values = token.split(':', 1)
+        if operator.strip() == 'name' and values.strip().startswith('/'):
+            # Commas belong to the regular expression
+            values = [values.strip()]
+        else:
+            values = [value.strip() for value in values.split(',')]
+        if operator.strip() == 'inputs':
+            values = [QUERY_PLANNER.normalize_input_type(value) for value in values]
+        elif operator.strip() in ['calls', 'calledby', 'reaches']:
+            try:
+                values = [self.normalize_symbol_key(value, operator.strip()) for value in values]
+            except ValueError:
+                raise SCBErrors.SCBInvalidQueryError
+        elif operator.strip() == 'name':
+            try:
+                for value in values:
+                    NAME_PATTERN.NamePattern(value)
+            except ValueError:
+                raise SCBErrors.SCBInvalidQueryError
+        assertion = SCBAssertion(operator.strip(), values)
+        assertion_list.append(assertion)
+        return assertion, position + 1
 
-    def convert_query(self, query_str):
-        # QUERY FORMAT: find PR_TYPE where ASSERTION and (ASSERTION or ASSERTION)
-        try:
-            query_str_stripped = re.sub(' +', ' ', query_str.lower().strip()[:-1])
-            query_parts = query_str_stripped.split(' ', 3)
-            if len(query_parts) == 2:
-                return SCBQuery(query_str, query_parts[1], [], [])
-            query_type = query_parts[1]
-            assertion_str = query_parts[3]
-        except IndexError:
+
+    def normalize_symbol_key(self, value, operator):
+        if operator == 'reaches' and value in QUERY_PLANNER.BODY_CONTAINS_FLAGS:
+            return value
+        name, arity = CALL_GRAPH.parse_symbol_key(value.replace(' ', ''))
+        if arity == -1:
+            return name
+        return '{}/{}'.format(name, arity)
+
+
+    def parse_assertions(self, assertion_str):
+        assertion_list = []
+        tokens = self.tokenize_assertions(assertion_str)
+        assertion_tree, position = self.parse_assertion_group(tokens, 0, assertion_list)
+        if position != len(tokens):
             raise SCBErrors.SCBInvalidQueryError
-        assertion_list, assertion_relationships = self.parse_assertions(assertion_str)
-        return SCBQuery(query_str, query_type, assertion_list, assertion_relationships)
+        return assertion_list, assertion_tree
 
-    def process_query(self, scb_query):
-        print('\nSearching for {} that satisfy assertions:'.format(scb_query.search_type))
-        for assertion in scb_query.assertion_list:
-            print(' - Assertion: {} -> {}'.format(assertion.assertion_operator, assertion.assertion_values))
 
-        if isinstance(self.program_representation, PR.PrologProgramRepresentation):
-            return self.process_prolog_query(scb_query)
-        elif isinstance(self.program_representation, PR.CProgramRepresentation):
-            return self.process_c_query(scb_query)
+    def compile_assertion_tree(self, assertion_tree, search_arity):
+        # Each node becomes a closure over its compiled children, so running a query only builds the
+        # plan for the current index
+        if isinstance(assertion_tree, SCBAssertionGroup):
+            compiled_children = [self.compile_assertion_tree(child, search_arity) for child in assertion_tree.children]
+            if assertion_tree.group_operator == 'and':
+                return lambda query_index: query_index.plan_and([child(query_index) for child in compiled_children])
+            return lambda query_index: query_index.plan_or([child(query_index) for child in compiled_children])
+        return lambda query_index: query_index.plan_assertion(assertion_tree, search_arity)
 
 
-    def process_c_query(self, scb_query):
-        true_matches = []
-        partial_matches = []
-        search_arity = -1
-        if scb_query.search_type.startswith('function'):
-            try:
-                search_arity = scb_query.search_type.split('/')[1]
-            except IndexError:
-                print('No arity specified of target function or predicate.')
+    def compile_query(self, scb_query):
+        search_arity = scb_query.search_arity
+        if scb_query.assertion_tree is None:
+            if search_arity == -1:
+                scb_query.evaluator = lambda query_index: query_index.plan_all()
+            else:
+                scb_query.evaluator = lambda query_index: query_index.plan_arity(search_arity)
+            return scb_query
+        compiled_tree = self.compile_assertion_tree(scb_query.assertion_tree, search_arity)
+        if search_arity == -1:
+            scb_query.evaluator = compiled_tree
+        else:
+            scb_query.evaluator = lambda query_index: query_index.plan_and([query_index.plan_arity(search_arity), compiled_tree(query_index)])
+        return scb_query
+
+
+    def normalize_query(self, query_str):
+        # Queries are case-insensitive, but name:/REGEX/ values keep their case since escapes such as
+        # \S and \s differ, and are matched ignoring case instead
+        normalized_parts = []
+        last_end = 0
+        for match in re.finditer(NAME_REGEX_PATTERN.pattern, query_str, re.IGNORECASE):
+            normalized_parts.append(query_str[last_end:match.start()].lower())
+            normalized_parts.append('name:' + match.group()[len('name:'):])
+            last_end = match.end()
+        normalized_parts.append(query_str[last_end:].lower())
+        return re.sub(r'\s+', ' ', ''.join(normalized_parts).strip())
+
+
+    def split_paging_clauses(self, query_key):
+        # Strips trailing limit N and offset N clauses, in either order, from a normalized query
+        query_body = query_key[:-1].strip()
+        paging = {}
+        match = re.search(r'\s(limit|offset) (\d+)$', query_body)
+        while match is not None:
+            if match.group(1) in paging:
+                raise SCBErrors.SCBInvalidQueryError
+            paging[match.group(1)] = int(match.group(2))
+            query_body = query_body[:match.start()].strip()
+            match = re.search(r'\s(limit|offset) (\d+)$', query_body)
+        return query_body + '.', paging.get('limit'), paging.get('offset', 0)
 
-            for func in self.program_representation.c_functions:
-                if func.arity == int(search_arity) or search_arity == -1:
-                    assertion_results = []
-                    for assertion in scb_query.assertion_list:
-                        assertion_results.append(self.check_assertion(assertion, func))
-                    check = self.combine_results_with_relationships(assertion_results, scb_query.assertion_relationships)
-                    if check:
-                        true_matches.append(func)
-        return SCBQueryResult(scb_query.original_str, true_matches, partial_matches)
 
+    def convert_query(self, query_str):
+        # QUERY FORMAT: find PR_TYPE where ASSERTION and (ASSERTION or ASSERTION) limit N offset N
+        query_key = self.normalize_query(query_str)
+        if not query_key.endswith('.'):
+            raise SCBErrors.SCBInvalidQueryError
+        # Paged queries share the compiled query and cached result of the unpaged query
+        query_key, limit, offset = self.split_paging_clauses(query_key)
+        cached_query = self.query_cache.get(query_key)
+        if cached_query is None:
+            query_parts = query_key[:-1].strip().split(' ', 3)
+            if len(query_parts) == 3 or (len(query_parts) == 4 and query_parts[2] != 'where') or len(query_parts) < 2:
+                raise SCBErrors.SCBInvalidQueryError
+            query_type = query_parts[1]
+            search_arity = -1
+            if '/' in query_type:
+                try:
+                    search_arity = int(query_type.split('/')[1])
+                except ValueError:
+                    raise SCBErrors.SCBInvalidQueryError
+            assertion_list = []
+            assertion_tree = None
+            if len(query_parts) == 4:
+                assertion_list, assertion_tree = self.parse_assertions(query_parts[3])
+            cached_query = self.compile_query(SCBQuery(query_str, query_type, assertion_list, assertion_tree, search_arity=search_arity))
+            cached_query.query_key = query_key
+            self.query_cache.add(query_key, cached_query)
+
+        scb_query = SCBQuery(query_str, cached_query.search_type, cached_query.assertion_list,
+                             cached_query.assertion_tree, search_arity=cached_query.search_arity)
+        scb_query.evaluator = cached_query.evaluator
+        scb_query.query_key = query_key
+        scb_query.limit = limit
+        scb_query.offset = offset
+        return scb_query
+
+    def process_query(self, scb_query, verbose=True, lazy=False):
+        if verbose:
+            print('\nSearching for {} that satisfy assertions:'.format(scb_query.search_type))
+            for assertion in scb_query.assertion_list:
+                print(' - Assertion: {} -> {}'.format(assertion.assertion_operator, assertion.assertion_values))
+
+            if scb_query.search_arity == -1 and self.is_searchable_type(scb_query.search_type):
+                print('No arity specified of target function or predicate.')
 
-    def process_prolog_query(self, scb_query):
+        if lazy:
+            return SCBQueryResult(scb_query.original_str, self.iter_query(scb_query), [])
+        with LOGGER.timed('query', query=scb_query.original_str):
+            matches = list(self.iter_query(scb_query))
+        return SCBQueryResult(scb_query.original_str, matches, [])
+
+
+    def iter_query(self, scb_query):
+        # Generator over the matches of a query. Symbols are looked up one at a time, so evaluation
+        # stops as soon as the limit is reached or the caller stops iterating.
+        self.update_program_index()
+        if not self.is_searchable_type(scb_query.search_type):
+            return
+        stop = None
+        if scb_query.limit is not None:
+            stop = scb_query.offset + scb_query.limit
+        if scb_query.query_key is not None:
+            cached_result = self.result_cache.get(scb_query.query_key, self.program_representation)
+            if cached_result is not None:
+                yield from itertools.islice(cached_result.true_matched_terms, scb_query.offset, stop)
+                return
+        if scb_query.query_key is None or stop is not None or scb_query.offset > 0:
+            yield from self.query_index.iter_symbols(scb_query, scb_query.offset, stop)
+            return
+        # Complete results are cached once they have been fully consumed
+        generation = self.program_representation.generation
         true_matches = []
-        partial_matches = []
-        search_arity = -1
-        if scb_query.search_type.startswith('predicate'):
-            try:
-                search_arity = scb_query.search_type.split('/')[1]
-            except IndexError:
-                print('No arity specified of target function or predicate.')
+        for term in self.query_index.iter_symbols(scb_query):
+            true_matches.append(term)
+            yield term
+        if generation == self.program_representation.generation:
+            self.result_cache.add(scb_query.query_key, self.get_cache_arity(scb_query), self.program_representation,
+                                  SCBQueryResult(scb_query.original_str, true_matches, []))
+
+
+    def get_cache_arity(self, scb_query):
+        # Results that depend on symbols of other arities are dropped whenever any symbol changes
+        for assertion in scb_query.assertion_list:
+            if assertion.assertion_operator in QUERY_PLANNER.CROSS_ARITY_OPERATORS:
+                return -1
+        return scb_query.search_arity
+
+
+    def is_searchable_type(self, search_type):
+        if isinstance(self.program_representation, PR.PrologProgramRepresentation):
+            return search_type.startswith('predicate')
+        elif isinstance(self.program_representation, PR.CProgramRepresentation):
+            return search_type.startswith('function')
+        elif isinstance(self.program_representation, MAPPED_INDEX.MappedRepresentation):
+            return search_type.startswith(self.program_representation.search_type)
+        return False
 
-            for pred in self.program_representation.predicates:
-                if pred.arity == int(search_arity) or search_arity == -1:
-                    assertion_results = []
-                    for assertion in scb_query.assertion_list:
-                        assertion_results.append(self.check_assertion(assertion, pred))
-                    check = self.combine_results_with_relationships(assertion_results, scb_query.assertion_relationships)
-                    if check:
-                        true_matches.append(pred)
-        return SCBQueryResult(scb_query.original_str, true_matches,partial_matches)
-
-
-    def combine_results_with_relationships(self, assertion_results, assertion_relationships):
-        combined_result = []
-        for relation in assertion_relationships:
-            if relation[0] == 'and':
-                if assertion_results[relation[1]] and assertion_results[relation[2]]:
-                    combined_result.append(True)
-                else:
-                    combined_result.append(False)
-            if relation[0] == 'or':
-                if assertion_results[relation[1]] or assertion_results[relation[2]]:
-                    combined_result.append(True)
-                else:
-                    combined_result.append(False)
-
-        for i in range(0, len(assertion_results)):
-            in_relationship = False
-            for relation in assertion_relationships:
-                if relation[1] == i or relation[2] == i:
-                    in_relationship = True
-            if not in_relationship:
-                combined_result.append(assertion_results[i])
-
-        if False in combined_result:
-            return False
-        return True
-
-
-    def check_assertion(self, assertion, term):
-        # check the input types
-        assertion_result = True
-        if assertion.assertion_operator == 'inputs':
-            for i in range(0, len(term.set_of_terms)):
-                elem = term.set_of_terms[i]
-                if isinstance(elem, PR.Function) and not assertion.assertion_values[i].startswith('func/'):
-                    assertion_result = False
-                elif isinstance(elem, PR.Function) and not elem.arity == int(assertion.assertion_values[i].split('/')[1]):
-                    assertion_result = False
-                elif isinstance(elem, PR.Variable) and not elem.computed_type == assertion.assertion_values[i]:
-                    assertion_result = False
-        elif assertion.assertion_operator == 'bodycontains':
-            if not isinstance(term, PR.Predicate) and not isinstance(term, PR.Method) and not isinstance(term, PR.Function):
-                assertion_result = False
-            else:
-                assertion_result = False
-                for sub_term in term.body:
-                    for assertion_val in assertion.assertion_values:
-                        if assertion_val == 'function' and isinstance(sub_term, PR.Function):
-                            assertion_result = True
-                        elif assertion_val == 'loop' and isinstance(sub_term, PR.Loop):
-                            assertion_result = True
-                        elif assertion_val == 'conditional' and isinstance(sub_term, PR.Conditional):
-                            assertion = True
-                        elif isinstance(sub_term, PR.Function):
-                            if(self.check_assertion(assertion, sub_term)):
-                                assertion_result = True
-        elif assertion.assertion_operator == 'returns':
-            if not isinstance(term, PR.Method):
-                assertion_result = False
-            elif term.return_type not in assertion.assertion_values:
-                assertion_result = False
-        return assertion_result
 
 class QueryShell:
 
-    def __init__(self, program_path):
+    def __init__(self, program_path, num_workers=1, use_snapshots=True, result_cache_bytes=64 * 1024 * 1024, vectorized=False, mapped=False):
 
         self.program_path = program_path
+        self.num_workers = num_workers
+        self.use_snapshots = use_snapshots
+        self.vectorized = vectorized
+        self.mapped = mapped
+        self.watcher = None
+        self.watch_enabled = False
         if os.path.isfile(program_path):
             self.program_type = 'Single-File'
         else:
             self.program_type = 'Module'
         self.program_representation = None
-        self.load_new_program(program_path, initial_load=True)
-        self.engine = QueryEngine(self.program_representation)
+        self.query_metrics = METRICS.QueryMetrics()
+        query_index = self.load_new_program(program_path, initial_load=True)
+        self.engine = QueryEngine(self.program_representation, result_cache_bytes=result_cache_bytes, vectorized=vectorized, query_index=query_index)
 
 
 
@@ -241,9 +521,13 @@ class QueryShell:
         print('\nBasic Queries:')
         print(' > exit.\n    Exits the shell.')
         print(' > help.\n    Displays this help message.')
-        print(' > shell info.\n    Displays current shell information.')
+        print(' > shell info.\n    Displays current shell information and performance metrics.')
+        print(' > shell info json.\n    Prints the performance metrics as JSON.')
+        print(' > shell info prometheus.\n    Prints the performance metrics in the Prometheus text format.')
         print(' > program info.\n    Prints information on all elements collected from program.')
         print(' > load program PATH.\n    Loads a new program with the specified path.')
+        print(' > refresh program.\n    Reparses only the files of the loaded program that changed, were added or were deleted.')
+        print(' > watch program.\n    Toggles watch mode, in which changed files are reparsed before each query.')
         print(' > describe FUNCTION/ARITY\n    Prints all information about a function or predicate.\n')
 
 
@@ -251,10 +535,15 @@ class QueryShell:
         help = "\nThe format that queries entered into the query shell take is as follows:\n"
         help = help + "* Each query begins with the find keyword.\n"
         help = help + "* This is then followed by a search type, typically function or predicate with an optional arity marker.\n"
-        help = help + "* Then, optionally, assertions can be added by appending the where keyword followed by assertions of the following types.\n\nEach assertion starts with a keyword and colon, followed by certain search terms. Assertions can be glued together using or and and keywords.\n\n"
+        help = help + "* Then, optionally, assertions can be added by appending the where keyword followed by assertions of the following types.\n\nEach assertion starts with a keyword and colon, followed by certain search terms. Assertions can be glued together using or and and keywords, and binds tighter than or and parentheses can be used to group assertions.\n\n"
         help = help + "\t1) inputs:INPUT_1_TYPE,INPUT_2_TYPE...\n"
         help = help + "\t2) bodycontains:SEARCHTYPE (SEARCHTYPE: function, loop, conditional)\n"
-        help = help + "\t3) returns:RETURN_TYPE\n\n"
+        help = help + "\t3) returns:RETURN_TYPE\n"
+        help = help + "\t4) calls:NAME/ARITY,... (matches callers of any of the functions or predicates, the arity is optional)\n"
+        help = help + "\t5) calledby:NAME/ARITY,... (matches functions or predicates called by any of them)\n"
+        help = help + "\t6) reaches:NAME/ARITY,... or reaches:SEARCHTYPE (matches callers through any chain of calls, or bodies that contain or call into SEARCHTYPE)\n"
+        help = help + "\t7) name:NAME,... (NAME may be a glob such as search_* or a regular expression between slashes such as /(get|set)_.*/)\n\n"
+        help = help + "* Optionally, limit N returns at most N matches and offset N skips the first N matches.\n"
         help = help + "* All queries end with a period.\n"
 
         help = help + "Below are some examples of valid queries on an input program:\n\n"
@@ -263,31 +552,162 @@ class QueryShell:
         help = help + "SCB Query > find predicate.\n"
         help = help + "SCB Query > find predicate where bodycontains:function and inputs:function/3,var.\n"
         help = help + "SCB Query > find function where bodycontains:loop and returns:int*.\n"
+        help = help + "SCB Query > find function where (returns:void or returns:int) and bodycontains:loop.\n"
+        help = help + "SCB Query > find predicate/2 where inputs:atom,atom limit 20 offset 40.\n"
+        help = help + "SCB Query > find function where calls:malloc/1 or calledby:main.\n"
+        help = help + "SCB Query > find function where reaches:free/1 or reaches:loop.\n"
+        help = help + "SCB Query > find function where name:search_* and returns:int*.\n"
 
         print(help)
 
     def print_shell_info(self):
-        print('TODO')
+        result_cache = self.engine.result_cache
+        print('\nSCB Query Shell {}'.format(code_browsing.__version__))
+        print('Program: {} {} Program - {}'.format(self.representation_language, self.program_type, self.program_path))
+        print('Representation generation: {}'.format(self.program_representation.generation))
+        print('Watch mode: {}'.format('enabled' if self.watch_enabled else 'disabled'))
+        if isinstance(self.program_representation, MAPPED_INDEX.MappedRepresentation):
+            print('Query index: memory-mapped posting lists ({:.1f} KiB mapped)'.format(self.program_representation.mapped_size / 1024))
+        else:
+            print('Query index: {}'.format('vectorized' if self.engine.vectorized else 'posting lists'))
+        print('Compiled queries cached: {}/{}'.format(len(self.engine.query_cache.compiled_queries), self.engine.query_cache.max_size))
+        print('Query results cached: {} using {:.1f}/{:.1f} KiB'.format(len(result_cache.entries), result_cache.current_bytes / 1024, result_cache.max_bytes / 1024))
+        print('Result cache hits: {}, misses: {}, evictions: {}, invalidations: {}'.format(result_cache.hits, result_cache.misses,
+                                                                                         result_cache.evictions, result_cache.invalidations))
+        METRICS.print_metrics(METRICS.collect_metrics(self))
+
+    def print_shell_metrics(self, output_format):
+        metrics = METRICS.collect_metrics(self)
+        if output_format == 'json':
+            print(json.dumps(metrics, indent=2))
+        else:
+            sys.stdout.write(METRICS.format_prometheus(metrics))
 
     def print_loaded_program_info(self):
         self.program_representation.print_representation()
 
+    def read_program(self, path):
+        # Loads the representation from a snapshot or parses it, without touching the loaded program.
+        # Returns the representation, the parser class and the query index to use for it, or None.
+        parser = PARSER.create_parser(path, num_workers=self.num_workers)
+        program_representation = None
+        query_index = None
+        if self.use_snapshots or self.mapped:
+            source_signature = SNAPSHOT.get_source_signature(parser.get_program_files(path))
+        if self.mapped:
+            # Mapped files are written even without snapshots, the mapping is what worker processes share
+            program_representation = MAPPED_INDEX.load_mapped_representation(path, source_signature)
+            if program_representation is not None:
+                return program_representation, type(parser), None
+        if self.use_snapshots:
+            program_representation, query_index = SNAPSHOT.load_snapshot(path, source_signature, allow_stale=True)
+            if program_representation is not None and type(program_representation) is not type(parser.program_representation):
+                program_representation = None
+                query_index = None
+            if program_representation is not None and SNAPSHOT.get_representation_signature(program_representation) != source_signature:
+                # Only the files changed since the snapshot was saved are reparsed
+                changed_files, added_files, deleted_files = PROGRAM_WATCHER.ProgramWatcher(path, type(parser)).refresh(program_representation)
+                print('Updated snapshot: {} changed, {} added, {} deleted file(s).'.format(len(changed_files), len(added_files), len(deleted_files)))
+                if query_index is None or not query_index.apply_changes():
+                    query_index = self.build_snapshot_index(program_representation)
+                SNAPSHOT.save_snapshot(path, SNAPSHOT.get_representation_signature(program_representation), program_representation, query_index=query_index)
+        if program_representation is None:
+            start_time = time.perf_counter()
+            parser.parse_program(path)
+            elapsed = time.perf_counter() - start_time
+            program_representation = parser.program_representation
+            num_files = len(program_representation.source_files)
+            print('Parsed {} file(s) in {:.2f} s ({:.1f} files/s).'.format(num_files, elapsed, num_files / max(elapsed, 1e-9)))
+            print('Computed body summaries for {} symbol(s) in {:.1f} ms.'.format(program_representation.body_summary_count,
+                                                                         program_representation.body_summary_time * 1000))
+            if self.use_snapshots:
+                query_index = self.build_snapshot_index(program_representation)
+                SNAPSHOT.save_snapshot(path, SNAPSHOT.get_representation_signature(program_representation), program_representation, query_index=query_index)
+        if self.mapped:
+            representation_signature = SNAPSHOT.get_representation_signature(program_representation)
+            if MAPPED_INDEX.write_mapped_representation(path, representation_signature, program_representation):
+                mapped_representation = MAPPED_INDEX.load_mapped_representation(path, representation_signature)
+                if mapped_representation is not None:
+                    return mapped_representation, type(parser), None
+            print('WARNING - Could not write the mapped representation, using the parsed representation instead.')
+        return program_representation, type(parser), query_index
+
+
+    def build_snapshot_index(self, program_representation):
+        # The posting list index is built here rather than by the engine so it is saved with the
+        # snapshot. Vectorized and mapped engines build their own index.
+        if self.vectorized or self.mapped:
+            return None
+        return QUERY_PLANNER.QueryIndex(program_representation)
+
+
+    def set_program(self, path, program_representation, parser_type, query_index=None, initial_load=False):
+        self.program_representation = program_representation
+        self.watcher = PROGRAM_WATCHER.ProgramWatcher(path, parser_type)
+        if not initial_load:
+            self.engine.set_program_representation(self.program_representation, query_index=query_index)
+        if isinstance(self.program_representation, PR.PrologProgramRepresentation):
+            self.representation_language = 'Prolog'
+        elif isinstance(self.program_representation, PR.PythonProgramRepresentation):
+            self.representation_language = 'Python'
+        elif isinstance(self.program_representation, PR.CProgramRepresentation):
+            self.representation_language = 'C'
+        elif isinstance(self.program_representation, MAPPED_INDEX.MappedRepresentation):
+            self.representation_language = self.program_representation.language
+
+
     def load_new_program(self, path, initial_load=False):
         if not os.path.exists(path):
             print('ERROR - Path {} does not exist!'.format(path))
             exit()
         else:
-            parser = PARSER.create_parser(path)
-            parser.parse_program(path)
-            self.program_representation = parser.program_representation
-            if not initial_load:
-                self.engine.program_representation = self.program_representation
-            if isinstance(self.program_representation, PR.PrologProgramRepresentation):
-                self.representation_language = 'Prolog'
-            elif isinstance(self.program_representation, PR.PythonProgramRepresentation):
-                self.representation_language = 'Python'
-            elif isinstance(self.program_representation, PR.CProgramRepresentation):
-                self.representation_language = 'C'
+            with LOGGER.timed('load_program', path=path):
+                program_representation, parser_type, query_index = self.read_program(path)
+            self.set_program(path, program_representation, parser_type, query_index=query_index, initial_load=initial_load)
+            return query_index
+
+
+    def refresh_program(self, only_if_due=False):
+        if isinstance(self.program_representation, MAPPED_INDEX.MappedRepresentation):
+            self.refresh_mapped_program(only_if_due=only_if_due)
+            return
+        start_time = time.perf_counter()
+        if only_if_due:
+            changed_files, added_files, deleted_files = self.watcher.refresh_if_due(self.program_representation)
+        else:
+            changed_files, added_files, deleted_files = self.watcher.refresh(self.program_representation)
+        num_updated = len(changed_files) + len(added_files) + len(deleted_files)
+        if num_updated > 0:
+            LOGGER.trace('refresh_program', changed=len(changed_files), added=len(added_files), deleted=len(deleted_files),
+                         elapsed_ms=(time.perf_counter() - start_time) * 1000)
+            print('Reloaded program: {} changed, {} added, {} deleted file(s).'.format(len(changed_files), len(added_files), len(deleted_files)))
+            if self.use_snapshots:
+                SNAPSHOT.save_snapshot(self.watcher.program_path, SNAPSHOT.get_representation_signature(self.program_representation), self.program_representation,
+                                       query_index=self.engine.get_snapshot_index())
+        elif not only_if_due:
+            print('Program is up to date.')
+
+
+    def refresh_mapped_program(self, only_if_due=False):
+        # A mapped representation is read-only, so any change remaps a freshly written file
+        if only_if_due and not self.watcher.is_poll_due():
+            return
+        changed_files, added_files, deleted_files = self.watcher.poll(self.program_representation)
+        num_updated = len(changed_files) + len(added_files) + len(deleted_files)
+        if num_updated > 0:
+            program_representation, parser_type, query_index = self.read_program(self.watcher.program_path)
+            self.set_program(self.watcher.program_path, program_representation, parser_type, query_index=query_index)
+            print('Reloaded program: {} changed, {} added, {} deleted file(s).'.format(len(changed_files), len(added_files), len(deleted_files)))
+        elif not only_if_due:
+            print('Program is up to date.')
+
+
+    def toggle_watch_mode(self):
+        self.watch_enabled = not self.watch_enabled
+        if self.watch_enabled:
+            print('Watch mode enabled. Changed files will be reparsed before each query.')
+        else:
+            print('Watch mode disabled.')
 
 
     def show_pred_fun_info(self, query):
@@ -298,16 +718,62 @@ class QueryShell:
         else:
             pred_name = query.split(' ')[1][:-1]
         counter = 0
-        if isinstance(self.program_representation, PR.PrologProgramRepresentation):
-            symbols = self.program_representation.predicates
-        elif isinstance(self.program_representation, PR.CProgramRepresentation):
-            symbols = self.program_representation.c_functions
-        for pred in symbols:
-            if pred.name == pred_name and (pred.arity == pred_arity or pred_arity == -1):
-                pred.print_term()
-                counter = counter + 1
+        for pred in self.program_representation.lookup_symbols(pred_name, pred_arity):
+            pred.print_term()
+            counter = counter + 1
         print('\n{} Matching result(s) found.'.format(counter))
 
+    def run_batch_query(self, query):
+        start_time = time.perf_counter()
+        try:
+            scb_query = self.engine.convert_query(query)
+        except SCBErrors.SCBInvalidQueryError:
+            self.query_metrics.record_error()
+            return {'query': query, 'error': 'The entered query was not parsable!'}
+        parsed_time = time.perf_counter()
+        scb_result = self.engine.process_query(scb_query, verbose=False)
+        searched_time = time.perf_counter()
+        self.query_metrics.record_query(query, searched_time - start_time)
+        batch_result = scb_result.to_dict()
+        batch_result['parse_ms'] = (parsed_time - start_time) * 1000
+        batch_result['search_ms'] = (searched_time - parsed_time) * 1000
+        return batch_result
+
+
+    def run_batch(self, input_fp, output_fp=sys.stdout):
+        """Function that runs queries without the interactive shell
+
+        Each non empty line of input_fp not starting with # is a query, the closing period is optional.
+        One JSON object per query is written to output_fp as soon as the query finishes.
+
+        Parameters
+        ----------
+        input_fp : file
+            open file to read queries from
+        output_fp : file
+            open file the JSON Lines results are written to
+
+        Returns
+        -------
+        int
+            number of queries run
+        """
+
+        num_queries = 0
+        start_time = time.perf_counter()
+        for line in input_fp:
+            query = line.strip()
+            if len(query) == 0 or query.startswith('#'):
+                continue
+            if not query.endswith('.'):
+                query = query + '.'
+            output_fp.write(json.dumps(self.run_batch_query(query)) + '\n')
+            num_queries = num_queries + 1
+        elapsed = time.perf_counter() - start_time
+        sys.stderr.write('Ran {} queries in {:.3f} s ({:.1f} queries/s).\n'.format(num_queries, elapsed, num_queries / max(elapsed, 1e-9)))
+        return num_queries
+
+
     def exit_shell(self):
         print('Exiting...')
 
@@ -321,25 +787,36 @@ class QueryShell:
                 while not query.endswith('.'):
                     query = query + ' ' + input('> ')
                 try:
+                    if self.watch_enabled and query != 'exit.':
+                        self.refresh_program(only_if_due=True)
                     if query == 'exit.':
                         pass
                     elif query == 'help.':
                         self.print_query_shell_help()
                     elif query == 'shell info.':
                         self.print_shell_info()
+                    elif query in ['shell info json.', 'shell info prometheus.']:
+                        self.print_shell_metrics(query.split(' ')[2][:-1])
                     elif query == 'program info.':
                         self.print_loaded_program_info()
                     elif query.startswith('load program'):
                         self.load_new_program(query.split(' ')[2][:-1])
+                    elif query == 'refresh program.':
+                        self.refresh_program()
+                    elif query == 'watch program.':
+                        self.toggle_watch_mode()
                     elif query.startswith('describe'):
                         self.show_pred_fun_info(query)
                     elif query == 'help scb.':
                         self.show_scb_help()
                     else:
+                        start_time = time.perf_counter()
                         scb_query = self.engine.convert_query(query)
-                        scb_result = self.engine.process_query(scb_query)
+                        scb_result = self.engine.process_query(scb_query, lazy=True)
                         scb_result.print_result()
+                        self.query_metrics.record_query(query, time.perf_counter() - start_time)
                 except SCBErrors.SCBInvalidQueryError:
+                    self.query_metrics.record_error()
                     print('Syntax Error - The entered query was not parsable!')
             self.exit_shell()
         except KeyboardInterrupt:
@@ -0,0 +1,400 @@
+"""
+Secondary indexes and query planning for find queries.
+
+When a program is loaded, every function or predicate clause is numbered in iteration order and
+posting lists of these numbers are built by arity, return type, per-position input type and body
+contents, and a call graph is built over the same numbers. When files are refreshed, the symbols of
+the changed functions or predicates are removed and indexed again under numbers past all others.
+
+A query is turned into a tree of intersections and unions over posting lists. Each intersection
+enumerates its most selective child and only tests the others for membership, so a query touches
+its candidates rather than the whole program.
+"""
+
+import array
+import bisect
+import heapq
+import itertools
+import code_browsing.program_representation as PR
+import code_browsing.call_graph as CALL_GRAPH
+import code_browsing.name_pattern as NAME_PATTERN
+
+# Matches any queried input type, used for argument terms that are neither variables nor functions
+WILDCARD_TYPE = '*'
+
+
+def get_input_type_key(term):
+    # Queries are lowercased when they are normalized, so type names are indexed lowercased too
+    if isinstance(term, PR.Function):
+        return 'func/{}'.format(term.arity)
+    elif isinstance(term, PR.Variable):
+        if term.computed_type is None:
+            return None
+        return term.computed_type.lower()
+    return WILDCARD_TYPE
+
+
+def get_return_type_key(term):
+    if term.return_type is None:
+        return None
+    return term.return_type.lower()
+
+
+def normalize_input_type(input_type):
+    # func/N is compared on the arity as a number, so func/02 matches a function of arity 2
+    if input_type.startswith('func/'):
+        try:
+            return 'func/{}'.format(int(input_type.split('/')[1]))
+        except ValueError:
+            pass
+    return input_type
+
+
+# Body summary flag of each bodycontains search type
+BODY_CONTAINS_FLAGS = {
+    'function': PR.BODY_CONTAINS_CALL,
+    'loop': PR.BODY_CONTAINS_LOOP,
+    'conditional': PR.BODY_CONTAINS_CONDITIONAL,
+}
+
+# Operators whose matches depend on the bodies of symbols of other arities than their own
+CROSS_ARITY_OPERATORS = frozenset(['calledby', 'reaches'])
+
+
+class PostingNode:
+
+    def __init__(self, postings):
+        self.postings = postings
+
+    def estimate(self):
+        return len(self.postings)
+
+    def contains(self, ordinal):
+        position = bisect.bisect_left(self.postings, ordinal)
+        return position < len(self.postings) and self.postings[position] == ordinal
+
+    def iter_ordinals(self):
+        return iter(self.postings)
+
+
+class FlagNode:
+    # Symbols whose body summary has any of the flags in mask set. Membership is a single array lookup,
+    # enumeration merges the posting lists of the flags.
+
+    def __init__(self, body_flags, mask, flag_postings):
+        self.body_flags = body_flags
+        self.mask = mask
+        self.flag_postings = flag_postings
+
+    def estimate(self):
+        return sum([len(postings) for postings in self.flag_postings])
+
+    def contains(self, ordinal):
+        return (self.body_flags[ordinal] & self.mask) != 0
+
+    def iter_ordinals(self):
+        last_ordinal = None
+        for ordinal in heapq.merge(*self.flag_postings):
+            if ordinal != last_ordinal:
+                last_ordinal = ordinal
+                yield ordinal
+
+
+class AllNode:
+
+    def __init__(self, num_symbols):
+        self.num_symbols = num_symbols
+
+    def estimate(self):
+        return self.num_symbols
+
+    def contains(self, ordinal):
+        return True
+
+    def iter_ordinals(self):
+        return iter(range(0, self.num_symbols))
+
+
+class AndNode:
+
+    def __init__(self, children):
+        self.children = children
+
+    def estimate(self):
+        return min([child.estimate() for child in self.children])
+
+    def contains(self, ordinal):
+        for child in self.children:
+            if not child.contains(ordinal):
+                return False
+        return True
+
+    def iter_ordinals(self):
+        children = sorted(self.children, key=lambda child: child.estimate())
+        driver = children[0]
+        filters = children[1:]
+        for ordinal in driver.iter_ordinals():
+            matched = True
+            for child in filters:
+                if not child.contains(ordinal):
+                    matched = False
+                    break
+            if matched:
+                yield ordinal
+
+
+class OrNode:
+
+    def __init__(self, children):
+        self.children = children
+
+    def estimate(self):
+        return sum([child.estimate() for child in self.children])
+
+    def contains(self, ordinal):
+        for child in self.children:
+            if child.contains(ordinal):
+                return True
+        return False
+
+    def iter_ordinals(self):
+        last_ordinal = None
+        for ordinal in heapq.merge(*[child.iter_ordinals() for child in self.children]):
+            if ordinal != last_ordinal:
+                last_ordinal = ordinal
+                yield ordinal
+
+
+class QueryIndex:
+
+    def __init__(self, program_representation):
+        self.program_representation = program_representation
+        # Generation of the representation when the index was built, an index saved in a snapshot is
+        # only used if it still matches
+        self.generation = program_representation.generation
+        self.num_symbols = 0
+        # Prolog clauses are numbered group by group, group_bases holds the first number of each group
+        self.groups = []
+        self.group_bases = []
+        self.arity_postings = {}
+        self.return_postings = {}
+        # (arity, position, input type) -> clauses with that input type at that position
+        self.input_postings = {}
+        # Body summary flags of every symbol, and flag -> symbols with that flag set
+        self.body_flags = array.array('B')
+        self.body_postings = {}
+        # (name, arity) -> numbers of the symbols of that key, and the C functions in number order
+        self.key_ordinals = {}
+        self.c_functions = []
+        if isinstance(program_representation, PR.PrologProgramRepresentation):
+            self.index_prolog_representation()
+        elif isinstance(program_representation, PR.CProgramRepresentation):
+            for func in program_representation.c_functions:
+                self.index_c_function(func)
+        self.call_graph = CALL_GRAPH.build_call_graph(program_representation)
+
+
+    def add_posting(self, postings, key, ordinal):
+        if key not in postings:
+            postings[key] = array.array('I')
+        postings[key].append(ordinal)
+
+
+    def index_symbol(self, term, ordinal):
+        self.add_posting(self.arity_postings, term.arity, ordinal)
+        for i in range(0, term.arity):
+            self.add_posting(self.input_postings, (term.arity, i, get_input_type_key(term.set_of_terms[i])), ordinal)
+        self.body_flags.append(term.body_flags)
+        for flag in BODY_CONTAINS_FLAGS.values():
+            if term.body_flags & flag:
+                self.add_posting(self.body_postings, flag, ordinal)
+
+
+    def index_c_function(self, func):
+        self.index_symbol(func, self.num_symbols)
+        self.add_posting(self.return_postings, get_return_type_key(func), self.num_symbols)
+        self.add_posting(self.key_ordinals, (func.name, func.arity), self.num_symbols)
+        self.c_functions.append(func)
+        self.num_symbols = self.num_symbols + 1
+
+
+    def index_prolog_representation(self):
+        for key, group in self.program_representation.predicate_index.items():
+            self.index_prolog_group(key, group)
+
+
+    def index_prolog_group(self, key, group):
+        self.groups.append((key, group))
+        self.group_bases.append(self.num_symbols)
+        self.key_ordinals[key] = range(self.num_symbols, self.num_symbols + len(group))
+        if not isinstance(group, PR.FactTable):
+            for pred in group:
+                self.index_symbol(pred, self.num_symbols)
+                self.num_symbols = self.num_symbols + 1
+            return
+        # Fact rows are indexed straight from their columns, facts have no body
+        atom_type_codes = self.program_representation.atom_type_codes
+        self.body_flags.extend(bytes(len(group)))
+        for row in range(0, len(group)):
+            self.add_posting(self.arity_postings, group.arity, self.num_symbols + row)
+        for i in range(0, group.arity):
+            position_types = self.program_representation.get_fact_type_names(key, i)
+            column = group.columns[i]
+            for row in range(0, len(group)):
+                self.add_posting(self.input_postings, (group.arity, i, position_types[atom_type_codes[column[row]]]), self.num_symbols + row)
+        self.num_symbols = self.num_symbols + len(group)
+
+
+    def apply_changes(self):
+        """Function that patches the index for the symbols changed since it was built
+
+        The symbols of every changed (name, arity) key are removed and indexed again under new numbers
+        past all others. Apart from one pass over the change generation of every key to find the
+        changed ones, the time taken is proportional to the changed symbols. Removed numbers stay in
+        the posting lists and are skipped, and once they would make up half of the index it is rebuilt
+        instead.
+
+        Returns
+        -------
+        bool
+            True if the index was patched, False if it must be rebuilt
+        """
+
+        changed_keys = sorted(self.program_representation.get_changed_keys(self.generation))
+        num_changed = sum([len(self.key_ordinals.get(key, ())) for key in changed_keys])
+        if 2 * (self.call_graph.num_removed + num_changed) > self.num_symbols:
+            return False
+        removed_ordinals = []
+        for key in changed_keys:
+            removed_ordinals.extend(self.key_ordinals.pop(key, ()))
+        for ordinal in removed_ordinals:
+            self.body_flags[ordinal] = 0
+        self.call_graph.remove_symbols(removed_ordinals)
+        if isinstance(self.program_representation, PR.PrologProgramRepresentation):
+            for key in changed_keys:
+                if key in self.program_representation.predicate_index:
+                    self.index_prolog_group(key, self.program_representation.predicate_index[key])
+        else:
+            for key in changed_keys:
+                for func in self.program_representation.c_function_index.get(key, []):
+                    self.index_c_function(func)
+        self.call_graph.add_symbols(CALL_GRAPH.iter_symbol_calls(self.program_representation, changed_keys))
+        self.generation = self.program_representation.generation
+        return True
+
+
+    def count_symbols(self):
+        return self.num_symbols - self.call_graph.num_removed
+
+
+    def get_symbol(self, ordinal):
+        if isinstance(self.program_representation, PR.CProgramRepresentation):
+            return self.c_functions[ordinal]
+        group_number = bisect.bisect_right(self.group_bases, ordinal) - 1
+        key, group = self.groups[group_number]
+        row = ordinal - self.group_bases[group_number]
+        if isinstance(group, PR.FactTable):
+            return self.program_representation.materialize_fact(key, group, row)
+        return group[row]
+
+
+    def get_posting_node(self, postings, key):
+        return PostingNode(postings.get(key, array.array('I')))
+
+
+    def plan_inputs(self, input_types, search_arity):
+        # A symbol of arity N matches if each of its N arguments has the queried type for its position.
+        # Input types past a symbol's arity are ignored, symbols with more arguments never match.
+        arities = range(0, len(input_types) + 1)
+        if search_arity != -1:
+            arities = [arity for arity in arities if arity == search_arity]
+        arity_nodes = []
+        for arity in arities:
+            if arity == 0:
+                arity_nodes.append(self.get_posting_node(self.arity_postings, 0))
+                continue
+            position_nodes = []
+            for i in range(0, arity):
+                position_nodes.append(OrNode([self.get_posting_node(self.input_postings, (arity, i, input_types[i])),
+                                              self.get_posting_node(self.input_postings, (arity, i, WILDCARD_TYPE))]))
+            arity_nodes.append(AndNode(position_nodes))
+        return OrNode(arity_nodes)
+
+
+    def plan_assertion(self, assertion, search_arity):
+        if assertion.assertion_operator == 'inputs':
+            return self.plan_inputs(assertion.assertion_values, search_arity)
+        elif assertion.assertion_operator == 'bodycontains':
+            mask = 0
+            for value in assertion.assertion_values:
+                mask = mask | BODY_CONTAINS_FLAGS.get(value, 0)
+            flag_postings = [self.body_postings[flag] for flag in BODY_CONTAINS_FLAGS.values() if mask & flag and flag in self.body_postings]
+            return FlagNode(self.body_flags, mask, flag_postings)
+        elif assertion.assertion_operator == 'returns':
+            return OrNode([self.get_posting_node(self.return_postings, value) for value in assertion.assertion_values])
+        elif assertion.assertion_operator in ['calls', 'calledby', 'reaches']:
+            return OrNode([PostingNode(postings) for postings in self.iter_call_postings(assertion)])
+        elif assertion.assertion_operator == 'name':
+            return OrNode([PostingNode(postings) for postings in self.iter_name_postings(assertion)])
+        return self.plan_all()
+
+
+    def iter_name_postings(self, assertion):
+        # Sorted symbol numbers of every function or predicate whose name matches. Only the call graph
+        # nodes sharing the literal prefix of a pattern are tested, exact names are found directly.
+        for value in assertion.assertion_values:
+            pattern = NAME_PATTERN.NamePattern(value)
+            if pattern.exact:
+                nodes = self.call_graph.find_nodes(value)
+            else:
+                nodes = self.call_graph.find_prefix_nodes(pattern.prefix)
+            for node in nodes:
+                definitions = self.call_graph.get_definitions(node)
+                if len(definitions) > 0 and pattern.matches(self.call_graph.get_node_name(node)):
+                    yield definitions
+
+
+    def iter_call_postings(self, assertion):
+        # Sorted symbol numbers calling each queried function or predicate for calls:, called by it for
+        # calledby:, or calling it through any chain of calls for reaches:, read from the call graph.
+        # reaches:loop and the other body contents match symbols whose own body or the body of any
+        # function or predicate they reach contains them.
+        for value in assertion.assertion_values:
+            if assertion.assertion_operator == 'reaches' and value in BODY_CONTAINS_FLAGS:
+                yield self.call_graph.get_flag_reaching_symbols(self.body_flags, BODY_CONTAINS_FLAGS[value])
+                continue
+            name, arity = CALL_GRAPH.parse_symbol_key(value)
+            for node in self.call_graph.find_nodes(name, arity):
+                if assertion.assertion_operator == 'calls':
+                    yield self.call_graph.get_callers(node)
+                elif assertion.assertion_operator == 'reaches':
+                    yield self.call_graph.get_reaching_symbols(node)
+                else:
+                    yield self.call_graph.get_callees(node)
+
+
+    def plan_arity(self, search_arity):
+        return self.get_posting_node(self.arity_postings, search_arity)
+
+
+    def plan_all(self):
+        return AllNode(self.num_symbols)
+
+
+    def plan_and(self, nodes):
+        return AndNode(nodes)
+
+
+    def plan_or(self, nodes):
+        return OrNode(nodes)
+
+
+    def iter_symbols(self, scb_query, start=0, stop=None):
+        # The compiled query builds its posting list tree over this index. Symbols are looked up as the
+        # tree yields their numbers, so skipped matches are never looked up and a caller that stops
+        # early skips the rest of the plan.
+        ordinals = scb_query.evaluator(self).iter_ordinals()
+        if self.call_graph.num_removed > 0:
+            ordinals = itertools.filterfalse(self.call_graph.removed_symbols.__getitem__, ordinals)
+        for ordinal in itertools.islice(ordinals, start, stop):
+            yield self.get_symbol(ordinal)
@@ -0,0 +1,203 @@
+"""
+Asyncio query server sharing one loaded program between many clients.
+
+Clients connect over TCP or a Unix socket and send one JSON object per line, such as
+{"id": 1, "query": "find predicate/2 where inputs:atom,atom."}. Each request is answered with one
+JSON object per line, in request order, echoing the request id. Supported queries are find queries,
+describe NAME/ARITY., shell info., which returns the server's performance metrics, and reload program.
+
+Clients may pipeline requests without waiting for responses. Each connection buffers a bounded
+number of pending requests, once that is reached the server stops reading from the connection until
+its responses have been written, so a slow client cannot grow the server's memory.
+
+Queries run one at a time in a worker thread against a single QueryEngine, so the event loop keeps
+reading requests and writing responses while a query runs, but queries from all clients are
+serialized. A reload parses the program in a worker thread while queries keep being answered from
+the current representation, and the new representation is swapped in between two queries while
+holding the lock queries run under, so no query is dropped or sees a partial program. A request that fails is answered with an error and
+the connection stays open.
+"""
+
+import sys
+import json
+import time
+import signal
+import asyncio
+import code_browsing.errors as SCBErrors
+import code_browsing.metrics as METRICS
+
+# Longest accepted request line, in bytes
+MAX_REQUEST_BYTES = 1024 * 1024
+
+
+class QueryServer:
+
+    def __init__(self, query_shell, max_pending_requests=32):
+        self.query_shell = query_shell
+        self.max_pending_requests = max_pending_requests
+        self.reload_lock = None
+        self.query_lock = None
+        self.num_connections = 0
+        self.num_requests = 0
+
+
+    def describe_symbols(self, query):
+        # describe NAME/ARITY. or describe NAME.
+        symbol = query[:-1].split(' ', 1)[1].strip() if ' ' in query else ''
+        if len(symbol) == 0:
+            raise SCBErrors.SCBInvalidQueryError
+        arity = -1
+        if '/' in symbol:
+            try:
+                arity = int(symbol.split('/')[1])
+            except ValueError:
+                raise SCBErrors.SCBInvalidQueryError
+            symbol = symbol.split('/')[0]
+        matches = [term.to_dict() for term in self.query_shell.program_representation.lookup_symbols(symbol, arity)]
+        return {'query': query, 'count': len(matches), 'matches': matches}
+
+
+    async def reload_program(self):
+        # Reloads are serialized, queries keep running against the old representation until the swap
+        async with self.reload_lock:
+            start_time = time.perf_counter()
+            program_path = self.query_shell.program_path
+            loop = asyncio.get_running_loop()
+            program_representation, parser_type, query_index = await loop.run_in_executor(None, self.query_shell.read_program, program_path)
+            # Swapping in the new representation can build its index, so it runs in a worker thread,
+            # under the query lock like any query
+            await self.run_query(self.query_shell.set_program, program_path, program_representation, parser_type, query_index)
+            elapsed = time.perf_counter() - start_time
+            print('Reloaded program {} in {:.3f} s.'.format(program_path, elapsed))
+            return {'reloaded': program_path, 'generation': program_representation.generation, 'reload_ms': elapsed * 1000}
+
+
+    def log_reload_result(self, reload_task):
+        # Reloads started by SIGHUP have no client to answer, so their errors are printed
+        if not reload_task.cancelled() and reload_task.exception() is not None:
+            sys.stderr.write('ERROR: Reload failed: {}\n'.format(reload_task.exception()))
+
+
+    def reload_on_signal(self):
+        reload_task = asyncio.ensure_future(self.reload_program())
+        reload_task.add_done_callback(self.log_reload_result)
+
+
+    async def run_query(self, query_function, *args):
+        # Queries share one engine and its caches, so they run one at a time off the event loop. The
+        # lock is held until the worker thread is done, even if the awaiting request is cancelled, so
+        # a reload never swaps the program under a running query.
+        async with self.query_lock:
+            loop = asyncio.get_running_loop()
+            query_future = loop.run_in_executor(None, query_function, *args)
+            try:
+                return await asyncio.shield(query_future)
+            except asyncio.CancelledError:
+                await asyncio.wait([query_future])
+                raise
+
+
+    def collect_metrics(self, query):
+        return {'query': query, 'metrics': METRICS.collect_metrics(self.query_shell)}
+
+
+    async def handle_request(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+        request_id = None
+        query = None
+        if isinstance(request, dict):
+            request_id = request.get('id')
+            query = request.get('query')
+        if not isinstance(query, str):
+            return {'id': request_id, 'error': 'Requests must be JSON objects with a query field!'}
+        query = query.strip()
+        if not query.endswith('.'):
+            query = query + '.'
+        try:
+            if query == 'reload program.':
+                try:
+                    response = await self.reload_program()
+                except OSError as err:
+                    response = {'query': query, 'error': 'Reload failed: {}'.format(err)}
+            elif query.startswith('describe'):
+                response = await self.run_query(self.describe_symbols, query)
+            elif query == 'shell info.':
+                response = await self.run_query(self.collect_metrics, query)
+            else:
+                response = await self.run_query(self.query_shell.run_batch_query, query)
+        except SCBErrors.SCBInvalidQueryError:
+            response = {'query': query, 'error': 'The entered query was not parsable!'}
+        except Exception as err:
+            # Any other failure is reported to the client instead of closing its connection
+            response = {'query': query, 'error': 'Query failed: {}: {}'.format(type(err).__name__, err)}
+        response['id'] = request_id
+        return response
+
+
+    async def read_requests(self, reader, pending_requests):
+        # Stops reading while the queue is full, which leaves unread data in the socket buffers and
+        # makes the client wait
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                if len(line.strip()) > 0:
+                    await pending_requests.put(line)
+        except (ValueError, ConnectionError):
+            pass
+        await pending_requests.put(None)
+
+
+    async def handle_connection(self, reader, writer):
+        self.num_connections = self.num_connections + 1
+        pending_requests = asyncio.Queue(maxsize=self.max_pending_requests)
+        reader_task = asyncio.ensure_future(self.read_requests(reader, pending_requests))
+        try:
+            while True:
+                line = await pending_requests.get()
+                if line is None:
+                    break
+                response = await self.handle_request(line)
+                self.num_requests = self.num_requests + 1
+                writer.write((json.dumps(response) + '\n').encode())
+                # Waits while the client is not reading its responses
+                await writer.drain()
+                # Lets other connections run between two queries
+                await asyncio.sleep(0)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            reader_task.cancel()
+            self.num_connections = self.num_connections - 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_socket_path=None):
+        self.reload_lock = asyncio.Lock()
+        self.query_lock = asyncio.Lock()
+        if unix_socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket_path, limit=MAX_REQUEST_BYTES)
+            print('Serving queries on unix socket {}'.format(unix_socket_path))
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port, limit=MAX_REQUEST_BYTES)
+            print('Serving queries on {}:{}'.format(host, server.sockets[0].getsockname()[1]))
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, self.reload_on_signal)
+        async with server:
+            await server.serve_forever()
+
+
+    def run(self, host='127.0.0.1', port=8765, unix_socket_path=None):
+        try:
+            asyncio.run(self.serve(host=host, port=port, unix_socket_path=unix_socket_path))
+        except KeyboardInterrupt:
+            print('Shutting down query server...')
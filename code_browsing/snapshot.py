@@ -0,0 +1,205 @@
+"""
+Versioned on-disk snapshots of parsed program representations.
+
+A snapshot stores a full representation along with the path, size and mtime of every source file
+it was parsed from. A snapshot is only loaded as is if all of these still match. Otherwise the
+shell loads it as a stale snapshot and reparses only the files that changed, were added or deleted.
+The query index of the representation, with its posting lists and call graph, is stored along with
+it, so loading an unchanged program does not rebuild the index.
+
+Snapshots are kept in the user's cache directory, one file per program path. Since unpickling a file
+can run arbitrary code, a snapshot is only loaded from a file and directory that belong to the user
+and that no one else can write to.
+"""
+
+import os
+import stat
+import pickle
+import hashlib
+import code_browsing
+
+# Must be bumped whenever the attributes stored on representation or term classes change, or a
+# parser reads the same source into a different representation
+SNAPSHOT_FORMAT_VERSION = 14
+
+# Magic bytes written at the start of every snapshot file
+_SNAPSHOT_MAGIC = b'SCBSNAP\n'
+
+# Directory in which snapshots are stored, under the user's cache directory
+SNAPSHOT_DIRECTORY = 'scb_snapshots'
+
+
+def get_snapshot_directory():
+    """Function that finds the default directory of snapshots
+
+    Returns
+    -------
+    str
+        SNAPSHOT_DIRECTORY under $XDG_CACHE_HOME, or under ~/.cache if it is not set
+    """
+
+    cache_dir = os.environ.get('XDG_CACHE_HOME')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, SNAPSHOT_DIRECTORY)
+
+
+def make_snapshot_directory(snapshot_dir):
+    # Readable by the user only, snapshots can reveal the source they were parsed from
+    os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+
+
+def is_private_path(path):
+    # True if path belongs to the current user and no other user can write to it
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, 'getuid') and path_stat.st_uid != os.getuid():
+        return False
+    return path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH) == 0
+
+
+def get_source_signature(program_files):
+    """Function that computes the snapshot key of a set of source files
+
+    Parameters
+    ----------
+    program_files : list of str
+        absolute paths of all source files of the program
+
+    Returns
+    -------
+    list of tuple
+        (path, size, mtime in ns) for each file, sorted by path
+    """
+
+    source_signature = []
+    for file_path in program_files:
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            continue
+        source_signature.append((file_path, file_stat.st_size, file_stat.st_mtime_ns))
+    return sorted(source_signature)
+
+
+def get_representation_signature(program_representation):
+    """Function that computes the snapshot key from the file stats recorded while parsing
+
+    Parameters
+    ----------
+    program_representation : ProgramRepresentation
+        a parsed representation
+
+    Returns
+    -------
+    list of tuple
+        (path, size, mtime in ns) for each file the representation was parsed from, sorted by path
+    """
+
+    source_signature = []
+    for file_path, file_stat in program_representation.source_files.items():
+        source_signature.append((file_path, file_stat[0], file_stat[1]))
+    return sorted(source_signature)
+
+
+def get_snapshot_path(program_path, snapshot_dir=None):
+    if snapshot_dir is None:
+        snapshot_dir = get_snapshot_directory()
+    program_hash = hashlib.sha1(os.path.abspath(program_path).encode('utf-8')).hexdigest()
+    return os.path.join(snapshot_dir, 'SCB_{}.snapshot'.format(program_hash))
+
+
+def save_snapshot(program_path, source_signature, program_representation, snapshot_dir=None, query_index=None):
+    """Function that writes a representation snapshot to disk
+
+    Parameters
+    ----------
+    program_path : str
+        path to the program file or directory that was parsed
+    source_signature : list of tuple
+        output of get_representation_signature for the parsed representation
+    program_representation : ProgramRepresentation
+        the parsed representation
+    snapshot_dir : str
+        directory to write the snapshot to, get_snapshot_directory() if None
+    query_index : QueryIndex
+        query index of program_representation to store with it, or None
+
+    Returns
+    -------
+    bool
+        True if the snapshot was written, False otherwise
+    """
+
+    if snapshot_dir is None:
+        snapshot_dir = get_snapshot_directory()
+    snapshot_path = get_snapshot_path(program_path, snapshot_dir=snapshot_dir)
+    temp_path = '{}.{}.tmp'.format(snapshot_path, os.getpid())
+    header = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'scb_version': code_browsing.__version__,
+        'program_path': os.path.abspath(program_path),
+        'source_signature': source_signature,
+    }
+    try:
+        make_snapshot_directory(snapshot_dir)
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as snapshot_fp:
+            snapshot_fp.write(_SNAPSHOT_MAGIC)
+            # Header is pickled separately so stale snapshots can be rejected without loading the payload
+            pickle.dump(header, snapshot_fp, protocol=pickle.HIGHEST_PROTOCOL)
+            # The index refers to the representation's terms, so both are pickled together
+            pickle.dump((program_representation, query_index), snapshot_fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, snapshot_path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def load_snapshot(program_path, source_signature, snapshot_dir=None, allow_stale=False):
+    """Function that loads a representation snapshot if it is still valid
+
+    Parameters
+    ----------
+    program_path : str
+        path to the program file or directory
+    source_signature : list of tuple
+        output of get_source_signature for the current state of the sources
+    snapshot_dir : str
+        directory to read the snapshot from, get_snapshot_directory() if None
+    allow_stale : bool
+        if True, a snapshot of the same program taken before some of its files changed is also
+        loaded, the caller compares its signature and reparses the changed files
+
+    Returns
+    -------
+    tuple
+        (ProgramRepresentation, QueryIndex) with the stored representation and its query index, the
+        index is None if none was stored. (None, None) if there is no valid snapshot, or if the
+        snapshot or its directory could have been written by another user.
+    """
+
+    if snapshot_dir is None:
+        snapshot_dir = get_snapshot_directory()
+    snapshot_path = get_snapshot_path(program_path, snapshot_dir=snapshot_dir)
+    if not os.path.exists(snapshot_path):
+        return None, None
+    if not is_private_path(snapshot_dir) or not is_private_path(snapshot_path):
+        return None, None
+    try:
+        with open(snapshot_path, 'rb') as snapshot_fp:
+            if snapshot_fp.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+                return None, None
+            header = pickle.load(snapshot_fp)
+            if header.get('format_version') != SNAPSHOT_FORMAT_VERSION or header.get('scb_version') != code_browsing.__version__:
+                return None, None
+            if header.get('program_path') != os.path.abspath(program_path):
+                return None, None
+            if header.get('source_signature') != source_signature and not allow_stale:
+                return None, None
+            return pickle.load(snapshot_fp)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        return None, None
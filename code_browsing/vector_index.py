@@ -0,0 +1,182 @@
+"""
+Vectorized query evaluation over symbol attribute arrays.
+
+An alternative to the posting list index in query_planner for large programs. Every function or
+predicate clause is one row of a set of NumPy arrays: its arity, the interned id of its return type,
+the interned id of the type at each input position and its body summary flags. Each assertion is
+evaluated as a boolean mask over all rows, and and/or groups combine the masks with & and |.
+Symbols are numbered in the same order as QueryIndex, so both return matches in the same order.
+
+NumPy is an optional dependency, is_available() reports whether this index can be used.
+"""
+
+import code_browsing.program_representation as PR
+import code_browsing.query_planner as QUERY_PLANNER
+import code_browsing.call_graph as CALL_GRAPH
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Type id of an empty input position, and of queried types that no symbol uses
+NO_TYPE_ID = -1
+UNKNOWN_TYPE_ID = -2
+
+
+def is_available():
+    return numpy is not None
+
+
+class MaskNode:
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def estimate(self):
+        return int(numpy.count_nonzero(self.mask))
+
+    def contains(self, ordinal):
+        return bool(self.mask[ordinal])
+
+    def iter_ordinals(self):
+        return iter(numpy.flatnonzero(self.mask).tolist())
+
+
+class VectorQueryIndex(QUERY_PLANNER.QueryIndex):
+
+    def __init__(self, program_representation):
+        self.program_representation = program_representation
+        self.num_symbols = 0
+        self.groups = []
+        self.group_bases = []
+        self.type_ids = {}
+        if isinstance(program_representation, PR.PrologProgramRepresentation):
+            self.index_prolog_representation()
+        elif isinstance(program_representation, PR.CProgramRepresentation):
+            self.c_functions = program_representation.c_functions
+            self.index_terms(self.c_functions)
+        else:
+            self.index_terms([])
+        self.call_graph = CALL_GRAPH.build_call_graph(program_representation)
+
+
+    def apply_changes(self):
+        # The arrays are sized for the symbols at build time, so any change rebuilds the index
+        return False
+
+
+    def get_type_id(self, type_name):
+        if type_name not in self.type_ids:
+            self.type_ids[type_name] = len(self.type_ids)
+        return self.type_ids[type_name]
+
+
+    def allocate_rows(self, num_symbols, max_arity):
+        self.num_symbols = num_symbols
+        self.arities = numpy.zeros(num_symbols, dtype=numpy.int32)
+        self.return_ids = numpy.full(num_symbols, NO_TYPE_ID, dtype=numpy.int32)
+        self.input_ids = numpy.full((num_symbols, max_arity), NO_TYPE_ID, dtype=numpy.int32)
+        self.body_flags = numpy.zeros(num_symbols, dtype=numpy.uint8)
+
+
+    def fill_term_row(self, term, ordinal):
+        self.arities[ordinal] = term.arity
+        for i in range(0, term.arity):
+            self.input_ids[ordinal, i] = self.get_type_id(QUERY_PLANNER.get_input_type_key(term.set_of_terms[i]))
+        self.body_flags[ordinal] = term.body_flags
+
+
+    def index_terms(self, terms):
+        self.allocate_rows(len(terms), max([term.arity for term in terms], default=0))
+        for ordinal, term in enumerate(terms):
+            self.fill_term_row(term, ordinal)
+            if isinstance(term, PR.Method):
+                self.return_ids[ordinal] = self.get_type_id(QUERY_PLANNER.get_return_type_key(term))
+
+
+    def index_prolog_representation(self):
+        num_symbols = 0
+        max_arity = 0
+        for key, group in self.program_representation.predicate_index.items():
+            self.groups.append((key, group))
+            self.group_bases.append(num_symbols)
+            num_symbols = num_symbols + len(group)
+            max_arity = max(max_arity, key[1])
+        self.allocate_rows(num_symbols, max_arity)
+        atom_type_codes = self.program_representation.atom_type_codes
+        atom_type_codes = numpy.frombuffer(atom_type_codes, dtype=numpy.dtype(atom_type_codes.typecode))
+        for (key, group), base in zip(self.groups, self.group_bases):
+            if not isinstance(group, PR.FactTable):
+                for row, pred in enumerate(group):
+                    self.fill_term_row(pred, base + row)
+                continue
+            # Fact columns are translated a whole column at a time: atom id -> type code -> type id
+            rows = slice(base, base + len(group))
+            self.arities[rows] = group.arity
+            for i in range(0, group.arity):
+                position_types = self.program_representation.get_fact_type_names(key, i)
+                position_type_ids = numpy.array([self.get_type_id(type_name) for type_name in position_types], dtype=numpy.int32)
+                column = numpy.frombuffer(group.columns[i], dtype=numpy.dtype(group.columns[i].typecode))
+                self.input_ids[rows, i] = position_type_ids[atom_type_codes[column]]
+
+
+    def plan_inputs(self, input_types, search_arity):
+        # Same rule as QueryIndex.plan_inputs: every argument of the symbol must have the queried type
+        # for its position, or be a wildcard, and symbols with more arguments than queried types never match
+        mask = self.arities <= len(input_types)
+        if search_arity != -1:
+            mask = mask & (self.arities == search_arity)
+        wildcard_id = self.type_ids.get(QUERY_PLANNER.WILDCARD_TYPE, UNKNOWN_TYPE_ID)
+        for i in range(0, min(len(input_types), self.input_ids.shape[1])):
+            column = self.input_ids[:, i]
+            type_id = self.type_ids.get(input_types[i], UNKNOWN_TYPE_ID)
+            mask = mask & ((self.arities <= i) | (column == type_id) | (column == wildcard_id))
+        return MaskNode(mask)
+
+
+    def plan_assertion(self, assertion, search_arity):
+        if assertion.assertion_operator == 'inputs':
+            return self.plan_inputs(assertion.assertion_values, search_arity)
+        elif assertion.assertion_operator == 'bodycontains':
+            flags = 0
+            for value in assertion.assertion_values:
+                flags = flags | QUERY_PLANNER.BODY_CONTAINS_FLAGS.get(value, 0)
+            return MaskNode((self.body_flags & flags) != 0)
+        elif assertion.assertion_operator == 'returns':
+            type_ids = [self.type_ids.get(value, UNKNOWN_TYPE_ID) for value in assertion.assertion_values]
+            return MaskNode(numpy.isin(self.return_ids, type_ids))
+        elif assertion.assertion_operator in ['calls', 'calledby', 'reaches']:
+            return self.get_postings_mask(self.iter_call_postings(assertion))
+        elif assertion.assertion_operator == 'name':
+            return self.get_postings_mask(self.iter_name_postings(assertion))
+        return self.plan_all()
+
+
+    def get_postings_mask(self, postings_lists):
+        mask = numpy.zeros(self.num_symbols, dtype=bool)
+        for postings in postings_lists:
+            mask[numpy.asarray(postings, dtype=numpy.int64)] = True
+        return MaskNode(mask)
+
+
+    def plan_arity(self, search_arity):
+        return MaskNode(self.arities == search_arity)
+
+
+    def plan_all(self):
+        return MaskNode(numpy.ones(self.num_symbols, dtype=bool))
+
+
+    def plan_and(self, nodes):
+        mask = nodes[0].mask
+        for node in nodes[1:]:
+            mask = mask & node.mask
+        return MaskNode(mask)
+
+
+    def plan_or(self, nodes):
+        mask = nodes[0].mask
+        for node in nodes[1:]:
+            mask = mask | node.mask
+        return MaskNode(mask)
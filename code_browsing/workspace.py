@@ -0,0 +1,304 @@
+"""
+Workspaces of several repositories, each loaded as a separate shard.
+
+Every repository path is a shard with its own representation and QueryEngine. Shards are spread over
+a number of worker processes, so each process only holds the representations of its own shards. A
+query is sent to every worker before any answer is read, the workers search their shards in
+parallel, and the per-shard matches are merged in shard order with every match tagged by its shard.
+With no worker processes, all shards are held and searched in the calling process. A worker that
+fails to load its shards or exits is reported, and its shards are dropped from the workspace.
+"""
+
+import os
+import sys
+import atexit
+import multiprocessing
+import code_browsing.errors as SCBErrors
+import code_browsing.query_engine as QUERY_ENGINE
+
+
+def get_shard_names(repository_paths):
+    # Shards are named after their repository directory, repeated names get a numeric suffix
+    shard_names = []
+    for repository_path in repository_paths:
+        base_name = os.path.basename(os.path.normpath(repository_path))
+        shard_name = base_name
+        suffix = 2
+        while shard_name in shard_names:
+            shard_name = '{}-{}'.format(base_name, suffix)
+            suffix = suffix + 1
+        shard_names.append(shard_name)
+    return shard_names
+
+
+class WorkspaceQueryResult:
+
+    def __init__(self, original_query, tagged_matches, shard_counts):
+        # tagged_matches is a list of (shard name, term), shard_counts maps shard names to match counts
+        self.original_query = original_query
+        self.tagged_matches = tagged_matches
+        self.shard_counts = shard_counts
+
+    def print_result(self, fp=sys.stdout):
+        fp.write('\nQuery: {}\n\n'.format(self.original_query))
+        for shard_name, term in self.tagged_matches:
+            fp.write(' > [{}] '.format(shard_name))
+            term.print_term(fp, verbosity='low')
+        fp.write('\n{} Matching result(s) found in {} shard(s).\n'.format(len(self.tagged_matches), len(self.shard_counts)))
+
+    def to_dict(self):
+        matches = []
+        for shard_name, term in self.tagged_matches:
+            match = term.to_dict()
+            match['shard'] = shard_name
+            matches.append(match)
+        return {'query': self.original_query, 'count': len(matches), 'shard_counts': self.shard_counts, 'matches': matches}
+
+
+class ShardGroup:
+    # The shards held by one process, each loaded into its own QueryShell
+
+    def __init__(self, repository_paths, shard_names, num_parse_workers=1, use_snapshots=True, result_cache_bytes=64 * 1024 * 1024, mapped=False):
+        self.shards = []
+        for repository_path, shard_name in zip(repository_paths, shard_names):
+            query_shell = QUERY_ENGINE.QueryShell(repository_path, num_workers=num_parse_workers, use_snapshots=use_snapshots,
+                                                  result_cache_bytes=result_cache_bytes, mapped=mapped)
+            self.shards.append((shard_name, query_shell))
+
+
+    def find_matches(self, query):
+        # Each shard returns up to offset + limit matches from its start, the merged list is paged
+        # once all shards have answered
+        shard_matches = {}
+        offset = 0
+        limit = None
+        for shard_name, query_shell in self.shards:
+            scb_query = query_shell.engine.convert_query(query)
+            offset = scb_query.offset
+            limit = scb_query.limit
+            if limit is not None:
+                scb_query.limit = offset + limit
+            scb_query.offset = 0
+            shard_matches[shard_name] = list(query_shell.engine.iter_query(scb_query))
+        return shard_matches, offset, limit
+
+
+    def describe_symbols(self, name, arity):
+        return dict([(shard_name, list(query_shell.program_representation.lookup_symbols(name, arity))) for shard_name, query_shell in self.shards])
+
+
+    def get_shard_info(self):
+        shard_info = {}
+        for shard_name, query_shell in self.shards:
+            shard_info[shard_name] = (query_shell.program_path, query_shell.representation_language, query_shell.engine.query_index.count_symbols())
+        return shard_info
+
+
+    def handle_request(self, request):
+        try:
+            if request[0] == 'find':
+                return ('ok', self.find_matches(request[1]))
+            elif request[0] == 'describe':
+                return ('ok', self.describe_symbols(request[1], request[2]))
+            elif request[0] == 'info':
+                return ('ok', self.get_shard_info())
+        except SCBErrors.SCBInvalidQueryError:
+            return ('invalid', None)
+        except Exception as e:
+            return ('error', get_error_message(e))
+        return ('invalid', None)
+
+
+def get_error_message(error):
+    return '{}: {}'.format(type(error).__name__, error)
+
+
+def run_shard_worker(connection, repository_paths, shard_names, num_parse_workers, use_snapshots, result_cache_bytes, mapped):
+    # Errors are sent back instead of ending the worker
+    try:
+        shard_group = ShardGroup(repository_paths, shard_names, num_parse_workers=num_parse_workers, use_snapshots=use_snapshots,
+                                 result_cache_bytes=result_cache_bytes, mapped=mapped)
+    except SystemExit:
+        # QueryShell exits on a missing path, after printing it
+        connection.send(('error', 'loading failed'))
+        connection.close()
+        return
+    except Exception as e:
+        connection.send(('error', 'loading failed with {}'.format(get_error_message(e))))
+        connection.close()
+        return
+    connection.send(('ready', None))
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request[0] == 'exit':
+            break
+        response = shard_group.handle_request(request)
+        try:
+            connection.send(response)
+        except Exception as e:
+            connection.send(('error', get_error_message(e)))
+    connection.close()
+
+
+class Workspace:
+
+    def __init__(self, repository_paths, num_workers=0, num_parse_workers=1, use_snapshots=True, result_cache_bytes=64 * 1024 * 1024, mapped=False):
+        # num_workers is the number of processes holding shards, num_parse_workers the number of
+        # processes each shard is parsed with
+        self.repository_paths = repository_paths
+        self.shard_names = get_shard_names(repository_paths)
+        self.shard_group = None
+        # (process, connection, names of its shards) of every live worker
+        self.workers = []
+        num_workers = min(num_workers, len(repository_paths))
+        if num_workers <= 0:
+            self.shard_group = ShardGroup(repository_paths, self.shard_names, num_parse_workers=num_parse_workers, use_snapshots=use_snapshots,
+                                          result_cache_bytes=result_cache_bytes, mapped=mapped)
+            return
+        # Shards are dealt out round robin, all workers load their shards at the same time
+        for i in range(0, num_workers):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=run_shard_worker,
+                                             args=(child_connection, repository_paths[i::num_workers], self.shard_names[i::num_workers],
+                                                   num_parse_workers, use_snapshots, result_cache_bytes, mapped))
+            worker.start()
+            child_connection.close()
+            self.workers.append((worker, parent_connection, self.shard_names[i::num_workers]))
+        # Workers are not daemons, which could not start the processes that parse a shard, so they
+        # are told to exit when this process does. This runs before multiprocessing joins them, as
+        # it is registered after the first process was started.
+        atexit.register(self.close)
+        for worker_entry in list(self.workers):
+            try:
+                status, response = worker_entry[1].recv()
+            except EOFError:
+                status, response = 'error', 'worker process exited while loading'
+            if status != 'ready':
+                self.drop_worker(worker_entry, response)
+
+
+    def drop_worker(self, worker_entry, reason):
+        worker, connection, shard_names = worker_entry
+        print('ERROR - Shard(s) {} dropped from the workspace: {}'.format(', '.join(shard_names), reason))
+        self.workers.remove(worker_entry)
+        self.shard_names = [shard_name for shard_name in self.shard_names if shard_name not in shard_names]
+        connection.close()
+        worker.join(timeout=1)
+
+
+    def send_request(self, request):
+        # Every worker gets the request before any response is read, so the shards are searched in parallel
+        if self.shard_group is not None:
+            responses = [self.shard_group.handle_request(request)]
+        else:
+            sent_workers = []
+            for worker_entry in list(self.workers):
+                try:
+                    worker_entry[1].send(request)
+                    sent_workers.append(worker_entry)
+                except OSError:
+                    self.drop_worker(worker_entry, 'worker process exited')
+            responses = []
+            for worker_entry in sent_workers:
+                try:
+                    responses.append(worker_entry[1].recv())
+                except (EOFError, OSError):
+                    self.drop_worker(worker_entry, 'worker process exited')
+        for status, response in responses:
+            if status == 'error':
+                raise SCBErrors.SCBShardError(response)
+            if status != 'ok':
+                raise SCBErrors.SCBInvalidQueryError
+        return [response for status, response in responses]
+
+
+    def process_query(self, query):
+        shard_matches = {}
+        offset = 0
+        limit = None
+        for worker_matches, offset, limit in self.send_request(('find', query)):
+            shard_matches.update(worker_matches)
+        tagged_matches = []
+        for shard_name in self.shard_names:
+            tagged_matches.extend([(shard_name, term) for term in shard_matches[shard_name]])
+        if limit is not None:
+            tagged_matches = tagged_matches[offset:offset + limit]
+        else:
+            tagged_matches = tagged_matches[offset:]
+        shard_counts = dict([(shard_name, 0) for shard_name in self.shard_names])
+        for shard_name, term in tagged_matches:
+            shard_counts[shard_name] = shard_counts[shard_name] + 1
+        return WorkspaceQueryResult(query, tagged_matches, shard_counts)
+
+
+    def describe_symbols(self, name, arity=-1):
+        shard_symbols = {}
+        for worker_symbols in self.send_request(('describe', name, arity)):
+            shard_symbols.update(worker_symbols)
+        return [(shard_name, term) for shard_name in self.shard_names for term in shard_symbols[shard_name]]
+
+
+    def get_shard_info(self):
+        shard_info = {}
+        for worker_info in self.send_request(('info',)):
+            shard_info.update(worker_info)
+        return [(shard_name,) + shard_info[shard_name] for shard_name in self.shard_names]
+
+
+    def close(self):
+        for worker, connection, shard_names in self.workers:
+            try:
+                connection.send(('exit',))
+            except OSError:
+                pass
+            connection.close()
+        for worker, connection, shard_names in self.workers:
+            worker.join()
+        self.workers = []
+
+
+    def print_workspace_info(self):
+        print('\nWorkspace of {} shard(s) in {} worker process(es):'.format(len(self.shard_names), max(1, len(self.workers))))
+        for shard_name, program_path, language, num_symbols in self.get_shard_info():
+            print(' - {}: {} {} program, {} symbol(s) - {}'.format(shard_name, language, 'Module' if os.path.isdir(program_path) else 'Single-File',
+                                                                  num_symbols, program_path))
+
+
+    def run_shell(self):
+        print('Welcome to the Semantic Code Browsing Workspace Shell. Queries are run against all {} shard(s).'.format(len(self.shard_names)))
+        print('Use workspace info. to list the shards, describe NAME/ARITY. to describe a symbol, and exit. to quit.\n')
+        try:
+            query = None
+            while query != 'exit.':
+                query = input('SCB Workspace > ')
+                while not query.endswith('.'):
+                    query = query + ' ' + input('> ')
+                try:
+                    if query == 'exit.':
+                        pass
+                    elif query == 'workspace info.':
+                        self.print_workspace_info()
+                    elif query.startswith('describe'):
+                        symbol = query.split(' ')[1][:-1]
+                        arity = -1
+                        if '/' in symbol:
+                            arity = int(symbol.split('/')[1])
+                            symbol = symbol.split('/')[0]
+                        tagged_symbols = self.describe_symbols(symbol, arity)
+                        for shard_name, term in tagged_symbols:
+                            print('[{}]'.format(shard_name))
+                            term.print_term()
+                        print('\n{} Matching result(s) found.'.format(len(tagged_symbols)))
+                    else:
+                        self.process_query(query).print_result()
+                except (SCBErrors.SCBInvalidQueryError, IndexError, ValueError):
+                    print('Syntax Error - The entered query was not parsable!')
+                except SCBErrors.SCBShardError as e:
+                    print('ERROR - Query failed in a shard: {}'.format(e))
+        except KeyboardInterrupt:
+            pass
+        print('Exiting...')
+        self.close()
@@ -0,0 +1,53 @@
+import os
+import io
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'larger_example.c')
+
+
+class TestNameAssertions(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.previous_dir = os.getcwd()
+        os.chdir(cls.work_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.query_shell = QUERY_ENGINE.QueryShell(EXAMPLE_PATH, use_snapshots=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.previous_dir)
+        shutil.rmtree(cls.work_dir)
+
+    def get_match_names(self, query):
+        batch_result = self.query_shell.run_batch_query(query)
+        return [match['name'] for match in batch_result['matches']]
+
+    def test_glob(self):
+        self.assertEqual(self.get_match_names('find function where name:search_* and returns:int*.'), ['search_by_name', 'search_by_major'])
+
+    def test_regex_uppercase_escapes(self):
+        by_names = ['search_by_id', 'search_by_name', 'search_by_major']
+        self.assertEqual(self.get_match_names(r'find function where name:/\S+_by_\w+/.'), by_names)
+        self.assertEqual(self.get_match_names(r'find function where name:/\D+_by_\w+/.'), by_names)
+        self.assertEqual(self.get_match_names(r'find function where name:/\Asearch_by_i\w\Z/.'), ['search_by_id'])
+        self.assertEqual(self.get_match_names(r'find function where name:/\s+_by_\w+/.'), [])
+
+    def test_regex_ignores_case(self):
+        self.assertEqual(self.get_match_names('find function where name:/FREE_[A-Z]+/.'), ['free_list'])
+
+    def test_invalid_regex(self):
+        self.assertIn('error', self.query_shell.run_batch_query('find function where name:/search_(/.'))
+
+
+if __name__ == '__main__':
+    unittest.main()
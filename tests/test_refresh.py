@@ -0,0 +1,86 @@
+import os
+import io
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+import benchmarks.generators as GENERATORS
+
+
+def load_shell(program_path):
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return QUERY_ENGINE.QueryShell(program_path, use_snapshots=False)
+
+
+def write_file(file_path, lines):
+    with open(file_path, 'w') as file_fp:
+        file_fp.write(''.join(lines))
+    # Refreshes compare mtimes, which can be too coarse to tell two writes apart
+    file_stat = os.stat(file_path)
+    os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10 ** 9))
+
+
+class TestRefresh(unittest.TestCase):
+    # A refreshed program must hold the same symbols, with the same types, as a fresh load of the same
+    # files. Clauses of one predicate spread over files with conflicting argument types make the
+    # reconciled types depend on clause order.
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.previous_dir = os.getcwd()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir)
+
+    def get_matches(self, query_shell, query):
+        return sorted([repr(match) for match in query_shell.run_batch_query(query)['matches']])
+
+    def assert_refresh_matches_fresh_load(self, program_path, queries, edits):
+        query_shell = load_shell(program_path)
+        for edit in edits:
+            edit()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                query_shell.refresh_program()
+            fresh_shell = load_shell(program_path)
+            for query in queries:
+                self.assertEqual(self.get_matches(query_shell, query), self.get_matches(fresh_shell, query), query)
+
+    def test_prolog_conflicting_types(self):
+        queries = ['find predicate.', 'find predicate where reaches:pred_3.', 'find predicate/2 where inputs:atom,atom.']
+        for seed in range(0, 4):
+            program_path = os.path.join(self.work_dir, 'prolog_{}'.format(seed))
+            os.makedirs(os.path.join(program_path, 'sub'))
+            file_paths = [os.path.join(program_path, 'f0.pl'), os.path.join(program_path, 'f1.pl'),
+                          os.path.join(program_path, 'sub', 'f2.pl'), os.path.join(program_path, 'z.pl')]
+            for i, file_path in enumerate(file_paths[:3]):
+                write_file(file_path, GENERATORS.generate_prolog_program(60, seed=seed * 10 + i, num_predicates=10))
+            self.assert_refresh_matches_fresh_load(program_path, queries, [
+                lambda: write_file(file_paths[1], GENERATORS.generate_prolog_program(60, seed=seed * 10 + 7, num_predicates=10)),
+                lambda: write_file(file_paths[3], GENERATORS.generate_prolog_program(60, seed=seed * 10 + 8, num_predicates=10)),
+                lambda: os.remove(file_paths[0]),
+                lambda: write_file(file_paths[0], GENERATORS.generate_prolog_program(60, seed=seed * 10 + 9, num_predicates=10)),
+            ])
+
+    def test_c_function_order(self):
+        queries = ['find function.', 'find function where calls:function_12.', 'find function/1 where inputs:int.']
+        program_path = os.path.join(self.work_dir, 'c')
+        os.makedirs(program_path)
+        file_paths = [os.path.join(program_path, 'f{}.c'.format(i)) for i in range(0, 4)]
+        for i, file_path in enumerate(file_paths[:3]):
+            write_file(file_path, GENERATORS.generate_c_program(20, seed=i, first_function=i * 8))
+        self.assert_refresh_matches_fresh_load(program_path, queries, [
+            lambda: write_file(file_paths[1], GENERATORS.generate_c_program(20, seed=7, first_function=4)),
+            lambda: write_file(file_paths[3], GENERATORS.generate_c_program(20, seed=8, first_function=2)),
+            lambda: os.remove(file_paths[0]),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
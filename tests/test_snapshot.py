@@ -0,0 +1,130 @@
+import os
+import io
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_browsing.query_engine as QUERY_ENGINE
+import code_browsing.program_parser as PARSER
+import code_browsing.snapshot as SNAPSHOT
+import benchmarks.generators as GENERATORS
+
+
+def load_shell(program_path, use_snapshots=True):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+        query_shell = QUERY_ENGINE.QueryShell(program_path, use_snapshots=use_snapshots)
+    return query_shell, output.getvalue()
+
+
+def write_file(file_path, lines):
+    with open(file_path, 'w') as file_fp:
+        file_fp.write(''.join(lines))
+    # Snapshots are keyed on mtimes, which can be too coarse to tell two writes apart
+    file_stat = os.stat(file_path)
+    os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10 ** 9))
+
+
+class TestSnapshot(unittest.TestCase):
+    # A program loaded from its snapshot, or from a stale snapshot updated in place, must answer
+    # queries as a fresh parse of the same files does
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.previous_cache_dir = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.work_dir, 'cache')
+        self.program_path = os.path.join(self.work_dir, 'program')
+        os.makedirs(os.path.join(self.program_path, 'sub'))
+        self.file_paths = [os.path.join(self.program_path, 'f0.pl'), os.path.join(self.program_path, 'f1.pl'),
+                           os.path.join(self.program_path, 'sub', 'f2.pl')]
+        for i, file_path in enumerate(self.file_paths):
+            write_file(file_path, GENERATORS.generate_prolog_program(60, seed=i, num_predicates=10))
+
+    def tearDown(self):
+        if self.previous_cache_dir is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.previous_cache_dir
+        shutil.rmtree(self.work_dir)
+
+    def get_matches(self, query_shell, query):
+        return sorted([repr(match) for match in query_shell.run_batch_query(query)['matches']])
+
+    def assert_same_matches(self, query_shell, fresh_shell):
+        for query in ['find predicate.', 'find predicate where reaches:pred_3.', 'find predicate/2 where inputs:atom,atom.']:
+            self.assertEqual(self.get_matches(query_shell, query), self.get_matches(fresh_shell, query), query)
+
+    def test_round_trip(self):
+        parsed_shell, output = load_shell(self.program_path)
+        self.assertIn('Parsed 3 file(s)', output)
+        snapshot_path = SNAPSHOT.get_snapshot_path(self.program_path)
+        self.assertTrue(os.path.exists(snapshot_path))
+        self.assertEqual(stat.S_IMODE(os.stat(snapshot_path).st_mode), 0o600)
+
+        loaded_shell, output = load_shell(self.program_path)
+        self.assertNotIn('Parsed', output)
+        self.assertIsNotNone(loaded_shell.engine.query_index)
+        self.assertEqual(loaded_shell.engine.query_index.count_symbols(), parsed_shell.engine.query_index.count_symbols())
+        self.assert_same_matches(loaded_shell, parsed_shell)
+
+    def test_stale_snapshot_refreshed_in_place(self):
+        load_shell(self.program_path)
+        write_file(self.file_paths[1], GENERATORS.generate_prolog_program(60, seed=7, num_predicates=10))
+        os.remove(self.file_paths[2])
+        write_file(os.path.join(self.program_path, 'f3.pl'), GENERATORS.generate_prolog_program(60, seed=8, num_predicates=10))
+
+        stale_shell, output = load_shell(self.program_path)
+        self.assertIn('Updated snapshot: 1 changed, 1 added, 1 deleted file(s).', output)
+        fresh_shell, output = load_shell(self.program_path, use_snapshots=False)
+        self.assert_same_matches(stale_shell, fresh_shell)
+
+        # The updated snapshot was saved again and now loads as is
+        loaded_shell, output = load_shell(self.program_path)
+        self.assertEqual(output, '')
+        self.assert_same_matches(loaded_shell, fresh_shell)
+
+    def get_signature(self):
+        return SNAPSHOT.get_source_signature(PARSER.create_parser(self.program_path).get_program_files(self.program_path))
+
+    def test_rejected_snapshots(self):
+        load_shell(self.program_path)
+        snapshot_path = SNAPSHOT.get_snapshot_path(self.program_path)
+        signature = self.get_signature()
+        self.assertIsNotNone(SNAPSHOT.load_snapshot(self.program_path, signature)[0])
+
+        # Changed sources are only loaded as a stale snapshot
+        write_file(self.file_paths[0], GENERATORS.generate_prolog_program(60, seed=9, num_predicates=10))
+        self.assertEqual(SNAPSHOT.load_snapshot(self.program_path, self.get_signature()), (None, None))
+        self.assertIsNotNone(SNAPSHOT.load_snapshot(self.program_path, self.get_signature(), allow_stale=True)[0])
+
+        # A snapshot that other users could have written is not unpickled
+        os.chmod(snapshot_path, 0o620)
+        self.assertEqual(SNAPSHOT.load_snapshot(self.program_path, signature), (None, None))
+        os.chmod(snapshot_path, 0o600)
+
+        # Nor is a snapshot of another program copied over this one's
+        other_path = os.path.join(self.work_dir, 'other')
+        shutil.copytree(self.program_path, other_path)
+        shutil.copyfile(snapshot_path, SNAPSHOT.get_snapshot_path(other_path))
+        os.chmod(SNAPSHOT.get_snapshot_path(other_path), 0o600)
+        self.assertEqual(SNAPSHOT.load_snapshot(other_path, signature, allow_stale=True), (None, None))
+
+        # A truncated or foreign file is ignored and the program is parsed again
+        with open(snapshot_path, 'rb') as snapshot_fp:
+            snapshot_bytes = snapshot_fp.read()
+        with open(snapshot_path, 'wb') as snapshot_fp:
+            snapshot_fp.write(snapshot_bytes[:len(snapshot_bytes) // 2])
+        self.assertEqual(SNAPSHOT.load_snapshot(self.program_path, signature, allow_stale=True), (None, None))
+        with open(snapshot_path, 'wb') as snapshot_fp:
+            snapshot_fp.write(b'not a snapshot')
+        query_shell, output = load_shell(self.program_path)
+        self.assertIn('Parsed 3 file(s)', output)
+
+
+if __name__ == '__main__':
+    unittest.main()